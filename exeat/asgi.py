@@ -3,6 +3,11 @@ ASGI config for exeat project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+Long-lived streaming endpoints such as the exeat event feed
+(/api/exeat-events/) should be served through this app with an ASGI server,
+e.g. ``uvicorn exeat.asgi:application``, so idle connections do not each
+hold a worker thread.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/4.2/howto/deployment/asgi/
 """
@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,10 +44,13 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'exeat_app.middleware.LoadSheddingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'exeat_app.db_routing.DatabaseRoutingMiddleware',
+    'exeat_app.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -87,6 +90,38 @@ DATABASES = {
     }
 }
 
+# Read replicas: one alias per host in DB_REPLICA_HOSTS (same name/credentials
+# as the primary). Read-only API views read from them, see db_routing.py.
+DATABASE_REPLICAS = []
+for _index, _host in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv())):
+    _alias = f'replica_{_index + 1}'
+    DATABASES[_alias] = {**DATABASES['default'], 'HOST': _host, 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(_alias)
+
+# School shards: one alias per "[name@]host" entry in DB_SHARD_HOSTS (same
+# credentials as the primary). 'default' is always a shard and also holds
+# the shard map; see db_routing.py and the move_school_shard command.
+DATABASE_SHARDS = ['default']
+for _index, _entry in enumerate(config('DB_SHARD_HOSTS', default='', cast=Csv())):
+    _name, _, _host = _entry.rpartition('@')
+    _alias = f'shard_{_index + 1}'
+    DATABASES[_alias] = {**DATABASES['default'], 'HOST': _host, 'NAME': _name or DATABASES['default']['NAME']}
+    DATABASE_SHARDS.append(_alias)
+
+# IDs allocated on shard N start at N * SHARD_ID_BLOCK so rows keep their
+# primary keys when a school moves between shards
+SHARD_ID_BLOCK = 10 ** 12
+
+# How long a school's shard is cached. move_school_shard only clears the
+# entry in a shared cache, so with LocMemCache keep the school's writes
+# paused this long after a move.
+SHARD_MAP_CACHE_SECONDS = config('SHARD_MAP_CACHE_SECONDS', default=60, cast=int)
+
+DATABASE_ROUTERS = ['exeat_app.db_routing.ShardReplicaRouter']
+
+# Seconds a user's reads stay on the primary after they write
+REPLICA_STICKY_SECONDS = config('REPLICA_STICKY_SECONDS', default=10, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -131,6 +166,17 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Uploads stream to a temporary file while being hashed (see exeat_app/uploads.py)
+FILE_UPLOAD_HANDLERS = ['exeat_app.uploads.PhotoUploadHandler']
+PHOTO_MAX_BYTES = config('PHOTO_MAX_BYTES', default=5 * 1024 * 1024, cast=int)
+PHOTO_MAX_DIMENSION = config('PHOTO_MAX_DIMENSION', default=4096, cast=int)
+
+# How student photos are sent: 'django', or handed to the web server with
+# 'x-accel-redirect' (nginx, internal location MEDIA_ACCEL_PREFIX aliased
+# to MEDIA_ROOT) or 'x-sendfile' (Apache mod_xsendfile, lighttpd)
+MEDIA_SERVING = config('MEDIA_SERVING', default='django')
+MEDIA_ACCEL_PREFIX = config('MEDIA_ACCEL_PREFIX', default='/protected-media/')
+
 # Email settings
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # For development, prints to console
 # For production, use SMTP:
@@ -142,9 +188,125 @@ EMAIL_HOST_USER = config('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = 'Exeat System'
 
+# Cache
+# Throttle counters must be shared by every worker, so point this at Redis or
+# Memcached in production (e.g. django.core.cache.backends.redis.RedisCache).
+# With the default local memory cache every rate limit is per process.
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='exeat'),
+    }
+}
+
+# REST framework
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'exeat_app.renderers.ORJSONRenderer',
+        'exeat_app.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'exeat_app.renderers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_CONTENT_NEGOTIATION_CLASS': 'exeat_app.renderers.StaffBrowsableNegotiation',
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'exeat_app.authentication.SignedTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'exeat_app.throttling.IPRateThrottle',
+        'exeat_app.throttling.UserRateThrottle',
+        'exeat_app.throttling.SchoolRateThrottle',
+        'exeat_app.throttling.GateRateThrottle',
+    ],
+    'DEFAULT_THROTTLE_RATES': {
+        'ip': config('THROTTLE_RATE_IP', default='300/min'),
+        'user': config('THROTTLE_RATE_USER', default='600/min'),
+        'school': config('THROTTLE_RATE_SCHOOL', default='6000/min'),
+        # Gate sign out/in and sync only count here, not against ip/user/school
+        'gate': config('THROTTLE_RATE_GATE', default='600/min'),
+        'password_reset': config('THROTTLE_RATE_PASSWORD_RESET', default='5/hour'),
+        'login': config('THROTTLE_RATE_LOGIN', default='20/min'),
+    },
+}
+
+# Load shedding: requests in flight per process before low / normal priority
+# traffic is turned away with 503. Gate sign out/in is never shed.
+LOAD_SHED_LOW_INFLIGHT = config('LOAD_SHED_LOW_INFLIGHT', default=32, cast=int)
+LOAD_SHED_NORMAL_INFLIGHT = config('LOAD_SHED_NORMAL_INFLIGHT', default=64, cast=int)
+LOAD_SHED_RETRY_AFTER = config('LOAD_SHED_RETRY_AFTER', default=5, cast=int)
+
+# One-time passcodes (stored in the cache, never on the user row)
+OTP_TTL_SECONDS = config('OTP_TTL_SECONDS', default=300, cast=int)
+OTP_MAX_ATTEMPTS = config('OTP_MAX_ATTEMPTS', default=5, cast=int)
+
+# Signed API tokens (seconds)
+ACCESS_TOKEN_LIFETIME = config('ACCESS_TOKEN_LIFETIME', default=900, cast=int)
+REFRESH_TOKEN_LIFETIME = config('REFRESH_TOKEN_LIFETIME', default=7 * 86400, cast=int)
+
+# Seconds a create response is kept for replay under its Idempotency-Key
+IDEMPOTENCY_KEY_TTL = config('IDEMPOTENCY_KEY_TTL', default=86400, cast=int)
+
+# Background jobs (manage.py run_jobs): seconds an idle worker waits between
+# polls, first retry delay (doubling per attempt up to the max), seconds
+# before a running job whose worker went quiet is requeued, and days
+# finished jobs are kept
+JOB_POLL_INTERVAL = config('JOB_POLL_INTERVAL', default=1.0, cast=float)
+JOB_RETRY_BASE_SECONDS = config('JOB_RETRY_BASE_SECONDS', default=10, cast=int)
+JOB_RETRY_MAX_SECONDS = config('JOB_RETRY_MAX_SECONDS', default=3600, cast=int)
+JOB_TIMEOUT_SECONDS = config('JOB_TIMEOUT_SECONDS', default=1800, cast=int)
+JOB_KEEP_DAYS = config('JOB_KEEP_DAYS', default=7, cast=int)
+
+# Seconds between the periodic overdue sweep and legacy OTP cleanup jobs
+OVERDUE_SWEEP_SECONDS = config('OVERDUE_SWEEP_SECONDS', default=60, cast=int)
+LEGACY_OTP_SWEEP_SECONDS = config('LEGACY_OTP_SWEEP_SECONDS', default=3600, cast=int)
+
+# Seconds the lateness analytics for a school/term are cached
+ANALYTICS_CACHE_TIMEOUT = config('ANALYTICS_CACHE_TIMEOUT', default=600, cast=int)
+
+# Seconds the staff per-school rollup is cached (sorting and paging reuse it)
+ROLLUP_CACHE_TIMEOUT = config('ROLLUP_CACHE_TIMEOUT', default=60, cast=int)
+
+# Gate sync holds back events younger than this so one committed late is not skipped
+GATE_SYNC_SETTLE_SECONDS = config('GATE_SYNC_SETTLE_SECONDS', default=2, cast=int)
+
+# Seconds a built gate manifest is served from the cache before being rebuilt
+GATE_MANIFEST_TIMEOUT = config('GATE_MANIFEST_TIMEOUT', default=900, cast=int)
+
+# Request profiles (X-Profile: 1, staff only): where they are written, how
+# many are kept and the milliseconds between stack samples
+PROFILE_DIR = config('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILE_KEEP = config('PROFILE_KEEP', default=100, cast=int)
+PROFILE_INTERVAL_MS = config('PROFILE_INTERVAL_MS', default=5, cast=int)
+
+# Statements taking this many milliseconds or more are captured for
+# `manage.py slow_queries` (0 turns capture off), with an EXPLAIN plan for
+# this fraction of them, in a ring buffer of SLOW_QUERY_BUFFER entries
+SLOW_QUERY_MS = config('SLOW_QUERY_MS', default=200, cast=int)
+SLOW_QUERY_EXPLAIN_RATE = config('SLOW_QUERY_EXPLAIN_RATE', default=0.01, cast=float)
+SLOW_QUERY_BUFFER = config('SLOW_QUERY_BUFFER', default=500, cast=int)
+
 # Authentication settings
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/'
 
+# Sessions are read from the cache and written through to the database, and
+# the session user (with its role profile) is cached by CachedModelBackend
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+AUTHENTICATION_BACKENDS = ['exeat_app.backends.CachedModelBackend']
+AUTH_USER_CACHE_TIMEOUT = config('AUTH_USER_CACHE_TIMEOUT', default=300, cast=int)
+
 
 AUTH_USER_MODEL = 'exeat_app.CustomUser'
+
+# Live exeat event stream (Server-Sent Events)
+# Seconds between polls of the event table by each worker's broadcaster
+EXEAT_EVENT_POLL_INTERVAL = config('EXEAT_EVENT_POLL_INTERVAL', default=2.0, cast=float)
+# Events are only sent once this many seconds old, so ones committed out of
+# id order aren't skipped
+EXEAT_EVENT_SETTLE_SECONDS = config('EXEAT_EVENT_SETTLE_SECONDS', default=2, cast=int)
+# Seconds of silence before a keepalive comment is sent to idle clients
+EXEAT_EVENT_KEEPALIVE = config('EXEAT_EVENT_KEEPALIVE', default=15, cast=int)
@@ -1,6 +1,55 @@
-from django.contrib import admin
+from collections import Counter, defaultdict
+
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.html import format_html
-from .models import Student, Exeat, HouseMistress, House, School, SubAdmin, SecurityPerson
+from .conflicts import is_overlap_violation
+from .events import record_events
+from .models import AbsenceQuota, Job, Student, Exeat, HouseMistress, House, School, SubAdmin, SecurityPerson
+from .quotas import QuotaExceeded, release_slots, take_slots
+
+
+# Rows per UPDATE when a bulk action runs over a large selection
+ACTION_CHUNK_SIZE = 1000
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Uses the planner's row estimate instead of COUNT(*) for unfiltered
+    changelists on large tables. Filtered lists still get an exact count.
+    """
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            connection = connections[queryset.db]
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                        [queryset.model._meta.db_table]
+                    )
+                    row = cursor.fetchone()
+                if row and row[0] >= self.exact_count_threshold:
+                    return row[0]
+        return super().count
+
+
+def _chunked_pks(queryset):
+    """Yield lists of primary keys from a queryset, ACTION_CHUNK_SIZE at a time"""
+    chunk = []
+    for pk in queryset.values_list('pk', flat=True).order_by('pk').iterator(chunk_size=ACTION_CHUNK_SIZE):
+        chunk.append(pk)
+        if len(chunk) == ACTION_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
 
 
 #  SCHOOL ADMIN 
@@ -42,6 +91,8 @@ class SubAdminAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at', 'updated_at', 'user')
+    list_select_related = ('user', 'school')
+    autocomplete_fields = ('school',)
 
     def get_user_name(self, obj):
         return obj.user.get_full_name() or obj.user.username
@@ -65,6 +116,17 @@ class HouseAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at', 'updated_at')
+    list_select_related = ('school',)
+    autocomplete_fields = ('school',)
+
+
+@admin.register(AbsenceQuota)
+class AbsenceQuotaAdmin(admin.ModelAdmin):
+    list_display = ('school', 'house', 'capacity', 'used', 'updated_at')
+    list_filter = ('school',)
+    readonly_fields = ('used', 'updated_at')
+    list_select_related = ('school', 'house')
+    autocomplete_fields = ('school', 'house')
 
 
 #STUDENT ADMIN
@@ -93,6 +155,10 @@ class StudentAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at', 'updated_at', 'user')
+    list_select_related = ('school', 'house__school')
+    autocomplete_fields = ('school', 'house')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 # HOUSE MISTRESS ADMIN 
@@ -118,6 +184,8 @@ class HouseMistressAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at', 'updated_at', 'user')
+    list_select_related = ('school', 'house__school')
+    autocomplete_fields = ('school', 'house')
 
 
 # SECURITY PERSON ADMIN 
@@ -140,6 +208,8 @@ class SecurityPersonAdmin(admin.ModelAdmin):
         }),
     )
     readonly_fields = ('created_at', 'updated_at', 'user')
+    list_select_related = ('school',)
+    autocomplete_fields = ('school',)
 
 
 # EXEAT ADMIN
@@ -172,14 +242,116 @@ class ExeatAdmin(admin.ModelAdmin):
     )
     readonly_fields = ('created_at', 'updated_at')
     ordering = ('-created_at',)
+    list_select_related = ('school', 'student__school')
+    autocomplete_fields = ('school', 'student')
+    raw_id_fields = ('approved_by', 'signed_out_by', 'signed_in_by')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     actions = ['approve_exeats', 'reject_exeats']
 
     def approve_exeats(self, request, queryset):
-        queryset.update(status='approved')
-        self.message_user(request, f'Approved {queryset.count()} exeats.')
+        # Exeats that are already out or back are left alone
+        queryset = queryset.filter(status__in=['pending', 'rejected'])
+        approved = overlapping = over_quota = 0
+        for pks in _chunked_pks(queryset):
+            try:
+                done, full = self._approve(request, pks, queryset.db)
+            except IntegrityError as exc:
+                if not is_overlap_violation(exc):
+                    raise
+                # A re-approved exeat overlaps another one: go row by row
+                done = full = 0
+                for pk in pks:
+                    try:
+                        one, one_full = self._approve(request, [pk], queryset.db)
+                    except IntegrityError as exc:
+                        if not is_overlap_violation(exc):
+                            raise
+                        overlapping += 1
+                        continue
+                    done += one
+                    full += one_full
+            approved += done
+            over_quota += full
+        self.message_user(request, f'Approved {approved} exeats.')
+        if overlapping:
+            self.message_user(
+                request, f'Skipped {overlapping} exeats that overlap another active exeat.', messages.WARNING
+            )
+        if over_quota:
+            self.message_user(
+                request, f'Skipped {over_quota} exeats whose house or school absence quota is full.',
+                messages.WARNING
+            )
     approve_exeats.short_description = 'Approve selected exeats'
 
+    def _approve(self, request, pks, using):
+        """Approve a chunk on the given shard; returns (approved, skipped because a quota is full)"""
+        with transaction.atomic(using=using):
+            rows = list(
+                Exeat.objects.using(using).select_for_update(of=('self',))
+                .filter(pk__in=pks, status__in=['pending', 'rejected'])
+                .values_list('pk', 'school_id', 'student_id', 'student__house_id', 'quota_held')
+            )
+            # Take quota slots a house at a time, all or nothing per house
+            by_house = defaultdict(list)
+            for row in rows:
+                by_house[row[1], row[3]].append(row)
+            approved_rows = []
+            full = 0
+            for (school_id, house_id), house_rows in by_house.items():
+                needed = sum(1 for row in house_rows if not row[4])
+                try:
+                    with transaction.atomic(using=using):
+                        if needed:
+                            take_slots(school_id, house_id, count=needed, using=using)
+                except QuotaExceeded:
+                    full += len(house_rows)
+                    continue
+                approved_rows.extend(row[:4] for row in house_rows)
+
+            approved = Exeat.objects.using(using).filter(pk__in=[row[0] for row in approved_rows]).update(
+                status='approved', approved_by=request.user, quota_held=True, updated_at=timezone.now()
+            )
+            record_events(approved_rows, 'approved', actor=request.user, using=using)
+        return approved, full
+
     def reject_exeats(self, request, queryset):
-        queryset.update(status='rejected')
-        self.message_user(request, f'Rejected {queryset.count()} exeats.')
-    reject_exeats.short_description = 'Reject selected exeats'
\ No newline at end of file
+        queryset = queryset.filter(status__in=['pending', 'approved'])
+        rejected = 0
+        for pks in _chunked_pks(queryset):
+            with transaction.atomic(using=queryset.db):
+                exeats = Exeat.objects.using(queryset.db).filter(pk__in=pks, status__in=['pending', 'approved'])
+                rows = list(
+                    exeats.select_for_update(of=('self',))
+                    .values_list('id', 'school_id', 'student_id', 'student__house_id', 'quota_held')
+                )
+                # Hand back the quota slots held by approved exeats
+                held = Counter((row[1], row[3]) for row in rows if row[4])
+                for (school_id, house_id), count in held.items():
+                    release_slots(school_id, house_id, count=count, using=queryset.db)
+                rejected += Exeat.objects.using(queryset.db).filter(pk__in=[row[0] for row in rows]).update(
+                    status='rejected', quota_held=False, updated_at=timezone.now()
+                )
+                record_events([row[:4] for row in rows], 'rejected', actor=request.user, using=queryset.db)
+        self.message_user(request, f'Rejected {rejected} exeats.')
+    reject_exeats.short_description = 'Reject selected exeats'
+
+
+# JOB ADMIN
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'priority', 'run_at', 'attempts', 'locked_by', 'finished_at')
+    list_filter = ('status', 'name', 'periodic')
+    readonly_fields = ('attempts', 'locked_by', 'locked_at', 'created_at', 'finished_at', 'last_error')
+    ordering = ('-created_at',)
+    actions = ['retry_jobs']
+
+    def retry_jobs(self, request, queryset):
+        # Periodic jobs already have their next run queued
+        retried = queryset.filter(status='failed', periodic=False).update(
+            status='queued', attempts=0, run_at=timezone.now(), finished_at=None
+        )
+        self.message_user(request, f'Queued {retried} jobs to run again.')
+    retry_jobs.short_description = 'Retry selected failed jobs'
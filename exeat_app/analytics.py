@@ -0,0 +1,195 @@
+"""
+Lateness and absence analytics.
+
+The timestamps for a school's exeats (optionally limited to a term) are
+pulled as plain columns with values_list and analysed with NumPy: lateness
+distribution and percentiles, per-student and per-house outliers, and a
+weekday/hour heatmap of departures. Grouping is done with np.unique and
+np.bincount, so there are no Python loops over exeats and a million rows
+take well under a second once loaded.
+"""
+from datetime import datetime, time, timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import FloatField
+from django.db.models.functions import Cast, Extract, ExtractHour, ExtractIsoWeekDay
+from django.utils import timezone
+
+from .db_routing import shard_for_school
+from .models import Exeat, House, Student
+
+# Returns later than this past end_date count as late
+LATE_GRACE_HOURS = 0.25
+# Lateness histogram bucket edges, in hours; the first bucket starts at the grace period
+LATENESS_BUCKETS = [LATE_GRACE_HOURS, 1, 3, 6, 12, 24, 48, 168, np.inf]
+PERCENTILES = [50, 75, 90, 95, 99]
+# Modified z-score above which a student counts as an outlier
+OUTLIER_Z = 3.5
+# Students need at least this many late returns to be flagged as chronic
+MIN_LATE_RETURNS = 3
+MAX_FLAGGED = 50
+
+# Column order of load_columns()
+STUDENT, HOUSE, START, END, OUT, IN, WEEKDAY, HOUR = range(8)
+
+
+def _epoch(field):
+    return Cast(Extract(field, 'epoch'), FloatField())
+
+
+def load_columns(school_id, term_start=None, term_end=None):
+    """Signed out exeats as an (n, 8) float array, NaN where a value is missing"""
+    exeats = Exeat.objects.using(shard_for_school(school_id)).filter(
+        school_id=school_id, signed_out_time__isnull=False
+    )
+    if term_start:
+        exeats = exeats.filter(start_date__gte=timezone.make_aware(datetime.combine(term_start, time.min)))
+    if term_end:
+        exeats = exeats.filter(
+            start_date__lt=timezone.make_aware(datetime.combine(term_end + timedelta(days=1), time.min))
+        )
+    rows = exeats.order_by().annotate(
+        start_ts=_epoch('start_date'),
+        end_ts=_epoch('end_date'),
+        out_ts=_epoch('signed_out_time'),
+        in_ts=_epoch('signed_in_time'),
+        weekday=ExtractIsoWeekDay('signed_out_time'),
+        hour=ExtractHour('signed_out_time'),
+    ).values_list('student_id', 'student__house_id', 'start_ts', 'end_ts', 'out_ts', 'in_ts', 'weekday', 'hour')
+    return np.array(list(rows), dtype=np.float64).reshape(-1, 8)
+
+
+def _percentiles(values):
+    if not len(values):
+        return {f'p{p}': None for p in PERCENTILES}
+    return {f'p{p}': round(float(v), 2) for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))}
+
+
+def _robust_z(values):
+    """Modified z-score (median/MAD); anything above a zero-MAD median scores inf"""
+    median = np.median(values)
+    mad = np.median(np.abs(values - median))
+    if mad == 0:
+        return np.where(values > median, np.inf, 0.0)
+    return 0.6745 * (values - median) / mad
+
+
+def analyse(columns, now=None):
+    """Statistics for the columns from load_columns(); ids in the result are database ids"""
+    now = (now or timezone.now()).timestamp()
+    total = len(columns)
+    returned = ~np.isnan(columns[:, IN])
+    # Students still out are measured against now
+    lateness = (np.where(returned, columns[:, IN], now) - columns[:, END]) / 3600
+    late = lateness > LATE_GRACE_HOURS
+    departure_delay = (columns[:, OUT] - columns[:, START]) / 3600
+    days_away = (np.where(returned, columns[:, IN], now) - columns[:, OUT]) / 86400
+    late_hours = lateness[late]
+
+    edges = LATENESS_BUCKETS
+    counts, _ = np.histogram(late_hours, bins=edges)
+    distribution = [
+        {'from_hours': edges[i], 'to_hours': None if np.isinf(edges[i + 1]) else edges[i + 1], 'count': int(c)}
+        for i, c in enumerate(counts)
+    ]
+
+    students, student_idx = np.unique(columns[:, STUDENT].astype(np.int64), return_inverse=True)
+    per_student = np.bincount(student_idx, minlength=len(students))
+    student_late = np.bincount(student_idx, weights=late, minlength=len(students))
+    student_late_hours = np.bincount(student_idx, weights=np.where(late, lateness, 0), minlength=len(students))
+    student_days = np.bincount(student_idx, weights=days_away, minlength=len(students))
+    late_rate = np.divide(student_late, per_student, out=np.zeros(len(students)), where=per_student > 0)
+    chronic = (student_late >= MIN_LATE_RETURNS) & (_robust_z(late_rate) > OUTLIER_Z) if total else np.zeros(0, bool)
+    long_absence = _robust_z(student_days) > OUTLIER_Z if total else np.zeros(0, bool)
+
+    flagged = np.flatnonzero(chronic | long_absence)
+    flagged = flagged[np.argsort(-student_late[flagged], kind='stable')][:MAX_FLAGGED]
+    flagged_students = [
+        {
+            'student_id': int(students[i]),
+            'exeats': int(per_student[i]),
+            'late_returns': int(student_late[i]),
+            'late_rate': round(float(late_rate[i]), 3),
+            'mean_late_hours': round(float(student_late_hours[i] / student_late[i]), 2) if student_late[i] else 0.0,
+            'days_away': round(float(student_days[i]), 2),
+            'chronic_late': bool(chronic[i]),
+            'long_absence': bool(long_absence[i]),
+        }
+        for i in flagged
+    ]
+
+    house_ids = np.nan_to_num(columns[:, HOUSE], nan=-1).astype(np.int64)
+    houses, house_idx = np.unique(house_ids, return_inverse=True)
+    per_house = np.bincount(house_idx, minlength=len(houses))
+    house_late = np.bincount(house_idx, weights=late, minlength=len(houses))
+    house_late_hours = np.bincount(house_idx, weights=np.where(late, lateness, 0), minlength=len(houses))
+    house_rate = np.divide(house_late, per_house, out=np.zeros(len(houses)), where=per_house > 0)
+    if len(houses) >= 3 and house_rate.std() > 0:
+        house_outlier = (house_rate - house_rate.mean()) / house_rate.std() > 2
+    else:
+        house_outlier = np.zeros(len(houses), bool)
+    per_house_stats = [
+        {
+            'house_id': None if houses[i] == -1 else int(houses[i]),
+            'exeats': int(per_house[i]),
+            'late_returns': int(house_late[i]),
+            'late_rate': round(float(house_rate[i]), 3),
+            'mean_late_hours': round(float(house_late_hours[i] / house_late[i]), 2) if house_late[i] else 0.0,
+            'outlier': bool(house_outlier[i]),
+        }
+        for i in range(len(houses))
+    ]
+
+    weekday = columns[:, WEEKDAY].astype(np.int64) - 1
+    hour = columns[:, HOUR].astype(np.int64)
+    departures = np.bincount(weekday * 24 + hour, minlength=7 * 24).reshape(7, 24)
+    late_by_weekday = np.bincount(weekday, weights=late, minlength=7)
+
+    return {
+        'exeats': total,
+        'returned': int(returned.sum()),
+        'late_returns': int(late.sum()),
+        'late_rate': round(float(late.mean()), 3) if total else 0.0,
+        'lateness_hours': {
+            **_percentiles(late_hours),
+            'mean': round(float(late_hours.mean()), 2) if len(late_hours) else None,
+            'max': round(float(late_hours.max()), 2) if len(late_hours) else None,
+        },
+        'departure_delay_hours': _percentiles(departure_delay),
+        'lateness_distribution': distribution,
+        'houses': per_house_stats,
+        'flagged_students': flagged_students,
+        # Rows are Monday..Sunday, columns are hours 0..23 (local time)
+        'departure_heatmap': departures.tolist(),
+        'late_returns_by_weekday': late_by_weekday.astype(np.int64).tolist(),
+    }
+
+
+def analytics_cache_key(school_id, term_start=None, term_end=None):
+    return f'analytics:lateness:{school_id}:{term_start or ""}:{term_end or ""}'
+
+
+def lateness_report(school_id, term_start=None, term_end=None):
+    """analyse() for a school/term with names filled in, cached for ANALYTICS_CACHE_TIMEOUT"""
+    key = analytics_cache_key(school_id, term_start, term_end)
+    report = cache.get(key)
+    if report is not None:
+        return report
+
+    report = analyse(load_columns(school_id, term_start, term_end))
+    using = shard_for_school(school_id)
+    names = dict(
+        Student.objects.using(using)
+        .filter(pk__in=[s['student_id'] for s in report['flagged_students']])
+        .values_list('pk', 'name')
+    )
+    for student in report['flagged_students']:
+        student['name'] = names.get(student['student_id'])
+    house_names = dict(House.objects.using(using).filter(school_id=school_id).values_list('pk', 'name'))
+    for house in report['houses']:
+        house['name'] = house_names.get(house['house_id'])
+
+    cache.set(key, report, getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 600))
+    return report
@@ -3,4 +3,7 @@ from django.apps import AppConfig
 
 class ExeatAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'exeat_app'
\ No newline at end of file
+    name = 'exeat_app'
+
+    def ready(self):
+        from . import signals, tasks  # noqa: F401
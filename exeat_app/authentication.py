@@ -0,0 +1,57 @@
+from django.contrib.auth import get_user_model
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from .scoping import scope_from_claims
+from .tokens import InvalidToken, verify_access_token
+
+User = get_user_model()
+
+
+def user_from_claims(claims):
+    """
+    Build a CustomUser from token claims without touching the database.
+
+    Only the fields carried in the token are populated, so the instance
+    must never be saved. Related profiles still load lazily on access,
+    but exeat_scope() answers from the claims.
+    """
+    user = User(
+        pk=claims['uid'],
+        username=claims['usr'],
+        role=claims['role'],
+        school_id=claims['sch'],
+        is_staff=claims['stf'],
+        is_superuser=claims['su'],
+        is_active=True,
+    )
+    user._state.adding = False
+    user._state.db = 'default'
+    user.token_scope = scope_from_claims(user, claims)
+    return user
+
+
+class SignedTokenAuthentication(BaseAuthentication):
+    """
+    Authorization: Bearer <access token>
+
+    Tokens are issued by /api/auth/token/ and verified by signature only.
+    """
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed('Invalid token header.')
+
+        try:
+            claims = verify_access_token(auth[1].decode())
+        except (InvalidToken, UnicodeError) as e:
+            raise exceptions.AuthenticationFailed(str(e))
+
+        return (user_from_claims(claims), claims)
+
+    def authenticate_header(self, request):
+        return f'{self.keyword} realm="api"'
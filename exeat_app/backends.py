@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+
+from . import metrics
+from .db_routing import shard_for_school
+
+USER_CACHE_HIT = metrics.counter('auth_user_cache.hit', 'Session user loaded from cache')
+USER_CACHE_MISS = metrics.counter('auth_user_cache.miss', 'Session user loaded from the database')
+
+# Role profiles fetched with the user so permission checks need no extra queries
+PROFILE_RELATIONS = (
+    'subadmin_profile__school',
+    'housemistress_profile__house',
+    'security_profile__school',
+    'student',
+)
+
+# Profiles that live on the user's school shard rather than on 'default'
+SHARDED_PROFILES = {
+    'housemistress_profile': ('house',),
+    'security_profile': ('school',),
+    'student': (),
+}
+
+
+def _cache():
+    return caches[getattr(settings, 'AUTH_USER_CACHE_ALIAS', 'default')]
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    _cache().delete(user_cache_key(user_id))
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend whose get_user() - called by AuthenticationMiddleware on
+    every session-authenticated request - is served from the cache. The
+    user is cached together with its role profile and dropped whenever the
+    user or a profile is saved (see signals.py).
+    """
+
+    def get_user(self, user_id):
+        cache = _cache()
+        key = user_cache_key(user_id)
+        user = cache.get(key)
+        if user is not None:
+            metrics.incr(USER_CACHE_HIT)
+            return user if self.user_can_authenticate(user) else None
+
+        metrics.incr(USER_CACHE_MISS)
+        user = self.load_user(user_id)
+        if user is None:
+            return None
+        cache.set(key, user, getattr(settings, 'AUTH_USER_CACHE_TIMEOUT', 300))
+        return user if self.user_can_authenticate(user) else None
+
+    def load_user(self, user_id):
+        User = get_user_model()
+        school_id = User._default_manager.filter(pk=user_id).values_list('school_id', flat=True).first()
+        shard = shard_for_school(school_id)
+        if shard == 'default':
+            return User._default_manager.select_related(*PROFILE_RELATIONS).filter(pk=user_id).first()
+
+        user = User._default_manager.select_related('subadmin_profile__school').filter(pk=user_id).first()
+        if user is None:
+            return None
+        for name, related_fields in SHARDED_PROFILES.items():
+            relation = getattr(User, name).related
+            profile = (
+                relation.related_model._base_manager.using(shard)
+                .select_related(*related_fields).filter(user_id=user_id).first()
+            )
+            relation.set_cached_value(user, profile)
+        return user
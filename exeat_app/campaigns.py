@@ -0,0 +1,114 @@
+"""
+Exeat campaigns: one exeat for every targeted student in a school.
+
+The exeats are written by a single INSERT ... SELECT over the student table
+on the school's shard, so 5,000 students take one statement rather than
+5,000 serializer round trips. ON CONFLICT DO NOTHING makes the
+exclude_overlapping_exeats constraint skip students who already have an
+active exeat in the window instead of failing the batch. That also makes
+repeating a campaign harmless.
+
+Pre-approved campaigns take absence quota slots a house at a time, as the
+admin approve action does. Exeats in a house whose quota can't take them
+all are left pending, with an 'updated' event. Approvals are recorded as
+events so the live feed, gate sync and manifests pick them up.
+"""
+from collections import defaultdict
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .db_routing import shard_for_school, use_shard
+from .events import record_events
+from .models import Exeat, Student
+from .quotas import QuotaExceeded, take_slots
+
+CAMPAIGN_SQL = """
+INSERT INTO {exeat} (school_id, student_id, reason, start_date, end_date, status,
+                     approved_by_id, quota_held, created_at, updated_at)
+SELECT s.school_id, s.id, %(reason)s, %(start)s, %(end)s, %(status)s,
+       %(approved_by)s, %(approved)s, %(now)s, %(now)s
+FROM {student} s
+WHERE s.school_id = %(school_id)s {target}
+ORDER BY s.id
+ON CONFLICT DO NOTHING
+RETURNING id, school_id, student_id
+"""
+
+
+def _target(house_ids, student_ids):
+    if house_ids:
+        return 'AND s.house_id = ANY(%(house_ids)s)'
+    if student_ids:
+        return 'AND s.id = ANY(%(student_ids)s)'
+    return ''
+
+
+def _houses(school, house_ids, student_ids, using):
+    """House of every targeted student, by student id"""
+    students = Student.objects.using(using).filter(school=school)
+    if house_ids:
+        students = students.filter(house_id__in=house_ids)
+    elif student_ids:
+        students = students.filter(pk__in=student_ids)
+    return dict(students.values_list('pk', 'house_id'))
+
+
+def issue_campaign(school, user, reason, start_date, end_date, house_ids=None, student_ids=None, approve=False):
+    """
+    Create an exeat for every student in the school, or in house_ids, or in
+    student_ids (Student pks), approved by user when approve is set. Returns
+    a summary of what was created and skipped.
+    """
+    using = shard_for_school(school.pk)
+    sql = CAMPAIGN_SQL.format(
+        exeat=Exeat._meta.db_table, student=Student._meta.db_table,
+        target=_target(house_ids, student_ids),
+    )
+    with use_shard(using), transaction.atomic(using=using):
+        houses = _houses(school, house_ids, student_ids, using)
+        with connections[using].cursor() as cursor:
+            cursor.execute(sql, {
+                'school_id': school.pk,
+                'house_ids': list(house_ids or []),
+                'student_ids': list(student_ids or []),
+                'reason': reason,
+                'start': start_date,
+                'end': end_date,
+                'status': 'approved' if approve else 'pending',
+                'approved_by': user.pk if approve else None,
+                'approved': approve,
+                'now': timezone.now(),
+            })
+            rows = [(exeat_id, school_id, student_id, houses.get(student_id))
+                    for exeat_id, school_id, student_id in cursor.fetchall()]
+
+        held_back = []
+        if approve:
+            by_house = defaultdict(list)
+            for row in rows:
+                by_house[row[3]].append(row)
+            approved_rows = []
+            for house_id, house_rows in by_house.items():
+                try:
+                    with transaction.atomic(using=using):
+                        take_slots(school.pk, house_id, count=len(house_rows), using=using)
+                except QuotaExceeded:
+                    held_back.extend(house_rows)
+                    continue
+                approved_rows.extend(house_rows)
+            if held_back:
+                Exeat.objects.using(using).filter(pk__in=[row[0] for row in held_back]).update(
+                    status='pending', approved_by=None, quota_held=False, updated_at=timezone.now()
+                )
+                # Inserted as approved; gate sync drops them and the live feed refetches them as pending
+                record_events(held_back, 'updated', actor=user)
+            record_events(approved_rows, 'approved', actor=user)
+
+    return {
+        'targeted': len(houses),
+        'created': len(rows),
+        'approved': len(rows) - len(held_back) if approve else 0,
+        'pending_quota_full': len(held_back),
+        'skipped_overlapping': len(houses) - len(rows),
+    }
@@ -0,0 +1,84 @@
+"""
+Turning database constraint violations into API errors.
+
+Overlapping exeats are rejected by the exclude_overlapping_exeats
+exclusion constraint rather than by a lookup before every write, so the
+check is race free and costs no extra query. Callers wrap the write in
+a savepoint and translate the IntegrityError with these helpers.
+"""
+from functools import lru_cache
+
+from django.db import IntegrityError, connections
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import ACTIVE_EXEAT_STATUSES, EXEAT_OVERLAP_CONSTRAINT
+
+OVERLAP_ERROR = 'The student already has an exeat overlapping these dates'
+
+
+class OverlappingExeat(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = OVERLAP_ERROR
+    default_code = 'overlapping_exeat'
+
+
+def violated_constraint(exc):
+    """Name of the constraint behind an IntegrityError, if the driver reports one"""
+    diag = getattr(exc.__cause__, 'diag', None)
+    return getattr(diag, 'constraint_name', None)
+
+
+def violated_columns(exc, using='default'):
+    """
+    (table, columns) of the constraint behind an IntegrityError. Django picks
+    the names of unique=True constraints itself, so the reported name is
+    looked up through the database's introspection rather than guessed.
+    """
+    name = violated_constraint(exc)
+    if not name:
+        return None
+    return _constraint_columns(using, exc.__cause__.diag.table_name, name)
+
+
+@lru_cache(maxsize=None)
+def _constraint_columns(using, table, name):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        constraint = connection.introspection.get_constraints(cursor, table).get(name)
+    return (table, tuple(constraint['columns'])) if constraint else None
+
+
+def is_overlap_violation(exc):
+    return isinstance(exc, IntegrityError) and violated_constraint(exc) == EXEAT_OVERLAP_CONSTRAINT
+
+
+def find_overlapping_exeats(exeats):
+    """
+    (earlier, later) pairs of exeats in the queryset that
+    exclude_overlapping_exeats forbids: both active, same student,
+    overlapping dates. Takes a queryset so migration 0005 can pass its
+    historical model's.
+    """
+    rows = (
+        exeats.filter(status__in=ACTIVE_EXEAT_STATUSES)
+        .only('pk', 'student_id', 'status', 'start_date', 'end_date')
+        .order_by('student_id', 'start_date', 'pk')
+    )
+    pairs = []
+    student_id, earlier = None, []
+    for exeat in rows.iterator():
+        if exeat.student_id != student_id:
+            student_id, earlier = exeat.student_id, []
+        if exeat.start_date < exeat.end_date:
+            pairs.extend((other, exeat) for other in earlier if other.end_date > exeat.start_date)
+            earlier.append(exeat)
+    return pairs
+
+
+def describe_overlap(earlier, later):
+    return (
+        f'student {earlier.student_id}: exeat {earlier.pk} ({earlier.status}, '
+        f'{earlier.start_date:%Y-%m-%d %H:%M} to {earlier.end_date:%Y-%m-%d %H:%M}) overlaps exeat {later.pk} '
+        f'({later.status}, {later.start_date:%Y-%m-%d %H:%M} to {later.end_date:%Y-%m-%d %H:%M})'
+    )
@@ -0,0 +1,265 @@
+"""
+Database routing: school-keyed shards plus read replicas.
+
+Sharding
+    Every school's data (houses, students, staff profiles, exeats and the
+    tables derived from them) lives on one shard, chosen by the SchoolShard
+    map; schools without an entry live on 'default'. Reference data that
+    everything points at (schools, users, sub-admins, the shard map) is
+    written to 'default' and mirrored to the other shards so foreign keys
+    resolve locally. During a request the shard comes from the principal's
+    school (CustomUser.school); staff can target a school with ?school_id=
+    and code outside a request uses use_shard()/use_school_shard(). Each
+    process caches the map for SHARD_MAP_CACHE_SECONDS, so with a per-process
+    cache other workers follow a move once their entry expires.
+
+Read replicas
+    DatabaseRoutingMiddleware marks GET requests to read-only views (viewset
+    list/retrieve actions and APIViews with use_read_replica = True) and
+    their reads on the 'default' shard go to a replica. Writes always go to
+    the primary. After a user's successful write their reads stay on the
+    primary for REPLICA_STICKY_SECONDS, so they never see replica lag on
+    data they have just changed.
+"""
+import contextvars
+import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils.deprecation import MiddlewareMixin
+
+READ_ONLY_ACTIONS = ('list', 'retrieve')
+
+# exeat_app models that stay on 'default' (the reference data among them is
+# mirrored to shards). Every other exeat_app model is sharded by school.
+GLOBAL_MODELS = {'school', 'subadmin', 'customuser', 'schoolshard', 'job'}
+
+_routing_state = contextvars.ContextVar('exeat_db_routing', default=None)
+_shard_override = contextvars.ContextVar('exeat_shard_override', default=None)
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def shard_aliases():
+    return getattr(settings, 'DATABASE_SHARDS', ['default'])
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'exeat_app' and model._meta.model_name not in GLOBAL_MODELS
+
+
+def sticky_key(user_id):
+    return f'db:sticky:{user_id}'
+
+
+def shard_cache_key(school_id):
+    return f'db:shard:{school_id}'
+
+
+def shard_for_school(school_id):
+    """Database alias holding a school's data"""
+    if school_id is None or len(shard_aliases()) == 1:
+        return 'default'
+    key = shard_cache_key(school_id)
+    alias = cache.get(key)
+    if alias is None:
+        from .models import SchoolShard
+        alias = (
+            SchoolShard.objects.using('default').filter(school_id=school_id)
+            .values_list('database', flat=True).first()
+        ) or 'default'
+        cache.set(key, alias, getattr(settings, 'SHARD_MAP_CACHE_SECONDS', 60))
+    return alias
+
+
+@contextmanager
+def use_shard(alias):
+    """Route sharded models to the given alias inside the block"""
+    token = _shard_override.set(alias)
+    try:
+        yield alias
+    finally:
+        _shard_override.reset(token)
+
+
+def use_school_shard(school_id):
+    return use_shard(shard_for_school(school_id))
+
+
+def current_shard():
+    alias = _shard_override.get()
+    if alias is not None:
+        return alias
+    state = _routing_state.get()
+    if state is not None:
+        return state.shard()
+    return 'default'
+
+
+def pin_school(request, school_id):
+    """Send the rest of this request's sharded queries to the school's shard"""
+    state = getattr(request, '_db_routing_state', None)
+    if state is not None:
+        state.pinned = shard_for_school(school_id)
+
+
+def fan_out(func, aliases=None):
+    """Call func(alias) for every shard in parallel and return the results in order"""
+    aliases = list(aliases or shard_aliases())
+    if len(aliases) == 1:
+        with use_shard(aliases[0]):
+            return [func(aliases[0])]
+
+    def run(alias):
+        try:
+            with use_shard(alias):
+                return func(alias)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        return list(pool.map(run, aliases))
+
+
+def sharded_models():
+    from django.apps import apps
+    return [model for model in apps.get_app_config('exeat_app').get_models() if is_sharded(model)]
+
+
+def reserve_id_ranges():
+    """
+    Start each shard's id sequences in its own SHARD_ID_BLOCK sized range so
+    rows keep their primary keys when a school moves between shards.
+    Safe to run repeatedly; sequences already past their block are left alone.
+    """
+    block = getattr(settings, 'SHARD_ID_BLOCK', 10**12)
+    for index, alias in enumerate(shard_aliases()):
+        floor = index * block
+        if not floor:
+            continue
+        with connections[alias].cursor() as cursor:
+            for model in sharded_models():
+                cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [model._meta.db_table, model._meta.pk.column])
+                sequence = cursor.fetchone()[0]
+                if sequence:
+                    cursor.execute(
+                        f"SELECT setval(%s, GREATEST((SELECT last_value FROM {sequence}), %s))",
+                        [sequence, floor]
+                    )
+
+
+class RoutingState:
+    """Per-request routing decisions, resolved lazily by the router"""
+
+    def __init__(self, request):
+        self.request = request
+        self.read_only = False
+        self.pinned = None
+        self.sticky = {}
+        self.shards = {}
+        self.resolving = False
+
+    def user(self):
+        # Resolving request.user may itself query the database
+        if self.resolving:
+            return None
+        self.resolving = True
+        try:
+            user = getattr(self.request, 'user', None)
+            return user if user is not None and user.is_authenticated else None
+        finally:
+            self.resolving = False
+
+    def shard(self):
+        if self.pinned is not None:
+            return self.pinned
+        user = self.user()
+        if user is None:
+            return 'default'
+        if user.pk not in self.shards:
+            school_id = user.school_id
+            if school_id is None and user.is_staff:
+                school_id = self.request.GET.get('school_id')
+            self.shards[user.pk] = shard_for_school(school_id)
+        return self.shards[user.pk]
+
+    def use_replica(self):
+        if not self.read_only or self.resolving:
+            return False
+        user = self.user()
+        if user is None:
+            return True
+        if user.pk not in self.sticky:
+            self.sticky[user.pk] = cache.get(sticky_key(user.pk)) is not None
+        return not self.sticky[user.pk]
+
+
+class ShardReplicaRouter:
+    def _replica_or(self, alias):
+        state = _routing_state.get()
+        replicas = replica_aliases()
+        if alias == 'default' and replicas and state is not None and state.use_replica():
+            return random.choice(replicas)
+        return alias
+
+    def _shard(self, model, hints):
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(instance._meta.model) and instance._state.db:
+            return instance._state.db
+        return current_shard()
+
+    def db_for_read(self, model, **hints):
+        if not is_sharded(model):
+            return self._replica_or('default')
+        return self._replica_or(self._shard(model, hints))
+
+    def db_for_write(self, model, **hints):
+        if not is_sharded(model):
+            return 'default'
+        return self._shard(model, hints)
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
+
+
+class DatabaseRoutingMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        request._db_routing_state = RoutingState(request)
+        request._db_routing_token = _routing_state.set(request._db_routing_state)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if request.method not in ('GET', 'HEAD'):
+            return None
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        actions = getattr(view_func, 'actions', None)
+        if actions is not None:
+            read_only = actions.get(request.method.lower()) in READ_ONLY_ACTIONS
+        else:
+            read_only = getattr(view_class, 'use_read_replica', False)
+        request._db_routing_state.read_only = read_only
+        return None
+
+    def process_response(self, request, response):
+        token = getattr(request, '_db_routing_token', None)
+        if token is None:
+            return response
+        request._db_routing_token = None
+        try:
+            _routing_state.reset(token)
+        except ValueError:
+            # Reset from a different context (async middleware chain)
+            _routing_state.set(None)
+
+        user = getattr(request, 'user', None)
+        if (request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400
+                and user is not None and user.is_authenticated):
+            cache.set(sticky_key(user.pk), True, getattr(settings, 'REPLICA_STICKY_SECONDS', 10))
+        return response
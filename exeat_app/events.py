@@ -0,0 +1,232 @@
+"""
+Live exeat activity feed.
+
+State changes (approval, sign out, sign in, overdue) are appended to the
+ExeatEvent table inside the same transaction as the change itself.  Each
+ASGI worker runs a single broadcaster task that polls that table and fans
+new events out to every connected Server-Sent Events client, so idle
+connections cost a queue each rather than a database query each.
+
+With sharding there is one broadcaster per shard. Staff streams span every
+shard, so their SSE ids are a composite "alias:id,alias:id" cursor; streams
+scoped to one school keep plain integer ids.
+
+Event ids are assigned at insert but only become visible at commit, so an
+event can show up after one with a higher id that a client has already
+been sent. Polls therefore only read events older than
+EXEAT_EVENT_SETTLE_SECONDS (as gate sync does), trading that much latency
+for never skipping one.
+"""
+import asyncio
+import json
+import weakref
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .db_routing import shard_aliases, shard_for_school
+from .models import ExeatEvent
+
+
+def record_event(exeat, kind, actor=None):
+    """Append an event for an exeat state change (on the exeat's own shard)"""
+    return ExeatEvent.objects.db_manager(exeat._state.db).create(
+        exeat=exeat,
+        school_id=exeat.school_id,
+        house_id=exeat.student.house_id,
+        student_id=exeat.student_id,
+        kind=kind,
+        actor=actor,
+    )
+
+
+def record_events(rows, kind, actor=None, using=None):
+    """Bulk version of record_event() for (exeat_id, school_id, student_id, house_id) rows"""
+    return ExeatEvent.objects.db_manager(using).bulk_create(
+        ExeatEvent(exeat_id=exeat_id, school_id=school_id, student_id=student_id,
+                   house_id=house_id, kind=kind, actor=actor)
+        for exeat_id, school_id, student_id, house_id in rows
+    )
+
+
+def event_in_scope(event, scope):
+    """In-memory version of scope_exeats() for a single event"""
+    kind, value = scope
+    if kind == 'all':
+        return True
+    elif kind == 'school':
+        return event.school_id == value.pk
+    elif kind == 'house':
+        return event.house_id == value.pk
+    return event.student.user_id == value.pk
+
+
+def scope_events(queryset, scope):
+    """Restrict an ExeatEvent queryset to the given scope"""
+    kind, value = scope
+    if kind == 'all':
+        return queryset
+    elif kind == 'school':
+        return queryset.filter(school=value)
+    elif kind == 'house':
+        return queryset.filter(house=value)
+    return queryset.filter(student__user=value)
+
+
+def scope_shards(scope):
+    """Database aliases holding the events a scope can see"""
+    kind, value = scope
+    if kind == 'all':
+        return list(shard_aliases())
+    elif kind == 'school':
+        return [shard_for_school(value.pk)]
+    return [shard_for_school(value.school_id)]
+
+
+def parse_cursor(value, aliases):
+    """
+    Turn a Last-Event-ID into {alias: last id}. Raises ValueError when it
+    is malformed; returns None when there is nothing to resume from.
+    """
+    if not value:
+        return None
+    if ':' not in value:
+        if len(aliases) != 1:
+            raise ValueError(value)
+        return {aliases[0]: int(value)}
+    cursor = {}
+    for part in value.split(','):
+        alias, _, event_id = part.rpartition(':')
+        if alias not in aliases:
+            raise ValueError(value)
+        cursor[alias] = int(event_id)
+    return cursor
+
+
+def format_cursor(cursor):
+    if len(cursor) == 1:
+        return str(next(iter(cursor.values())))
+    return ','.join(f'{alias}:{event_id}' for alias, event_id in cursor.items())
+
+
+def format_event(event, event_id=None):
+    """Render an event as a Server-Sent Events message"""
+    data = json.dumps({
+        'event_id': event.id,
+        'exeat_id': event.exeat_id,
+        'student_id': event.student_id,
+        'student_name': event.student.name,
+        'house_id': event.house_id,
+        'kind': event.kind,
+        'created_at': event.created_at.isoformat(),
+    })
+    return f"id: {event_id or event.id}\nevent: {event.kind}\ndata: {data}\n\n"
+
+
+def settled_events(using='default'):
+    """Events old enough that every transaction with a lower id has committed"""
+    settle = getattr(settings, 'EXEAT_EVENT_SETTLE_SECONDS', 2)
+    return ExeatEvent.objects.using(using).filter(created_at__lt=timezone.now() - timedelta(seconds=settle))
+
+
+def latest_event_id(using='default'):
+    return settled_events(using).order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def fetch_events(after_id, scope=None, limit=500, using='default'):
+    events = settled_events(using).filter(id__gt=after_id).select_related('student')
+    if scope is not None:
+        events = scope_events(events, scope)
+    return list(events.order_by('id')[:limit])
+
+
+class EventBroadcaster:
+    """Polls one shard's event table once per interval and dispatches to subscribers"""
+
+    def __init__(self, alias='default'):
+        self.alias = alias
+        self.subscribers = {}
+        self.last_id = None
+        self.task = None
+
+    def subscribe(self, scope, queue=None):
+        queue = queue or asyncio.Queue()
+        self.subscribers[queue] = scope
+        if self.task is None or self.task.done():
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.pop(queue, None)
+
+    async def run(self):
+        interval = getattr(settings, 'EXEAT_EVENT_POLL_INTERVAL', 2.0)
+        if self.last_id is None:
+            self.last_id = await sync_to_async(latest_event_id)(self.alias)
+        while self.subscribers:
+            events = await sync_to_async(fetch_events)(self.last_id, using=self.alias)
+            for event in events:
+                self.last_id = event.id
+                for queue, scope in list(self.subscribers.items()):
+                    if event_in_scope(event, scope):
+                        queue.put_nowait(event)
+            if not events:
+                await asyncio.sleep(interval)
+        self.task = None
+
+
+_broadcasters = weakref.WeakKeyDictionary()
+
+
+def get_broadcaster(alias='default'):
+    """One broadcaster per shard per running event loop"""
+    per_shard = _broadcasters.setdefault(asyncio.get_running_loop(), {})
+    if alias not in per_shard:
+        per_shard[alias] = EventBroadcaster(alias)
+    return per_shard[alias]
+
+
+async def stream_events(scope, last_event_id=None):
+    """
+    Async generator of SSE messages for one client.
+
+    When the client reconnects with a Last-Event-ID (a cursor from
+    parse_cursor()) the missed events are replayed from the table before
+    switching to the live queue.
+    """
+    keepalive = getattr(settings, 'EXEAT_EVENT_KEEPALIVE', 15)
+    aliases = await sync_to_async(scope_shards)(scope)
+    queue = asyncio.Queue()
+    broadcasters = [get_broadcaster(alias) for alias in aliases]
+    for broadcaster in broadcasters:
+        broadcaster.subscribe(scope, queue)
+    try:
+        yield f"retry: {keepalive * 1000}\n\n"
+        delivered = dict(last_event_id or {})
+        for alias in aliases:
+            if alias not in delivered:
+                delivered[alias] = await sync_to_async(latest_event_id)(alias)
+                continue
+            while True:
+                backlog = await sync_to_async(fetch_events)(delivered[alias], scope, using=alias)
+                for event in backlog:
+                    delivered[alias] = event.id
+                    yield format_event(event, format_cursor(delivered))
+                if len(backlog) < 500:
+                    break
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            alias = event._state.db
+            if event.id <= delivered[alias]:
+                continue
+            delivered[alias] = event.id
+            yield format_event(event, format_cursor(delivered))
+    finally:
+        for broadcaster in broadcasters:
+            broadcaster.unsubscribe(queue)
@@ -0,0 +1,224 @@
+"""
+Gate operations: sign out/in transitions and sync for offline gate devices.
+
+Devices keep a local copy of their school's gate-relevant exeats (approved,
+signed out or overdue). sync_changes() hands them the exeats touched since
+their cursor - read off the ExeatEvent log, so reconnect traffic follows the
+number of changes rather than the size of the Exeat table - plus tombstones
+for exeats that left the gate set. apply_scans() takes sign outs and sign
+ins recorded while offline; each scan carries a device-chosen scan_id and is
+stored as a GateScan, so uploading the same batch twice is harmless.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .db_routing import shard_for_school
+from .events import record_event
+from .models import Exeat, ExeatEvent, GateScan
+from .quotas import QuotaExceeded, hold_quota, lock_exeat, release_quota
+from .roster import add_to_roster, remove_from_roster
+
+GATE_STATUSES = ('approved', 'signed_out', 'overdue')
+SYNC_SALT = 'exeat_app.gate.sync'
+SYNC_PAGE_SIZE = 500
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class InvalidTransition(Exception):
+    """The exeat is not (or no longer) in a status the action applies to"""
+
+
+def require_status(exeat, statuses, message):
+    """
+    Lock the exeat and check it is still in one of statuses; a check made
+    before the lock may be stale. Call inside a transaction.
+    """
+    lock_exeat(exeat)
+    if exeat.status not in statuses:
+        raise InvalidTransition(message)
+
+
+def sign_out_exeat(exeat, user, at=None):
+    """Record an approved exeat's student leaving; raises InvalidTransition or QuotaExceeded"""
+    with transaction.atomic(using=exeat._state.db):
+        require_status(exeat, ('approved',), 'Only approved exeats can be signed out')
+        # Exeats approved before the quota existed take their slot here
+        hold_quota(exeat)
+        exeat.status = 'signed_out'
+        exeat.signed_out_by = user
+        exeat.signed_out_time = at or timezone.now()
+        exeat.save()
+        record_event(exeat, 'signed_out', actor=user)
+        add_to_roster(exeat)
+
+
+def sign_in_exeat(exeat, user, at=None):
+    """Record a signed out (or overdue) student coming back; raises InvalidTransition"""
+    with transaction.atomic(using=exeat._state.db):
+        require_status(exeat, ('signed_out', 'overdue'), 'Only signed out exeats can be signed in')
+        release_quota(exeat)
+        exeat.status = 'signed_in'
+        exeat.signed_in_by = user
+        exeat.signed_in_time = at or timezone.now()
+        exeat.save()
+        record_event(exeat, 'signed_in', actor=user)
+        remove_from_roster(exeat)
+
+
+def gate_record(exeat):
+    """Compact representation of an exeat for gate devices (needs student loaded)"""
+    student = exeat.student
+    return {
+        'id': exeat.pk,
+        'student_id': student.pk,
+        'student_number': student.student_id,
+        'student_name': student.name,
+        'house_id': student.house_id,
+        'start_date': exeat.start_date,
+        'end_date': exeat.end_date,
+        'status': exeat.status,
+        'signed_out_time': exeat.signed_out_time,
+        'signed_in_time': exeat.signed_in_time,
+        'updated_at': exeat.updated_at,
+    }
+
+
+def encode_cursor(school_id, event_id):
+    return signing.dumps([school_id, event_id], salt=SYNC_SALT)
+
+
+def decode_cursor(cursor, school_id):
+    try:
+        cursor_school, event_id = signing.loads(cursor, salt=SYNC_SALT)
+    except (signing.BadSignature, TypeError, ValueError):
+        raise InvalidCursor(cursor)
+    if cursor_school != school_id:
+        raise InvalidCursor(cursor)
+    return event_id
+
+
+def settled_events(school, using):
+    # Event ids are assigned at insert but become visible at commit, so a
+    # just-written event can appear after a higher id. Leaving the newest
+    # events for the next sync means none are skipped.
+    settle = getattr(settings, 'GATE_SYNC_SETTLE_SECONDS', 2)
+    return ExeatEvent.objects.using(using).filter(
+        school=school, created_at__lt=timezone.now() - timedelta(seconds=settle)
+    )
+
+
+def sync_changes(school, cursor=None, limit=SYNC_PAGE_SIZE):
+    """
+    Without a cursor: every gate-relevant exeat of the school. With one:
+    exeats changed since, plus ids to drop. Raises InvalidCursor, in which
+    case the device should start over without a cursor.
+    """
+    using = shard_for_school(school.pk)
+    exeats = Exeat.objects.using(using).filter(school=school).select_related('student')
+
+    if cursor is None:
+        # Read the cursor first: changes made during the snapshot are replayed next time
+        last_id = settled_events(school, using).order_by('-id').values_list('id', flat=True).first() or 0
+        return {
+            'cursor': encode_cursor(school.pk, last_id),
+            'full': True,
+            'changes': [gate_record(e) for e in exeats.filter(status__in=GATE_STATUSES).order_by('id')],
+            'deleted': [],
+            'has_more': False,
+        }
+
+    after = decode_cursor(cursor, school.pk)
+    events = list(
+        settled_events(school, using).filter(id__gt=after).order_by('id')
+        .values_list('id', 'exeat_id')[:limit]
+    )
+    if not events:
+        return {'cursor': cursor, 'full': False, 'changes': [], 'deleted': [], 'has_more': False}
+
+    changed_ids = {exeat_id for _, exeat_id in events}
+    changes = [gate_record(e) for e in exeats.filter(pk__in=changed_ids, status__in=GATE_STATUSES).order_by('id')]
+    return {
+        'cursor': encode_cursor(school.pk, events[-1][0]),
+        'full': False,
+        'changes': changes,
+        'deleted': sorted(changed_ids - {change['id'] for change in changes}),
+        'has_more': len(events) == limit,
+    }
+
+
+def _apply_scan(exeat, scan, user):
+    """Apply one scan to a locked exeat; returns (result, reason)"""
+    if exeat is None:
+        return 'conflict', 'not_found'
+    if scan['action'] == 'sign_out':
+        if exeat.status in ('signed_out', 'overdue', 'signed_in'):
+            return 'conflict', 'already_signed_out'
+        if exeat.status != 'approved':
+            return 'conflict', 'not_approved'
+        try:
+            sign_out_exeat(exeat, user, at=scan['scanned_at'])
+        except QuotaExceeded:
+            return 'conflict', 'quota_full'
+        return 'applied', ''
+
+    if exeat.status == 'signed_in':
+        return 'conflict', 'already_signed_in'
+    if exeat.status not in ('signed_out', 'overdue'):
+        return 'conflict', 'not_signed_out'
+    sign_in_exeat(exeat, user, at=scan['scanned_at'])
+    return 'applied', ''
+
+
+def apply_scans(school, user, scans):
+    """
+    Apply offline scans (dicts with scan_id, exeat_id, action, scanned_at)
+    in the order they were scanned. Returns one result per scan; scans seen
+    before are reported with duplicate=True and their original outcome.
+    """
+    using = shard_for_school(school.pk)
+    exeats = Exeat.objects.using(using).filter(school=school).select_related('student')
+    seen = {
+        scan.scan_id: scan
+        for scan in GateScan.objects.using(using).filter(school=school, scan_id__in=[s['scan_id'] for s in scans])
+    }
+
+    results = {}
+    for scan in sorted(scans, key=lambda s: s['scanned_at']):
+        previous = seen.get(scan['scan_id'])
+        if previous is None:
+            try:
+                with transaction.atomic(using=using):
+                    exeat = exeats.select_for_update(of=('self',)).filter(pk=scan['exeat_id']).first()
+                    result, reason = _apply_scan(exeat, scan, user)
+                    previous = GateScan.objects.using(using).create(
+                        school=school, scan_id=scan['scan_id'], exeat_id=scan['exeat_id'],
+                        action=scan['action'], scanned_at=scan['scanned_at'],
+                        result=result, reason=reason, recorded_by=user,
+                    )
+                seen[scan['scan_id']] = previous
+                duplicate = False
+            except IntegrityError:
+                # The same scan arrived in a parallel upload, which won
+                previous = GateScan.objects.using(using).get(school=school, scan_id=scan['scan_id'])
+                duplicate = True
+        else:
+            duplicate = True
+        results[scan['scan_id']] = {
+            'scan_id': scan['scan_id'],
+            'result': previous.result,
+            'reason': previous.reason,
+            'duplicate': duplicate,
+        }
+
+    current = {e.pk: gate_record(e) for e in exeats.filter(pk__in={s['exeat_id'] for s in scans})}
+    return [
+        dict(results[scan['scan_id']], exeat=current.get(scan['exeat_id']))
+        for scan in scans
+    ]
@@ -0,0 +1,93 @@
+"""
+Idempotency-Key support for create endpoints.
+
+Clients on flaky networks retry POSTs. When a request carries an
+Idempotency-Key header the first response is kept in the cache and any
+retry with the same key (from the same user, with the same body) gets that
+response back without running the view again. A retry that arrives while
+the first request is still running gets 409.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.response import Response
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def _cache():
+    return caches[getattr(settings, 'IDEMPOTENCY_CACHE_ALIAS', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400)
+
+
+def _cache_key(request, key):
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'idempotency:{request.user.pk}:{digest}'
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method}:{request.path}:{body}'.encode()).hexdigest()
+
+
+def idempotent_response(request, handler):
+    """
+    Run handler() (which returns a Response) at most once per Idempotency-Key.
+    Requests without the header are passed straight through.
+    """
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    if not key:
+        return handler()
+    if len(key) > MAX_KEY_LENGTH:
+        return Response(
+            {'error': f'{IDEMPOTENCY_HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    cache = _cache()
+    cache_key = _cache_key(request, key)
+    fingerprint = _fingerprint(request)
+    # Claim the key; the marker expires on its own if this worker dies
+    if cache.add(cache_key, {'fingerprint': fingerprint, 'status': None}, 60):
+        try:
+            response = handler()
+        except Exception:
+            cache.delete(cache_key)
+            raise
+        if response.status_code >= 500 or response.status_code == status.HTTP_429_TOO_MANY_REQUESTS:
+            # Not a final answer, let the client retry for real
+            cache.delete(cache_key)
+        else:
+            cache.set(cache_key, {
+                'fingerprint': fingerprint,
+                'status': response.status_code,
+                'data': response.data,
+            }, _ttl())
+        return response
+
+    stored = cache.get(cache_key)
+    if stored is None:
+        # Expired between add() and get(); treat as a fresh request
+        return idempotent_response(request, handler)
+    if stored['fingerprint'] != fingerprint:
+        return Response(
+            {'error': f'{IDEMPOTENCY_HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    if stored['status'] is None:
+        response = Response(
+            {'error': 'A request with this Idempotency-Key is still being processed'},
+            status=status.HTTP_409_CONFLICT
+        )
+        response['Retry-After'] = '1'
+        return response
+    response = Response(stored['data'], status=stored['status'])
+    response['Idempotent-Replayed'] = 'true'
+    return response
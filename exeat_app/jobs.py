@@ -0,0 +1,221 @@
+"""
+Background jobs kept in a Postgres table.
+
+Work is queued as Job rows on 'default' and run by `manage.py run_jobs`
+workers, as many processes as needed. No broker is involved. A worker
+claims the highest priority job that is due with SELECT ... FOR UPDATE SKIP
+LOCKED, so workers never take the same job and never wait on each other.
+
+- enqueue() queues a registered task, optionally with a priority or delay.
+  Called inside a transaction, the job only becomes visible when it commits.
+- A task that raises is retried after JOB_RETRY_BASE_SECONDS, doubling per
+  attempt up to JOB_RETRY_MAX_SECONDS (with jitter). After max_attempts the
+  job is left failed with its traceback.
+- A periodic task always has one queued run. When a run finishes the next
+  is queued `every` seconds after it, and workers queue any missing ones as
+  they go. unique_pending_periodic_job stops two workers from queueing the
+  same one twice.
+- Jobs left running by a worker that died are requeued after
+  JOB_TIMEOUT_SECONDS.
+
+Queue depth, the wait of the oldest due job and done/failed/retried counts
+are in /api/metrics/.
+"""
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Min
+from django.utils import timezone
+
+from . import metrics
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+JOBS_DONE = metrics.counter('jobs.done', 'Jobs that ran successfully')
+JOBS_RETRIED = metrics.counter('jobs.retried', 'Failed job runs queued to retry')
+JOBS_FAILED = metrics.counter('jobs.failed', 'Jobs that failed their last attempt')
+
+TASKS = {}
+
+
+class Task:
+    def __init__(self, name, func, priority, max_attempts, every):
+        self.name = name
+        self.func = func
+        self.priority = priority
+        self.max_attempts = max_attempts
+        self.every = every
+
+
+def register(name, func, priority=0, max_attempts=5, every=None):
+    """Make func runnable as the job name; every (seconds) makes it periodic"""
+    TASKS[name] = Task(name, func, priority, max_attempts, every)
+    return func
+
+
+def enqueue(name, priority=None, delay=0, **kwargs):
+    """Queue a run of task name with the given (JSON serializable) kwargs"""
+    task = TASKS[name]
+    return Job.objects.create(
+        name=name,
+        kwargs=kwargs,
+        priority=task.priority if priority is None else priority,
+        max_attempts=task.max_attempts,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def _periodic_run(task, run_at):
+    return Job(name=task.name, periodic=True, priority=task.priority,
+               max_attempts=task.max_attempts, run_at=run_at)
+
+
+def schedule_periodic(now=None):
+    """Queue a run now of every periodic task without one queued or running"""
+    now = now or timezone.now()
+    Job.objects.bulk_create(
+        [_periodic_run(task, now) for task in TASKS.values() if task.every],
+        ignore_conflicts=True,
+    )
+
+
+def requeue_stale(now=None):
+    """Give jobs whose worker stopped responding back to the queue (or fail them if out of attempts)"""
+    now = now or timezone.now()
+    stale = Job.objects.filter(
+        status='running', locked_at__lt=now - timedelta(seconds=getattr(settings, 'JOB_TIMEOUT_SECONDS', 1800))
+    )
+    lost = {'locked_by': '', 'locked_at': None, 'last_error': 'Worker stopped responding'}
+    requeued = stale.filter(attempts__lt=F('max_attempts')).update(status='queued', run_at=now, **lost)
+    stale.update(status='failed', finished_at=now, **lost)
+    return requeued
+
+
+def claim(worker, now=None):
+    """Lock and mark running the next due job, or return None"""
+    now = now or timezone.now()
+    with transaction.atomic():
+        job = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status='queued', run_at__lte=now)
+            .order_by('-priority', 'run_at')
+            .first()
+        )
+        if job is None:
+            return None
+        job.status = 'running'
+        job.attempts += 1
+        job.locked_by = worker
+        job.locked_at = now
+        job.save(update_fields=['status', 'attempts', 'locked_by', 'locked_at'])
+    return job
+
+
+def retry_delay(attempts):
+    base = getattr(settings, 'JOB_RETRY_BASE_SECONDS', 10)
+    delay = min(base * 2 ** (attempts - 1), getattr(settings, 'JOB_RETRY_MAX_SECONDS', 3600))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def _finish(job, status, error=''):
+    now = timezone.now()
+    with transaction.atomic():
+        Job.objects.filter(pk=job.pk).update(
+            status=status, finished_at=now, last_error=error, locked_by='', locked_at=None
+        )
+        task = TASKS.get(job.name)
+        if job.periodic and task is not None and task.every:
+            next_run = max(job.run_at + timedelta(seconds=task.every), now)
+            Job.objects.bulk_create([_periodic_run(task, next_run)], ignore_conflicts=True)
+
+
+def run(job):
+    """Run a claimed job and record how it went"""
+    task = TASKS.get(job.name)
+    try:
+        if task is None:
+            raise LookupError(f'No task registered as {job.name!r}')
+        task.func(**job.kwargs)
+    except Exception:
+        logger.exception('Job %s (%s) failed', job.pk, job.name)
+        error = traceback.format_exc()[-4000:]
+        if job.attempts < job.max_attempts:
+            Job.objects.filter(pk=job.pk).update(
+                status='queued', last_error=error, locked_by='', locked_at=None,
+                run_at=timezone.now() + timedelta(seconds=retry_delay(job.attempts)),
+            )
+            metrics.incr(JOBS_RETRIED)
+        else:
+            _finish(job, 'failed', error)
+            metrics.incr(JOBS_FAILED)
+    else:
+        _finish(job, 'done')
+        metrics.incr(JOBS_DONE)
+
+
+def purge_finished_jobs():
+    """Delete jobs that finished more than JOB_KEEP_DAYS ago"""
+    cutoff = timezone.now() - timedelta(days=getattr(settings, 'JOB_KEEP_DAYS', 7))
+    deleted, _ = Job.objects.filter(status__in=['done', 'failed'], finished_at__lt=cutoff).delete()
+    return deleted
+
+
+class Worker:
+    """Claims and runs jobs until stop() is called (or the queue is empty, in burst mode)"""
+
+    def __init__(self, name=None):
+        self.name = name or f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = threading.Event()
+
+    def stop(self):
+        self.stopping.set()
+
+    def run(self, burst=False):
+        poll = getattr(settings, 'JOB_POLL_INTERVAL', 1.0)
+        housekeeping_every = getattr(settings, 'JOB_HOUSEKEEPING_SECONDS', 60)
+        last_housekeeping = None
+        ran = 0
+        while not self.stopping.is_set():
+            close_old_connections()
+            if last_housekeeping is None or time.monotonic() - last_housekeeping >= housekeeping_every:
+                requeue_stale()
+                schedule_periodic()
+                last_housekeeping = time.monotonic()
+            job = claim(self.name)
+            if job is None:
+                if burst:
+                    break
+                self.stopping.wait(poll)
+                continue
+            run(job)
+            ran += 1
+        return ran
+
+
+def _due():
+    return Job.objects.using('default').filter(status='queued', run_at__lte=timezone.now())
+
+
+def queue_depth():
+    return _due().count()
+
+
+def queue_wait_seconds():
+    """How long the oldest due job has been waiting"""
+    oldest = _due().aggregate(oldest=Min('run_at'))['oldest']
+    return round((timezone.now() - oldest).total_seconds(), 1) if oldest else 0
+
+
+metrics.gauge('jobs.queued', queue_depth, 'Jobs due and waiting for a worker')
+metrics.gauge('jobs.wait_seconds', queue_wait_seconds, 'Wait of the oldest due job')
+metrics.gauge('jobs.running', lambda: Job.objects.using('default').filter(status='running').count(),
+              'Jobs claimed by a worker')
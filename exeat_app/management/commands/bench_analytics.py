@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from exeat_app.analytics import analyse, load_columns
+
+
+class Command(BaseCommand):
+    help = 'Time the lateness analytics on synthetic exeats (or on a real school with --school)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--students', type=int, default=5000)
+        parser.add_argument('--school', type=int, help='Load this school from the database instead')
+
+    def handle(self, *args, **options):
+        if options['school']:
+            started = time.perf_counter()
+            columns = load_columns(options['school'])
+            self.stdout.write(f'Loaded {len(columns):,} exeats in {time.perf_counter() - started:.2f}s')
+        else:
+            columns = self.synthetic(options['rows'], options['students'])
+
+        started = time.perf_counter()
+        report = analyse(columns)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Analysed {report['exeats']:,} exeats ({report['late_returns']:,} late, "
+            f"{len(report['flagged_students'])} students flagged) in {elapsed:.2f}s"
+        )
+
+    def synthetic(self, rows, students):
+        rng = np.random.default_rng(0)
+        now = timezone.now().timestamp()
+        start = now - rng.uniform(0, 120 * 86400, rows)
+        end = start + rng.uniform(3600, 3 * 86400, rows)
+        out = start + rng.exponential(1800, rows)
+        back = end + rng.normal(-1800, 3600, rows)
+        back[rng.random(rows) < 0.02] = np.nan
+        return np.column_stack([
+            rng.integers(1, students + 1, rows),
+            rng.integers(1, 9, rows),
+            start, end, out, back,
+            rng.integers(1, 8, rows),
+            rng.integers(0, 24, rows),
+        ]).astype(np.float64)
@@ -0,0 +1,53 @@
+import time
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from exeat_app.campaigns import issue_campaign
+from exeat_app.models import House, School, Student
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Time a pre-approved exeat campaign for a synthetic school. Everything is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=5000)
+        parser.add_argument('--houses', type=int, default=8)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                # bulk_create skips the signals that would copy these rows to other shards
+                User = get_user_model()
+                school = School.objects.bulk_create([
+                    School(name='Benchmark school', code='bench-campaign', email='bench@example.com')
+                ])[0]
+                houses = House.objects.bulk_create(
+                    House(school=school, name=f'House {i}') for i in range(options['houses'])
+                )
+                users = User.objects.bulk_create(
+                    User(username=f'bench-campaign-{i}', school=school) for i in range(options['students'])
+                )
+                Student.objects.bulk_create(
+                    Student(user=user, school=school, house=houses[i % len(houses)], student_id=str(i),
+                            name=f'Student {i}', email='bench@example.com')
+                    for i, user in enumerate(users)
+                )
+                admin = User.objects.bulk_create([User(username='bench-campaign-admin', is_staff=True)])[0]
+
+                start = timezone.now() + timedelta(days=7)
+                started = time.perf_counter()
+                summary = issue_campaign(school, admin, 'Mid-term break', start, start + timedelta(days=4), approve=True)
+                elapsed = time.perf_counter() - started
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(f'{summary}')
+        self.stdout.write(self.style.SUCCESS(f"Issued {summary['created']:,} exeats in {elapsed:.2f}s"))
@@ -0,0 +1,108 @@
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.utils import timezone
+
+from exeat_app.models import EXEAT_OVERLAP_CONSTRAINT, Exeat, School, Student
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure exeat insert throughput with and without the overlap exclusion '
+        'constraint. A rolled back warm-up run goes first, then both orders are '
+        'measured so neither side always gets the cold table. Everything runs in '
+        'one transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000)
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=1000, help='Rows inserted and discarded before measuring')
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        database = options['database']
+        rows = options['rows']
+        results = {}
+        try:
+            with transaction.atomic(using=database):
+                students = self.make_students(database, options['students'])
+                if options['warmup']:
+                    with self.rolled_back(database):
+                        self.insert(database, students, options['warmup'], days=0)
+
+                with self.rolled_back(database):
+                    results['with first'] = {'with constraint': self.insert(database, students, rows, days=0)}
+                    self.drop_constraint(database)
+                    results['with first']['without constraint'] = self.insert(database, students, rows, days=10000)
+
+                with self.rolled_back(database):
+                    with self.rolled_back(database):
+                        # Rolling back this savepoint brings the constraint back
+                        self.drop_constraint(database)
+                        results['without first'] = {'without constraint': self.insert(database, students, rows, days=0)}
+                    results['without first']['with constraint'] = self.insert(database, students, rows, days=10000)
+                raise Rollback
+        except Rollback:
+            pass
+
+        overheads = []
+        for order, rates in results.items():
+            self.stdout.write(f'{order}:')
+            for label, rate in rates.items():
+                self.stdout.write(f'{label:>20}: {rate:,.0f} inserts/s')
+            overhead = 1 - rates['with constraint'] / rates['without constraint']
+            overheads.append(overhead)
+            self.stdout.write(f'{"overhead":>20}: {overhead:.1%}')
+        self.stdout.write(self.style.SUCCESS(f'Constraint overhead: {sum(overheads) / len(overheads):.1%} (mean of both orders)'))
+
+    @contextmanager
+    def rolled_back(self, database):
+        """Run the block in a savepoint that is always rolled back"""
+        try:
+            with transaction.atomic(using=database):
+                yield
+                raise Rollback
+        except Rollback:
+            pass
+
+    def drop_constraint(self, database):
+        with connections[database].cursor() as cursor:
+            # Flush deferred FK checks, ALTER TABLE refuses to run with them pending
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute(f'ALTER TABLE {Exeat._meta.db_table} DROP CONSTRAINT {EXEAT_OVERLAP_CONSTRAINT}')
+
+    def make_students(self, database, count):
+        # bulk_create skips the signals that would copy these rows to other shards
+        User = get_user_model()
+        school = School.objects.using(database).bulk_create([
+            School(name='Benchmark school', code='bench-exeat-inserts', email='bench@example.com')
+        ])[0]
+        users = User.objects.using(database).bulk_create(
+            User(username=f'bench-exeat-{i}', school=school) for i in range(count)
+        )
+        return Student.objects.using(database).bulk_create(
+            Student(user=user, school=school, student_id=str(i), name=f'Student {i}', email='bench@example.com')
+            for i, user in enumerate(users)
+        )
+
+    def insert(self, database, students, rows, days):
+        """Insert non-overlapping exeats one at a time, like the API does; returns rows/s"""
+        base = timezone.now() + timedelta(days=days)
+        started = time.perf_counter()
+        for i in range(rows):
+            student = students[i % len(students)]
+            start = base + timedelta(days=2 * (i // len(students)))
+            Exeat.objects.using(database).create(
+                school_id=student.school_id, student=student, reason='benchmark',
+                start_date=start, end_date=start + timedelta(days=1),
+            )
+        return rows / (time.perf_counter() - started)
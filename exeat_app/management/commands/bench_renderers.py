@@ -0,0 +1,72 @@
+import time
+from datetime import timedelta
+from io import BytesIO
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from exeat_app.models import CustomUser, Exeat, House, School, Student
+from exeat_app.renderers import ORJSONParser, ORJSONRenderer
+from exeat_app.serializers import ExeatSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare JSON rendering and parsing throughput on a serialized exeat list'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000)
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        exeats = self.synthetic(options['rows'])
+        started = time.perf_counter()
+        data = ExeatSerializer(exeats, many=True).data
+        self.stdout.write(f'Serialized {len(data):,} exeats in {time.perf_counter() - started:.2f}s')
+
+        rendered = {}
+        for renderer in (JSONRenderer(), ORJSONRenderer()):
+            elapsed, rendered[type(renderer)] = self.best_of(options['repeat'], lambda: renderer.render(data))
+            self.report(f'{type(renderer).__name__} render', elapsed, len(data), len(rendered[type(renderer)]))
+        if rendered[JSONRenderer] != rendered[ORJSONRenderer]:
+            self.stdout.write(self.style.WARNING('Rendered output differs'))
+
+        body = rendered[JSONRenderer]
+        for parser in (JSONParser(), ORJSONParser()):
+            elapsed, _ = self.best_of(options['repeat'], lambda: parser.parse(BytesIO(body)))
+            self.report(f'{type(parser).__name__} parse', elapsed, len(data), len(body))
+
+    def best_of(self, repeat, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def report(self, label, elapsed, rows, size):
+        self.stdout.write(
+            f'{label:>24}: {elapsed * 1000:8.1f}ms  {rows / elapsed:>10,.0f} rows/s  {size / elapsed / 2**20:7.1f} MiB/s'
+        )
+
+    def synthetic(self, rows):
+        """Unsaved exeats with their relations filled in, so no database is needed"""
+        now = timezone.now()
+        school = School(pk=1, name='Benchmark School', code='BENCH', email='bench@example.com',
+                        created_at=now, updated_at=now)
+        houses = [House(pk=i, school=school, name=f'House {i}', created_at=now, updated_at=now) for i in range(1, 9)]
+        exeats = []
+        for i in range(1, rows + 1):
+            user = CustomUser(pk=i, username=f'student{i}', email=f'student{i}@example.com')
+            student = Student(
+                pk=i, user=user, school=school, house=houses[i % len(houses)], student_id=f'S{i:06d}',
+                name=f'Student {i}', email=user.email, created_at=now, updated_at=now,
+            )
+            start = now - timedelta(hours=i % 500)
+            exeats.append(Exeat(
+                pk=i, school=school, student=student, reason='Weekend at home', start_date=start,
+                end_date=start + timedelta(days=2), status='approved', created_at=now, updated_at=now,
+            ))
+        return exeats
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from exeat_app.manifest import build_manifest
+from exeat_app.models import School
+
+
+class Command(BaseCommand):
+    help = "Build every school's gate manifest for a day (schedule it before the gates open)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='YYYY-MM-DD (default: today)')
+
+    def handle(self, *args, **options):
+        day = timezone.localdate()
+        if options['date']:
+            day = parse_date(options['date'])
+            if day is None:
+                raise CommandError('--date must be YYYY-MM-DD')
+        for school in School.objects.using('default').order_by('pk'):
+            manifest = build_manifest(school, day)
+            self.stdout.write(f"  {school}: {manifest['count']} exeats (version {manifest['version']})")
+        self.stdout.write(self.style.SUCCESS(f'Built gate manifests for {day}'))
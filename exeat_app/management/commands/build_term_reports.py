@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from exeat_app.db_routing import shard_aliases
+from exeat_app.models import TermReport
+from exeat_app.reports import build_report
+
+
+class Command(BaseCommand):
+    help = 'Build term reports left pending or failed (e.g. after a worker restart)'
+
+    def handle(self, *args, **options):
+        built = 0
+        for alias in shard_aliases():
+            pending = TermReport.objects.using(alias).filter(status__in=['pending', 'failed'])
+            for report_id in pending.values_list('pk', flat=True):
+                build_report(report_id, using=alias)
+                built += 1
+        self.stdout.write(self.style.SUCCESS(f'Processed {built} term reports'))
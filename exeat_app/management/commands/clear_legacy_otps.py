@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from exeat_app.otp import clear_legacy_otps
+
+
+class Command(BaseCommand):
+    help = 'Wipe OTP data left in the legacy CustomUser.otp columns (also a periodic job)'
+
+    def handle(self, *args, **options):
+        cleared = clear_legacy_otps()
+        self.stdout.write(self.style.SUCCESS(f'Cleared legacy OTPs on {cleared} users'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from exeat_app.conflicts import describe_overlap, find_overlapping_exeats
+from exeat_app.db_routing import shard_aliases
+from exeat_app.models import Exeat
+
+
+class Command(BaseCommand):
+    help = ('List active exeats that overlap another one for the same student '
+            '(reject or cancel one of each pair before migrating to 0005)')
+
+    def handle(self, *args, **options):
+        found = 0
+        for alias in shard_aliases():
+            for earlier, later in find_overlapping_exeats(Exeat.objects.using(alias)):
+                self.stdout.write(f'{alias}: {describe_overlap(earlier, later)}')
+                found += 1
+        if found:
+            self.stdout.write(self.style.WARNING(f'{found} overlapping pairs'))
+        else:
+            self.stdout.write(self.style.SUCCESS('No overlapping exeats'))
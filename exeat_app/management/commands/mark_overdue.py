@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from exeat_app.overdue import mark_overdue_exeats
+
+
+class Command(BaseCommand):
+    help = 'Mark signed out exeats past their end date as overdue'
+
+    def handle(self, *args, **options):
+        marked = mark_overdue_exeats()
+        self.stdout.write(self.style.SUCCESS(f'Marked {marked} exeats as overdue'))
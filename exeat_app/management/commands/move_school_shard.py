@@ -0,0 +1,98 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Q
+
+from exeat_app.db_routing import reserve_id_ranges, shard_aliases, shard_cache_key, shard_for_school
+from exeat_app.models import (AbsenceQuota, Exeat, ExeatEvent, GateScan, House, HouseMistress,
+                              HouseRosterCount, OffCampusEntry, School, SchoolShard, SecurityPerson, Student,
+                              TermReport)
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = "Move a school's data to another shard (pause writes for the school while it runs)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('school_id', type=int)
+        parser.add_argument('database', help='Target database alias from DATABASE_SHARDS')
+
+    def handle(self, *args, **options):
+        school = School.objects.using('default').filter(pk=options['school_id']).first()
+        if school is None:
+            raise CommandError(f"School {options['school_id']} does not exist")
+        target = options['database']
+        if target not in shard_aliases():
+            raise CommandError(f"'{target}' is not a shard (choose from {', '.join(shard_aliases())})")
+        source = shard_for_school(school.pk)
+        if source == target:
+            raise CommandError(f'{school} already lives on {target}')
+
+        reserve_id_ranges()
+        # Rows to move, in foreign key order
+        querysets = [
+            House.objects.filter(school=school),
+            Student.objects.filter(school=school),
+            HouseMistress.objects.filter(school=school),
+            SecurityPerson.objects.filter(school=school),
+            Exeat.objects.filter(Q(school=school) | Q(student__school=school)),
+            ExeatEvent.objects.filter(Q(school=school) | Q(student__school=school)),
+            GateScan.objects.filter(school=school),
+            OffCampusEntry.objects.filter(school=school),
+            HouseRosterCount.objects.filter(school=school),
+            AbsenceQuota.objects.filter(school=school),
+            TermReport.objects.filter(school=school),
+        ]
+
+        with transaction.atomic(using=target):
+            self.copy_reference_data(school, source, target)
+            for queryset in querysets:
+                moved = self.copy(queryset.using(source), target)
+                self.stdout.write(f'  {queryset.model._meta.verbose_name_plural}: {moved}')
+
+        SchoolShard.objects.using('default').update_or_create(school=school, defaults={'database': target})
+        cache.delete(shard_cache_key(school.pk))
+
+        with transaction.atomic(using=source):
+            for queryset in reversed(querysets):
+                # Collect ids first: the filters join through rows deleted earlier
+                ids = list(queryset.using(source).values_list('pk', flat=True))
+                queryset.model._base_manager.using(source).filter(pk__in=ids).delete()
+
+        self.stdout.write(self.style.SUCCESS(f'Moved {school} from {source} to {target}'))
+
+    def copy_reference_data(self, school, source, target):
+        """Make sure the school and every user its rows point at exist on the target"""
+        User = get_user_model()
+        if not School.objects.using(target).filter(pk=school.pk).exists():
+            School.objects.using(target).bulk_create([school])
+
+        user_ids = set(User.objects.using('default').filter(school=school).values_list('pk', flat=True))
+        for model in (Student, HouseMistress, SecurityPerson):
+            user_ids.update(model.objects.using(source).filter(school=school).values_list('user_id', flat=True))
+        exeats = Exeat.objects.using(source).filter(Q(school=school) | Q(student__school=school))
+        for field in ('approved_by', 'signed_out_by', 'signed_in_by'):
+            user_ids.update(exeats.filter(**{f'{field}__isnull': False}).values_list(field, flat=True))
+        user_ids.update(
+            ExeatEvent.objects.using(source).filter(school=school, actor__isnull=False)
+            .values_list('actor', flat=True)
+        )
+
+        present = set(User.objects.using(target).filter(pk__in=user_ids).values_list('pk', flat=True))
+        missing = User.objects.using('default').filter(pk__in=user_ids - present)
+        User.objects.using(target).bulk_create(missing, batch_size=BATCH_SIZE)
+
+    def copy(self, queryset, target):
+        """bulk_create rows on the target keeping their primary keys"""
+        moved = 0
+        batch = []
+        for obj in queryset.order_by('pk').iterator(chunk_size=BATCH_SIZE):
+            batch.append(obj)
+            if len(batch) == BATCH_SIZE:
+                moved += len(queryset.model.objects.using(target).bulk_create(batch))
+                batch = []
+        if batch:
+            moved += len(queryset.model.objects.using(target).bulk_create(batch))
+        return moved
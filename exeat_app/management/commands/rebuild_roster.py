@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from exeat_app.db_routing import shard_aliases
+from exeat_app.models import OffCampusEntry
+from exeat_app.roster import rebuild_roster
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the off campus roster and per-house counts from the exeat table'
+
+    def handle(self, *args, **options):
+        rebuild_roster()
+        off_campus = sum(OffCampusEntry.objects.using(alias).count() for alias in shard_aliases())
+        self.stdout.write(self.style.SUCCESS(f'Roster rebuilt: {off_campus} students off campus'))
@@ -0,0 +1,29 @@
+import re
+
+from django.core.management.base import BaseCommand
+
+from exeat_app.db_routing import shard_aliases
+from exeat_app.models import Student
+from exeat_app.storage import get_photo_storage
+
+CONTENT_NAME = re.compile(r'/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(\.\w+)?$')
+
+
+class Command(BaseCommand):
+    help = 'Move photos uploaded before content-addressed storage to their content names'
+
+    def handle(self, *args, **options):
+        storage = get_photo_storage()
+        moved = 0
+        for alias in shard_aliases():
+            students = Student.objects.using(alias).exclude(photo='').exclude(photo__isnull=True)
+            for pk, name in students.values_list('pk', 'photo').iterator():
+                if CONTENT_NAME.search(name) or not storage.exists(name):
+                    continue
+                with storage.open(name) as photo:
+                    new_name = storage.save(name, photo)
+                Student.objects.using(alias).filter(pk=pk).update(photo=new_name)
+                if not Student.objects.using(alias).filter(photo=name).exists():
+                    storage.delete(name)
+                moved += 1
+        self.stdout.write(self.style.SUCCESS(f'Moved {moved} photos'))
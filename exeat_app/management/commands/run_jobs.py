@@ -0,0 +1,22 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from exeat_app.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Run background jobs (start one process per worker wanted)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--burst', action='store_true', help='Exit once no job is due')
+        parser.add_argument('--name', help='Worker name recorded on claimed jobs (default host:pid)')
+
+    def handle(self, *args, **options):
+        worker = Worker(options['name'])
+        # Finish the current job before exiting
+        signal.signal(signal.SIGTERM, lambda *_: worker.stop())
+        signal.signal(signal.SIGINT, lambda *_: worker.stop())
+        self.stdout.write(f'Worker {worker.name} started')
+        ran = worker.run(burst=options['burst'])
+        self.stdout.write(self.style.SUCCESS(f'Worker {worker.name} stopped after {ran} jobs'))
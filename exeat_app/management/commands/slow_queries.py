@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from exeat_app.slow_queries import captured, clear, top_offenders
+
+
+class Command(BaseCommand):
+    help = 'Print the slowest query fingerprints captured over SLOW_QUERY_MS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20)
+        parser.add_argument('--order', choices=['total', 'max', 'mean', 'count'], default='total')
+        parser.add_argument('--plans', action='store_true', help='Also print a captured EXPLAIN plan for each')
+        parser.add_argument('--clear', action='store_true', help='Empty the buffer afterwards')
+
+    def handle(self, *args, **options):
+        records = captured()
+        if not records:
+            self.stdout.write('No slow queries captured')
+        for group in top_offenders(records, options['order'], options['limit']):
+            self.stdout.write(
+                f"{group['fingerprint']}  {group['count']}x  total {group['total_ms']:.0f}ms  "
+                f"mean {group['mean_ms']:.0f}ms  max {group['max_ms']:.0f}ms"
+            )
+            self.stdout.write(f"  {group['sql'][:300]}")
+            for site in sorted(group['call_sites']):
+                self.stdout.write(f'  at {site}')
+            if options['plans'] and group['plan']:
+                for line in group['plan'].splitlines():
+                    self.stdout.write(f'    {line}')
+            self.stdout.write('')
+        if options['clear']:
+            clear()
@@ -0,0 +1,54 @@
+"""
+Lightweight metrics surface.
+
+Counters are kept in the shared cache so every worker adds to the same
+totals; gauges are callables evaluated when a snapshot is taken. Both are
+exposed to staff through /api/metrics/.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+_counters = {}
+_gauges = {}
+
+
+def _cache():
+    return caches[getattr(settings, 'METRICS_CACHE_ALIAS', 'default')]
+
+
+def counter(name, description=''):
+    """Declare a counter so it shows up in snapshots"""
+    _counters[name] = description
+    return name
+
+
+def gauge(name, func, description=''):
+    """Declare a gauge whose value is func() at snapshot time"""
+    _gauges[name] = (func, description)
+    return name
+
+
+def incr(name, amount=1):
+    cache = _cache()
+    key = f'metrics:{name}'
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, amount)
+
+
+def snapshot():
+    """Current counter and gauge values, plus a hit rate for every .hit/.miss pair"""
+    values = _cache().get_many([f'metrics:{name}' for name in _counters])
+    data = {name: values.get(f'metrics:{name}', 0) for name in sorted(_counters)}
+
+    for name in list(data):
+        if name.endswith('.hit'):
+            prefix = name[:-len('.hit')]
+            lookups = data[name] + data.get(f'{prefix}.miss', 0)
+            data[f'{prefix}.hit_rate'] = round(data[name] / lookups, 4) if lookups else None
+
+    for name, (func, _) in sorted(_gauges.items()):
+        data[name] = func()
+    return data
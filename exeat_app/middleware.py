@@ -0,0 +1,58 @@
+import threading
+
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.deprecation import MiddlewareMixin
+
+
+class LoadSheddingMiddleware(MiddlewareMixin):
+    """
+    Priority-aware load shedding.
+
+    Tracks the number of requests in flight in this process. Once it passes
+    LOAD_SHED_LOW_INFLIGHT, low priority traffic (list polling, password
+    reset) gets a 503 with Retry-After; past LOAD_SHED_NORMAL_INFLIGHT so
+    does normal traffic. Critical views (gate sign out/in) are never shed.
+
+    Views declare their priority with a ``load_priority`` attribute, and
+    viewsets can override it per action with ``action_load_priorities``.
+    """
+    lock = threading.Lock()
+    in_flight = 0
+
+    def process_request(self, request):
+        with self.lock:
+            LoadSheddingMiddleware.in_flight += 1
+        request._load_counted = True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        priority = self.get_priority(request, view_func)
+        if priority == 'critical':
+            return None
+
+        limit = getattr(settings, 'LOAD_SHED_LOW_INFLIGHT' if priority == 'low' else 'LOAD_SHED_NORMAL_INFLIGHT', None)
+        if limit is None or self.in_flight <= limit:
+            return None
+
+        response = JsonResponse(
+            {'error': 'Server is busy, please retry shortly'},
+            status=503
+        )
+        response['Retry-After'] = str(getattr(settings, 'LOAD_SHED_RETRY_AFTER', 5))
+        return response
+
+    def process_response(self, request, response):
+        if getattr(request, '_load_counted', False):
+            request._load_counted = False
+            with self.lock:
+                LoadSheddingMiddleware.in_flight -= 1
+        return response
+
+    def get_priority(self, request, view_func):
+        view_class = getattr(view_func, 'cls', None) or getattr(view_func, 'view_class', None)
+        if view_class is None:
+            return 'normal'
+        actions = getattr(view_func, 'actions', None) or {}
+        action = actions.get(request.method.lower())
+        priorities = getattr(view_class, 'action_load_priorities', {})
+        return priorities.get(action, getattr(view_class, 'load_priority', 'normal'))
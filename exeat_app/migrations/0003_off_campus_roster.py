@@ -0,0 +1,165 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_roster(apps, schema_editor):
+    Exeat = apps.get_model("exeat_app", "Exeat")
+    OffCampusEntry = apps.get_model("exeat_app", "OffCampusEntry")
+    HouseRosterCount = apps.get_model("exeat_app", "HouseRosterCount")
+
+    counts = {}
+    entries = []
+    exeats = Exeat.objects.filter(status__in=["signed_out", "overdue"]).select_related(
+        "student"
+    )
+    for exeat in exeats.iterator():
+        student = exeat.student
+        school_id = exeat.school_id or student.school_id
+        overdue = exeat.status == "overdue"
+        entries.append(
+            OffCampusEntry(
+                exeat=exeat,
+                school_id=school_id,
+                house_id=student.house_id,
+                student=student,
+                student_name=student.name,
+                student_number=student.student_id,
+                signed_out_time=exeat.signed_out_time or exeat.start_date,
+                end_date=exeat.end_date,
+                is_overdue=overdue,
+            )
+        )
+        off_campus, overdue_count = counts.get((school_id, student.house_id), (0, 0))
+        counts[(school_id, student.house_id)] = (
+            off_campus + 1,
+            overdue_count + overdue,
+        )
+
+    OffCampusEntry.objects.bulk_create(entries, batch_size=1000)
+    HouseRosterCount.objects.bulk_create(
+        HouseRosterCount(
+            school_id=school_id,
+            house_id=house_id,
+            off_campus=off_campus,
+            overdue=overdue,
+        )
+        for (school_id, house_id), (off_campus, overdue) in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exeat_app", "0002_exeatevent"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HouseRosterCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("off_campus", models.IntegerField(default=0)),
+                ("overdue", models.IntegerField(default=0)),
+                (
+                    "house",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="exeat_app.house",
+                    ),
+                ),
+                (
+                    "school",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="roster_counts",
+                        to="exeat_app.school",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("school", "house"),
+                        name="unique_roster_count_per_house",
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="OffCampusEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("student_name", models.CharField(max_length=100)),
+                ("student_number", models.CharField(max_length=20)),
+                ("signed_out_time", models.DateTimeField()),
+                ("end_date", models.DateTimeField()),
+                ("is_overdue", models.BooleanField(default=False)),
+                (
+                    "exeat",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="off_campus_entry",
+                        to="exeat_app.exeat",
+                    ),
+                ),
+                (
+                    "house",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="exeat_app.house",
+                    ),
+                ),
+                (
+                    "school",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="exeat_app.school",
+                    ),
+                ),
+                (
+                    "student",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to="exeat_app.student",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Off Campus Entry",
+                "verbose_name_plural": "Off Campus Roster",
+                "ordering": ["end_date"],
+                "indexes": [
+                    models.Index(
+                        fields=["school", "house"],
+                        name="exeat_app_o_school__12f63d_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_roster, migrations.RunPython.noop),
+    ]
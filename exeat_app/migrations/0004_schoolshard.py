@@ -0,0 +1,29 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exeat_app", "0003_off_campus_roster"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SchoolShard",
+            fields=[
+                (
+                    "school",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="shard",
+                        serialize=False,
+                        to="exeat_app.school",
+                    ),
+                ),
+                ("database", models.CharField(max_length=100)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
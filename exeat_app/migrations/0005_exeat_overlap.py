@@ -0,0 +1,45 @@
+import django.contrib.postgres.constraints
+import exeat_app.models
+from django.db import migrations, models
+
+from exeat_app.conflicts import describe_overlap, find_overlapping_exeats
+
+
+def check_overlapping_exeats(apps, schema_editor):
+    """
+    Stop with a list of existing overlaps, which the constraint would fail
+    on; `manage.py find_overlapping_exeats` prints the same list
+    """
+    Exeat = apps.get_model("exeat_app", "Exeat")
+    pairs = find_overlapping_exeats(Exeat.objects.using(schema_editor.connection.alias))
+    if pairs:
+        listing = "\n".join(f"  {describe_overlap(*pair)}" for pair in pairs)
+        raise RuntimeError(
+            "These exeats overlap another active exeat for the same student. "
+            "Reject one of each pair and migrate again:\n" + listing
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exeat_app", "0004_schoolshard"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_overlapping_exeats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="exeat",
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(
+                condition=models.Q(
+                    ("status__in", ["pending", "approved", "signed_out", "overdue"])
+                ),
+                expressions=[
+                    (exeat_app.models.PointRange("student"), "&&"),
+                    (exeat_app.models.TsTzRange("start_date", "end_date"), "&&"),
+                ],
+                name="exclude_overlapping_exeats",
+                violation_error_message="The student already has an exeat overlapping these dates.",
+            ),
+        ),
+    ]
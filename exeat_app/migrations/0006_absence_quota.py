@@ -0,0 +1,62 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exeat_app", "0005_exeat_overlap"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="exeat",
+            name="quota_held",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name="AbsenceQuota",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("capacity", models.PositiveIntegerField()),
+                ("used", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "house",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="absence_quotas",
+                        to="exeat_app.house",
+                    ),
+                ),
+                (
+                    "school",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="absence_quotas",
+                        to="exeat_app.school",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Absence Quota",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("school", "house"),
+                        name="unique_absence_quota_per_house",
+                        nulls_distinct=False,
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,95 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exeat_app", "0007_term_report"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="exeatevent",
+            name="kind",
+            field=models.CharField(
+                choices=[
+                    ("approved", "Approved"),
+                    ("rejected", "Rejected"),
+                    ("signed_out", "Signed Out"),
+                    ("signed_in", "Signed In"),
+                    ("overdue", "Overdue"),
+                    ("updated", "Updated"),
+                    ("deleted", "Deleted"),
+                ],
+                max_length=10,
+            ),
+        ),
+        migrations.CreateModel(
+            name="GateScan",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("scan_id", models.CharField(max_length=64)),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[("sign_out", "Sign Out"), ("sign_in", "Sign In")],
+                        max_length=10,
+                    ),
+                ),
+                ("scanned_at", models.DateTimeField()),
+                (
+                    "result",
+                    models.CharField(
+                        choices=[("applied", "Applied"), ("conflict", "Conflict")],
+                        max_length=10,
+                    ),
+                ),
+                ("reason", models.CharField(blank=True, max_length=50)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "exeat",
+                    models.ForeignKey(
+                        db_constraint=False,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="+",
+                        to="exeat_app.exeat",
+                    ),
+                ),
+                (
+                    "recorded_by",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "school",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="gate_scans",
+                        to="exeat_app.school",
+                    ),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("school", "scan_id"), name="unique_gate_scan_per_school"
+                    )
+                ],
+            },
+        ),
+    ]
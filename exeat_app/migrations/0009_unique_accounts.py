@@ -0,0 +1,60 @@
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import migrations, models
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """
+    Stop with a list of the emails shared by several users (ignoring case);
+    they have to be changed by hand before unique_user_email can be added
+    """
+    User = apps.get_model("exeat_app", "CustomUser")
+    duplicates = list(
+        User.objects.using(schema_editor.connection.alias)
+        .exclude(email="")
+        .annotate(address=Lower("email"))
+        .values("address")
+        .annotate(users=Count("id"), usernames=ArrayAgg("username"))
+        .filter(users__gt=1)
+        .order_by("address")
+    )
+    if duplicates:
+        listing = "\n".join(
+            f"  {row['address']}: {', '.join(sorted(row['usernames']))}"
+            for row in duplicates
+        )
+        raise RuntimeError(
+            "These emails belong to more than one user. Give each user its own "
+            "email (or clear the extras) and migrate again:\n" + listing
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("exeat_app", "0008_gate_sync"),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name="student",
+            unique_together=set(),
+        ),
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name="customuser",
+            constraint=models.UniqueConstraint(
+                condition=models.Q(("email", ""), _negated=True),
+                fields=("email",),
+                name="unique_user_email",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="student",
+            constraint=models.UniqueConstraint(
+                fields=("school", "student_id"), name="unique_student_id_per_school"
+            ),
+        ),
+    ]
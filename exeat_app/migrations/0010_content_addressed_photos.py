@@ -0,0 +1,24 @@
+import exeat_app.storage
+import exeat_app.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("exeat_app", "0009_unique_accounts"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="student",
+            name="photo",
+            field=models.ImageField(
+                blank=True,
+                null=True,
+                storage=exeat_app.storage.get_photo_storage,
+                upload_to="student_photos/",
+                validators=[exeat_app.uploads.validate_photo],
+            ),
+        ),
+    ]
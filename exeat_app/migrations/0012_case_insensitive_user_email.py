@@ -0,0 +1,31 @@
+from importlib import import_module
+
+import django.db.models.functions.text
+from django.db import migrations, models
+
+# Now that case is ignored, addresses differing only in case count as duplicates too
+check_duplicate_emails = import_module("exeat_app.migrations.0009_unique_accounts").check_duplicate_emails
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("exeat_app", "0011_job_queue"),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        migrations.RemoveConstraint(
+            model_name="customuser",
+            name="unique_user_email",
+        ),
+        migrations.AddConstraint(
+            model_name="customuser",
+            constraint=models.UniqueConstraint(
+                django.db.models.functions.text.Lower("email"),
+                condition=models.Q(("email", ""), _negated=True),
+                name="unique_user_email",
+            ),
+        ),
+    ]
@@ -1,7 +1,13 @@
-from time import timezone
 from django.db import models
+from django.db.models.functions import Lower
+from django.utils import timezone
 from django.contrib.auth.models import  AbstractUser, User
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import BigIntegerRangeField, DateTimeRangeField, RangeOperators
 from exeat.settings import AUTH_USER_MODEL
+from . import otp as otp_store
+from .storage import get_photo_storage
+from .uploads import validate_photo
 AUTH_USER_MODEL
 
 
@@ -22,6 +28,16 @@ class School(models.Model):
         ordering = ['name']
 
 
+class SchoolShard(models.Model):
+    """Which database holds a school's data (schools without a row live on 'default')"""
+    school = models.OneToOneField(School, on_delete=models.CASCADE, primary_key=True, related_name='shard')
+    database = models.CharField(max_length=100)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.school_id} -> {self.database}"
+
+
 class SubAdmin(models.Model):
     """School Sub-Admin model"""
     user = models.OneToOneField(AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='subadmin_profile')
@@ -63,12 +79,15 @@ class Student(models.Model):
     house = models.ForeignKey(House, on_delete=models.SET_NULL, null=True, blank=True)
     guardian_name = models.CharField(max_length=100, blank=True)
     guardian_phone = models.CharField(max_length=15, blank=True)
-    photo = models.ImageField(upload_to='student_photos/', blank=True, null=True)
+    photo = models.ImageField(upload_to='student_photos/', storage=get_photo_storage, validators=[validate_photo],
+                              blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
-        unique_together = ('school', 'student_id')
+        constraints = [
+            models.UniqueConstraint(fields=['school', 'student_id'], name='unique_student_id_per_school'),
+        ]
         ordering = ['school', 'name']
 
     def __str__(self):
@@ -116,6 +135,23 @@ class SecurityPerson(models.Model):
 
 
 
+class TsTzRange(models.Func):
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
+class PointRange(models.Func):
+    """[x, x] as an int8range, so GiST can match ids without the btree_gist extension"""
+    function = 'INT8RANGE'
+    template = "%(function)s(%(expressions)s, %(expressions)s, '[]')"
+    output_field = BigIntegerRangeField()
+
+
+# Exeats in these states block any other exeat for the student over the same dates
+ACTIVE_EXEAT_STATUSES = ['pending', 'approved', 'signed_out', 'overdue']
+EXEAT_OVERLAP_CONSTRAINT = 'exclude_overlapping_exeats'
+
+
 class Exeat(models.Model):
     STATUS_CHOICES = [
         ('pending', 'Pending'),
@@ -136,11 +172,24 @@ class Exeat(models.Model):
     signed_out_time = models.DateTimeField(null=True, blank=True)
     signed_in_by = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='signed_in_exeats')
     signed_in_time = models.DateTimeField(null=True, blank=True)
+    # True while the exeat holds a slot in its house/school absence quota
+    quota_held = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        constraints = [
+            ExclusionConstraint(
+                name=EXEAT_OVERLAP_CONSTRAINT,
+                expressions=[
+                    (PointRange('student'), RangeOperators.OVERLAPS),
+                    (TsTzRange('start_date', 'end_date'), RangeOperators.OVERLAPS),
+                ],
+                condition=models.Q(status__in=ACTIVE_EXEAT_STATUSES),
+                violation_error_message='The student already has an exeat overlapping these dates.',
+            ),
+        ]
 
     def __str__(self):
         return f"Exeat for {self.student.name} - {self.status}"
@@ -151,6 +200,219 @@ class Exeat(models.Model):
             return True
         return False
 
+
+class ExeatEvent(models.Model):
+    """Append-only log of exeat state changes, consumed by the live event feed"""
+    KIND_CHOICES = [
+        ('approved', 'Approved'),
+        ('rejected', 'Rejected'),
+        ('signed_out', 'Signed Out'),
+        ('signed_in', 'Signed In'),
+        ('overdue', 'Overdue'),
+        ('updated', 'Updated'),
+        ('deleted', 'Deleted'),
+    ]
+    # No FK constraint so the log outlives deleted exeats
+    exeat = models.ForeignKey(Exeat, on_delete=models.DO_NOTHING, db_constraint=False, related_name='events')
+    # Denormalized from the exeat so feeds can be scoped without joins
+    school = models.ForeignKey(School, on_delete=models.CASCADE, null=True, blank=True, related_name='exeat_events')
+    house = models.ForeignKey(House, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='exeat_events')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    actor = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['school', 'id']),
+            models.Index(fields=['house', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} - exeat {self.exeat_id}"
+
+
+class GateScan(models.Model):
+    """A sign out/in scan uploaded by a gate device, kept so re-uploads are idempotent"""
+    ACTION_CHOICES = [
+        ('sign_out', 'Sign Out'),
+        ('sign_in', 'Sign In'),
+    ]
+    RESULT_CHOICES = [
+        ('applied', 'Applied'),
+        ('conflict', 'Conflict'),
+    ]
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='gate_scans')
+    # Chosen by the device; unique per school
+    scan_id = models.CharField(max_length=64)
+    exeat = models.ForeignKey(Exeat, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    scanned_at = models.DateTimeField()
+    result = models.CharField(max_length=10, choices=RESULT_CHOICES)
+    reason = models.CharField(max_length=50, blank=True)
+    recorded_by = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['school', 'scan_id'], name='unique_gate_scan_per_school'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} exeat {self.exeat_id} ({self.result})"
+
+
+class OffCampusEntry(models.Model):
+    """One row per student currently off campus, maintained by the gate actions"""
+    exeat = models.OneToOneField(Exeat, on_delete=models.CASCADE, related_name='off_campus_entry')
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='+')
+    house = models.ForeignKey(House, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='+')
+    # Denormalized so the roster can be listed without joins
+    student_name = models.CharField(max_length=100)
+    student_number = models.CharField(max_length=20)
+    signed_out_time = models.DateTimeField()
+    end_date = models.DateTimeField()
+    is_overdue = models.BooleanField(default=False)
+
+    class Meta:
+        verbose_name = "Off Campus Entry"
+        verbose_name_plural = "Off Campus Roster"
+        ordering = ['end_date']
+        indexes = [
+            models.Index(fields=['school', 'house']),
+        ]
+
+    def __str__(self):
+        return f"{self.student_name} (exeat {self.exeat_id})"
+
+
+class HouseRosterCount(models.Model):
+    """Running count of off campus students per house (house is null for students without one)"""
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='roster_counts')
+    house = models.ForeignKey(House, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    off_campus = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['school', 'house'],
+                name='unique_roster_count_per_house',
+                nulls_distinct=False
+            ),
+        ]
+
+    def __str__(self):
+        return f"House {self.house_id}: {self.off_campus} off campus"
+
+
+class AbsenceQuota(models.Model):
+    """Cap on students out at once for a house (or the whole school when house is null)"""
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='absence_quotas')
+    house = models.ForeignKey(House, on_delete=models.CASCADE, null=True, blank=True, related_name='absence_quotas')
+    capacity = models.PositiveIntegerField()
+    # Slots held by approved and signed out exeats, maintained by quotas.py
+    used = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Absence Quota"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['school', 'house'],
+                name='unique_absence_quota_per_house',
+                nulls_distinct=False
+            ),
+        ]
+
+    def __str__(self):
+        scope = f"house {self.house_id}" if self.house_id else f"school {self.school_id}"
+        return f"{scope}: {self.used}/{self.capacity}"
+
+
+class TermReport(models.Model):
+    """A generated term report file, kept so each school/term/format is built once"""
+    FORMAT_CHOICES = [
+        ('csv', 'CSV'),
+        ('pdf', 'PDF'),
+    ]
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    school = models.ForeignKey(School, on_delete=models.CASCADE, related_name='term_reports')
+    term_start = models.DateField()
+    term_end = models.DateField()
+    format = models.CharField(max_length=3, choices=FORMAT_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    file = models.FileField(upload_to='term_reports/', blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.ForeignKey(AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['school', 'term_start', 'term_end', 'format'],
+                name='unique_term_report'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.school_id} {self.term_start}..{self.term_end} ({self.format})"
+
+
+class Job(models.Model):
+    """A unit of background work, claimed by `manage.py run_jobs` workers (see jobs.py)"""
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    name = models.CharField(max_length=100)
+    kwargs = models.JSONField(default=dict, blank=True)
+    # Higher runs first
+    priority = models.SmallIntegerField(default=0)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    run_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    periodic = models.BooleanField(default=False)
+    last_error = models.TextField(blank=True)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # What workers scan when claiming
+            models.Index(
+                fields=['-priority', 'run_at'],
+                name='job_ready_idx',
+                condition=models.Q(status='queued')
+            ),
+        ]
+        constraints = [
+            # One pending run per periodic job, however many workers schedule it
+            models.UniqueConstraint(
+                fields=['name'],
+                name='unique_pending_periodic_job',
+                condition=models.Q(periodic=True, status__in=['queued', 'running'])
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
+
+
 class CustomUser(AbstractUser):
     ROLE_CHOICES = (
         ('student', 'Student'),
@@ -176,16 +438,22 @@ class CustomUser(AbstractUser):
         help_text='Specific permissions for this user.',
         verbose_name='user permissions'
     )
+    # Legacy columns, no longer written. OTPs live in the cache (see otp.py)
+    # and clear_legacy_otps wipes anything left here.
     otp = models.CharField(max_length=6, blank=True, null=True)
     otp_created_at = models.DateTimeField(null=True, blank=True)
 
+    class Meta(AbstractUser.Meta):
+        constraints = [
+            # Case-insensitive; migration 0012 lists existing duplicates to fix first
+            models.UniqueConstraint(Lower('email'), condition=~models.Q(email=''), name='unique_user_email'),
+        ]
+
     def set_otp(self, code):
-        self.otp = code
-        self.otp_created_at = timezone.now()
-        self.save()
-    
+        otp_store.store_otp(self, code)
+
     def is_otp_valid(self):
-        if self.otp_created_at:
-            # OTP valid for 5 minutes (adjust as needed)
-            return (timezone.now() - self.otp_created_at) < timezone.timedelta(minutes=5)
-        return False
\ No newline at end of file
+        return otp_store.has_active_otp(self)
+
+    def verify_otp(self, code):
+        return otp_store.verify_otp(self, code)
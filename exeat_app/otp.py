@@ -0,0 +1,82 @@
+"""
+One-time passcodes kept in the cache instead of on the CustomUser row.
+
+Codes are stored as an HMAC digest with a TTL, so they expire on their own
+and issuing or checking one never writes to the user table. A per-code
+attempt counter is incremented atomically and the code is burned once the
+limit is reached.
+"""
+import secrets
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+
+def _cache():
+    return caches[getattr(settings, 'OTP_CACHE_ALIAS', 'default')]
+
+
+def _ttl():
+    return getattr(settings, 'OTP_TTL_SECONDS', 300)
+
+
+def _keys(user):
+    return (f'otp:{user.pk}:code', f'otp:{user.pk}:attempts')
+
+
+def _digest(user, code):
+    return salted_hmac('exeat_app.otp', f'{user.pk}:{code}').hexdigest()
+
+
+def generate_otp(length=6):
+    return ''.join(secrets.choice('0123456789') for _ in range(length))
+
+
+def store_otp(user, code):
+    """Make code the user's active OTP, replacing any earlier one"""
+    code_key, attempts_key = _keys(user)
+    _cache().set_many({code_key: _digest(user, code), attempts_key: 0}, _ttl())
+
+
+def issue_otp(user):
+    """Generate, store and return a new OTP for the user"""
+    code = generate_otp()
+    store_otp(user, code)
+    return code
+
+
+def has_active_otp(user):
+    code_key, _ = _keys(user)
+    return _cache().get(code_key) is not None
+
+
+def verify_otp(user, code):
+    """Check a code, consuming it on success. Returns True or False."""
+    cache = _cache()
+    code_key, attempts_key = _keys(user)
+    try:
+        attempts = cache.incr(attempts_key)
+    except ValueError:
+        # Counter expired along with the code
+        return False
+
+    if attempts > getattr(settings, 'OTP_MAX_ATTEMPTS', 5):
+        cache.delete_many([code_key, attempts_key])
+        return False
+
+    digest = cache.get(code_key)
+    if digest is None or not constant_time_compare(digest, _digest(user, code)):
+        return False
+
+    cache.delete_many([code_key, attempts_key])
+    return True
+
+
+def clear_legacy_otps():
+    """Wipe codes left in the old CustomUser.otp columns. Returns the number of users cleared."""
+    return get_user_model().objects.filter(
+        Q(otp__isnull=False) | Q(otp_created_at__isnull=False)
+    ).update(otp=None, otp_created_at=None)
@@ -0,0 +1,40 @@
+"""
+Overdue sweep: flags signed out exeats whose return time has passed.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .db_routing import shard_aliases, use_shard
+from .events import record_event
+from .models import Exeat
+from .roster import mark_roster_overdue
+
+
+def mark_overdue_exeats(now=None, batch_size=500):
+    """Move signed out exeats past their end_date to 'overdue' on every shard. Returns the count."""
+    now = now or timezone.now()
+    marked = 0
+    for alias in shard_aliases():
+        with use_shard(alias):
+            marked += _mark_overdue_batches(alias, now, batch_size)
+    return marked
+
+
+def _mark_overdue_batches(alias, now, batch_size):
+    marked = 0
+    while True:
+        with transaction.atomic(using=alias):
+            exeats = list(
+                Exeat.objects.select_for_update(skip_locked=True)
+                .select_related('student')
+                .filter(status='signed_out', end_date__lt=now)
+                .order_by('id')[:batch_size]
+            )
+            for exeat in exeats:
+                exeat.status = 'overdue'
+                exeat.save(update_fields=['status', 'updated_at'])
+                record_event(exeat, 'overdue')
+                mark_roster_overdue(exeat)
+        marked += len(exeats)
+        if len(exeats) < batch_size:
+            return marked
@@ -0,0 +1,88 @@
+"""
+Minimal PDF writer for tabular reports.
+
+Produces plain Helvetica text pages (A4 landscape) with no dependencies,
+which is all the term reports need.
+"""
+PAGE_WIDTH, PAGE_HEIGHT = 842, 595
+MARGIN = 36
+FONT_SIZE = 8
+LINE_HEIGHT = 11
+
+
+def _escape(text):
+    text = str(text).encode('latin-1', 'replace').decode('latin-1')
+    return text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def _fit(text, width):
+    # Helvetica averages about half the font size per character
+    max_chars = max(int(width / (FONT_SIZE * 0.5)) - 1, 1)
+    text = str(text)
+    return text if len(text) <= max_chars else text[:max_chars - 1] + '~'
+
+
+def table_pdf(title, headers, rows, widths=None):
+    """Render rows as a paginated table and return the PDF bytes"""
+    usable = PAGE_WIDTH - 2 * MARGIN
+    widths = widths or [1] * len(headers)
+    scale = usable / sum(widths)
+    xs = [MARGIN]
+    for width in widths[:-1]:
+        xs.append(xs[-1] + width * scale)
+
+    def line(y, cells, bold=False):
+        font = '/F2' if bold else '/F1'
+        parts = [f'BT {font} {FONT_SIZE} Tf']
+        for x, width, cell in zip(xs, widths, cells):
+            parts.append(f'1 0 0 1 {x:.1f} {y} Tm ({_escape(_fit(cell, width * scale))}) Tj')
+        parts.append('ET')
+        return '\n'.join(parts)
+
+    rows_per_page = (PAGE_HEIGHT - 2 * MARGIN - 2 * LINE_HEIGHT) // LINE_HEIGHT - 1
+    pages = [rows[i:i + rows_per_page] for i in range(0, len(rows), rows_per_page)] or [[]]
+    streams = []
+    for number, page_rows in enumerate(pages, start=1):
+        y = PAGE_HEIGHT - MARGIN
+        ops = [f'BT /F2 12 Tf 1 0 0 1 {MARGIN} {y} Tm ({_escape(title)}) Tj ET']
+        ops.append(
+            f'BT /F1 {FONT_SIZE} Tf 1 0 0 1 {PAGE_WIDTH - MARGIN - 60} {y} Tm '
+            f'(Page {number} of {len(pages)}) Tj ET'
+        )
+        y -= 2 * LINE_HEIGHT
+        ops.append(line(y, headers, bold=True))
+        for row in page_rows:
+            y -= LINE_HEIGHT
+            ops.append(line(y, row))
+        streams.append('\n'.join(ops).encode('latin-1'))
+
+    # Objects: 1 catalog, 2 page tree, 3-4 fonts, then a page and a content stream per page
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        None,
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    page_ids = []
+    for stream in streams:
+        page_id, content_id = len(objects) + 1, len(objects) + 2
+        page_ids.append(page_id)
+        objects.append(
+            f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] '
+            f'/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_id} 0 R >>'.encode()
+        )
+        objects.append(b'<< /Length %d >>\nstream\n' % len(stream) + stream + b'\nendstream')
+    kids = ' '.join(f'{page_id} 0 R' for page_id in page_ids)
+    objects[1] = f'<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>'.encode()
+
+    out = bytearray(b'%PDF-1.4\n')
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    for offset in offsets:
+        out += b'%010d 00000 n \n' % offset
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
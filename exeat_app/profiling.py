@@ -0,0 +1,191 @@
+"""
+On-demand sampling profiler for single API requests.
+
+Staff add an ``X-Profile: 1`` header (or ``?_profile=1``) to a request.
+While it runs, a background thread samples the request thread's stack
+every PROFILE_INTERVAL_MS milliseconds and the queries on every database
+are counted. The samples are saved as a collapsed-stack file (one
+``frame;frame;frame count`` line per distinct stack, the input format of
+flamegraph.pl and speedscope) plus a small JSON file holding the URL name,
+school, query count and timing. /api/profiles/ lists them.
+
+Requests without the flag only pay for one dictionary lookup. Profiles are
+taken one at a time per process. The staff check runs before the sampler
+starts or the lock is taken, so other users can't tie up the profiler:
+the middleware runs before DRF authenticates, so it checks the session
+user or, failing that, the bearer token (signature only, no query).
+"""
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.utils import timezone
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.exceptions import AuthenticationFailed
+
+from .authentication import SignedTokenAuthentication
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_PARAM = '_profile'
+
+_profiling = threading.Lock()
+
+
+def profile_dir():
+    return str(getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{frame.f_globals.get('__name__', '?')}.{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class StackSampler(threading.Thread):
+    """Counts the distinct stacks of one thread, sampled every interval seconds"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='request-profiler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                names.append(frame_name(frame))
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        return self.stacks
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def save_profile(stacks, meta):
+    """Write the collapsed stacks and their metadata; returns the profile id"""
+    directory = profile_dir()
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f"{int(time.time() * 1000)}-{uuid.uuid4().hex[:8]}"
+    with open(os.path.join(directory, f'{profile_id}.collapsed'), 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump(dict(meta, id=profile_id), f)
+    _prune(directory)
+    return profile_id
+
+
+def _prune(directory):
+    keep = getattr(settings, 'PROFILE_KEEP', 100)
+    ids = sorted(name[:-len('.json')] for name in os.listdir(directory) if name.endswith('.json'))
+    for profile_id in ids[:-keep]:
+        for ext in ('.json', '.collapsed'):
+            try:
+                os.remove(os.path.join(directory, profile_id + ext))
+            except FileNotFoundError:
+                pass
+
+
+def list_profiles(limit=50):
+    """Metadata of the most recent profiles, newest first"""
+    directory = profile_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((name for name in os.listdir(directory) if name.endswith('.json')), reverse=True)
+    profiles = []
+    for name in names[:limit]:
+        try:
+            with open(os.path.join(directory, name)) as f:
+                profiles.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id):
+    """Path of a profile's collapsed stacks, or None if there is no such profile"""
+    if not profile_id.replace('-', '').isalnum():
+        return None
+    path = os.path.join(profile_dir(), f'{profile_id}.collapsed')
+    return path if os.path.isfile(path) else None
+
+
+def profile_requested(request):
+    return PROFILE_HEADER in request.META or PROFILE_PARAM in request.GET
+
+
+def requested_by_staff(request):
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        try:
+            user, _ = SignedTokenAuthentication().authenticate(request) or (None, None)
+        except AuthenticationFailed:
+            return False
+    return user is not None and user.is_staff
+
+
+class ProfilingMiddleware(MiddlewareMixin):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (not profile_requested(request) or not requested_by_staff(request)
+                or not _profiling.acquire(blocking=False)):
+            return None
+        request._profile_queries = QueryCounter()
+        request._profile_wrappers = ExitStack()
+        for alias in connections:
+            request._profile_wrappers.enter_context(connections[alias].execute_wrapper(request._profile_queries))
+        request._profile_started = time.perf_counter()
+        request._profile_sampler = StackSampler(
+            threading.get_ident(), getattr(settings, 'PROFILE_INTERVAL_MS', 5) / 1000
+        )
+        request._profile_sampler.start()
+        return None
+
+    def process_response(self, request, response):
+        sampler = getattr(request, '_profile_sampler', None)
+        if sampler is None:
+            return response
+        request._profile_sampler = None
+        try:
+            stacks = sampler.stop()
+            elapsed = time.perf_counter() - request._profile_started
+            request._profile_wrappers.close()
+
+            user = getattr(request, 'user', None)
+            match = request.resolver_match
+            school_id = request.GET.get('school_id') or getattr(user, 'school_id', None)
+            profile_id = save_profile(stacks, {
+                'url_name': match.url_name if match else None,
+                'path': request.path,
+                'method': request.method,
+                'status': response.status_code,
+                'school_id': int(school_id) if str(school_id or '').isdigit() else None,
+                'queries': request._profile_queries.count,
+                'duration_ms': round(elapsed * 1000, 1),
+                'samples': sum(stacks.values()),
+                'created_at': timezone.now().isoformat(),
+            })
+            response['X-Profile-Id'] = profile_id
+            return response
+        finally:
+            _profiling.release()
@@ -0,0 +1,171 @@
+"""
+values() fast path for list endpoints.
+
+A list normally turns every row into model instances (one per nested
+relation), runs each through the serializer's field objects and builds an
+OrderedDict. compile_projection() instead walks a serializer's readable
+fields once and works out the columns behind them, nested serializers
+included. Projection.rows() then fetches those columns with a single
+values_list() query (the joins come from the column paths) and shapes the
+output dicts straight from the tuples. Every value still goes through its
+field's to_representation(), so the output is the same as the serializer's.
+
+Most fields map to a column on their own. Fields that don't are declared on
+the serializer's Meta as ``read_projection``:
+
+    read_projection = {
+        'approved_by': 'approved_by__username',               # column giving the value
+        'pass_token': ('pk', 'status', 'start_date', 'end_date'),  # columns for get_pass_token()
+    }
+
+A string names the column that the field's to_representation() receives. A
+tuple names the columns a SerializerMethodField needs; its method gets an
+object with just those attributes. A serializer with any other field falls
+back to normal serialization.
+"""
+from types import SimpleNamespace
+
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.relations import PKOnlyObject, PrimaryKeyRelatedField
+from rest_framework.response import Response
+
+
+class Unsupported(Exception):
+    """A field the values() path can't reproduce"""
+
+
+class Projection:
+    def __init__(self, serializer):
+        self.columns = []
+        self.shape = self._compile(serializer, '')
+
+    def rows(self, queryset):
+        shape = self.shape
+        return [shape(row) for row in queryset.values_list(*self.columns)]
+
+    def _column(self, path):
+        self.columns.append(path)
+        return len(self.columns) - 1
+
+    def _compile(self, serializer, prefix):
+        model = serializer.Meta.model
+        declared = getattr(serializer.Meta, 'read_projection', {})
+        getters = [
+            (name, self._field(field, model, prefix, declared.get(name)))
+            for name, field in serializer.fields.items()
+            if not field.write_only
+        ]
+
+        def shape(row):
+            return {name: getter(row) for name, getter in getters}
+        return shape
+
+    def _field(self, field, model, prefix, declared):
+        if isinstance(declared, str):
+            index = self._column(prefix + declared)
+            return _plain(field, index)
+
+        if isinstance(declared, tuple):
+            if not isinstance(field, serializers.SerializerMethodField):
+                raise Unsupported(field.field_name)
+            indexes = [self._column(prefix + name) for name in declared]
+            method = getattr(field.parent, field.method_name)
+
+            def method_value(row):
+                return method(SimpleNamespace(**{name: row[i] for name, i in zip(declared, indexes)}))
+            return method_value
+
+        if field.source == '*':
+            raise Unsupported(field.field_name)
+        path = field.source.split('.')
+
+        if isinstance(field, serializers.ModelSerializer):
+            _resolve(model, path, relation=True)
+            nested_prefix = prefix + '__'.join(path) + '__'
+            # A null foreign key serializes as None rather than a dict of Nones
+            pk = self._column(nested_prefix + 'pk')
+            nested = self._compile(field, nested_prefix)
+
+            def nested_value(row):
+                return None if row[pk] is None else nested(row)
+            return nested_value
+
+        if isinstance(field, PrimaryKeyRelatedField):
+            _resolve(model, path, relation=True)
+            index = self._column(prefix + '__'.join(path))
+
+            def pk_value(row):
+                value = row[index]
+                return None if value is None else field.to_representation(PKOnlyObject(pk=value))
+            return pk_value
+
+        if isinstance(field, serializers.FileField):
+            model_field = _resolve(model, path)
+            index = self._column(prefix + '__'.join(path))
+
+            def file_value(row):
+                name = row[index]
+                return field.to_representation(model_field.attr_class(None, model_field, name)) if name else None
+            return file_value
+
+        if isinstance(field, (serializers.RelatedField, serializers.ManyRelatedField,
+                              serializers.BaseSerializer, serializers.SerializerMethodField,
+                              serializers.HiddenField)):
+            raise Unsupported(field.field_name)
+
+        _resolve(model, path)
+        return _plain(field, self._column(prefix + '__'.join(path)))
+
+
+def _plain(field, index):
+    def value(row):
+        value = row[index]
+        return None if value is None else field.to_representation(value)
+    return value
+
+
+def _resolve(model, path, relation=False):
+    """
+    Check a source path is a column reachable through non-null forward
+    relations (DRF skips the field when a nullable step is None) and
+    return the final model field.
+    """
+    for position, name in enumerate(path):
+        try:
+            model_field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            raise Unsupported(name)
+        if not model_field.concrete or model_field.many_to_many:
+            raise Unsupported(name)
+        last = position == len(path) - 1
+        if not last:
+            if not model_field.is_relation or model_field.null:
+                raise Unsupported(name)
+            model = model_field.related_model
+        elif model_field.is_relation != relation:
+            raise Unsupported(name)
+    return model_field
+
+
+def compile_projection(serializer_class, context=None):
+    """A Projection for the serializer, or None when it has fields the fast path can't handle"""
+    serializer = serializer_class(context=context or {})
+    if not isinstance(serializer, serializers.ModelSerializer):
+        return None
+    try:
+        return Projection(serializer)
+    except Unsupported:
+        return None
+
+
+class ProjectedListMixin:
+    """Serve unpaginated list actions through compile_projection() when the serializer allows"""
+
+    def list(self, request, *args, **kwargs):
+        projection = None
+        if self.paginator is None:
+            projection = compile_projection(self.get_serializer_class(), self.get_serializer_context())
+        if projection is None:
+            return super().list(request, *args, **kwargs)
+        return Response(projection.rows(self.filter_queryset(self.get_queryset())))
@@ -0,0 +1,60 @@
+"""
+Account provisioning for the sub-admin, student, house mistress and
+security create endpoints.
+
+The user row is inserted with its role and school already set, then the
+profile row, and nothing else: duplicate usernames, emails, student ids,
+houses that already have a mistress and schools that already have a
+sub-admin are caught by unique constraints rather than looked up first,
+so two concurrent creates can't both get through. The violated
+constraint's columns are turned into a ProvisioningError naming the field.
+"""
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+
+from .conflicts import violated_columns, violated_constraint
+from .db_routing import is_sharded, shard_for_school
+from .models import HouseMistress, Student, SubAdmin
+
+
+class ProvisioningError(Exception):
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+        self.message = message
+
+
+def _unique_key(model, *fields):
+    return model._meta.db_table, tuple(model._meta.get_field(field).column for field in fields)
+
+
+# Constraints declared on the models are keyed by name; the ones behind
+# unique=True fields, which Django names itself, by (table, columns)
+UNIQUE_ERRORS = {
+    _unique_key(get_user_model(), 'username'): ('username', 'Username already exists'),
+    'unique_user_email': ('email', 'Email already exists'),
+    'unique_student_id_per_school': ('student_id', 'Student ID already exists in this school'),
+    _unique_key(HouseMistress, 'house'): ('house_id', 'This house already has a mistress'),
+    _unique_key(SubAdmin, 'school'): ('school_id', 'This school already has a sub-admin'),
+}
+
+
+def provision_account(profile_model, school, role, user, profile):
+    """
+    Create a user (create_user() arguments in user) with the given role and
+    school, then its profile_model row from the profile fields - one INSERT
+    each. Raises ProvisioningError on a duplicate.
+    """
+    User = get_user_model()
+    # The user lives on 'default'; the profile on the school's shard if sharded
+    using = shard_for_school(school.pk) if is_sharded(profile_model) else 'default'
+    try:
+        with transaction.atomic(), transaction.atomic(using=using):
+            account = User.objects.create_user(role=role, school=school, **user)
+            return profile_model.objects.db_manager(using).create(user=account, school=school, **profile)
+    except IntegrityError as exc:
+        # Every shard carries the full schema, so the profile's database can look up either table
+        error = UNIQUE_ERRORS.get(violated_constraint(exc)) or UNIQUE_ERRORS.get(violated_columns(exc, using))
+        if error is None:
+            raise
+        raise ProvisioningError(*error) from exc
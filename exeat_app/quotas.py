@@ -0,0 +1,83 @@
+"""
+Per-house and per-school caps on how many students are out at once.
+
+Each AbsenceQuota row carries a running ``used`` counter. An exeat takes a
+slot when it is approved (or, if it was approved before the quota existed,
+when it is signed out) and gives it back when it is signed in, rejected or
+deleted. Taking a slot is a single conditional
+
+    UPDATE ... SET used = used + 1 WHERE ... AND used < capacity
+
+so parallel approvals serialize on the counter row and can never push it
+past its capacity, and nothing ever counts Exeat rows.
+"""
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+
+from .models import AbsenceQuota, Exeat
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, level):
+        self.level = level
+        super().__init__(f'The {level} absence quota is full')
+
+
+def _levels(school_id, house_id):
+    levels = []
+    if house_id is not None:
+        levels.append(('house', Q(school_id=school_id, house_id=house_id)))
+    levels.append(('school', Q(school_id=school_id, house__isnull=True)))
+    return levels
+
+
+def take_slots(school_id, house_id, count=1, using='default'):
+    """
+    Take count slots from the house and school quotas, if they have one.
+    Raises QuotaExceeded when either is full; call inside a transaction so
+    a slot already taken at the house level is rolled back with it.
+    """
+    for level, condition in _levels(school_id, house_id):
+        quotas = AbsenceQuota.objects.using(using).filter(condition)
+        if quotas.filter(used__lte=F('capacity') - count).update(used=F('used') + count):
+            continue
+        # Nothing updated: either there is no quota here or it is full
+        if quotas.exists():
+            raise QuotaExceeded(level)
+
+
+def release_slots(school_id, house_id, count=1, using='default'):
+    """Give back count slots to the house and school quotas"""
+    condition = Q(school_id=school_id, house__isnull=True)
+    if house_id is not None:
+        condition |= Q(school_id=school_id, house_id=house_id)
+    AbsenceQuota.objects.using(using).filter(condition).update(used=Greatest(F('used') - count, 0))
+
+
+def lock_exeat(exeat):
+    """
+    Lock the exeat row and refresh status and quota_held, so parallel
+    actions on it see each other's changes and can't double count
+    """
+    exeat.status, exeat.quota_held = (
+        Exeat.objects.using(exeat._state.db).select_for_update()
+        .values_list('status', 'quota_held').get(pk=exeat.pk)
+    )
+
+
+def hold_quota(exeat):
+    """Take a slot for an exeat unless it already holds one (the caller saves the exeat)"""
+    lock_exeat(exeat)
+    if exeat.quota_held:
+        return
+    take_slots(exeat.school_id, exeat.student.house_id, using=exeat._state.db)
+    exeat.quota_held = True
+
+
+def release_quota(exeat):
+    """Give back the exeat's slot, if it holds one (the caller saves the exeat)"""
+    lock_exeat(exeat)
+    if not exeat.quota_held:
+        return
+    release_slots(exeat.school_id, exeat.student.house_id, using=exeat._state.db)
+    exeat.quota_held = False
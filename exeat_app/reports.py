@@ -0,0 +1,154 @@
+"""
+Term-end student reports.
+
+The per-student numbers (exeats taken, days away, late returns, who
+approved them) and each student's standing in their house are computed in
+one Postgres query with GROUP BY and window functions, so no Exeat rows are
+loaded into Python. Files are rendered by a job worker (jobs.py) and kept as
+TermReport rows: each school/term/format is generated once and later
+requests download the stored file.
+"""
+import csv
+import io
+import logging
+from datetime import datetime, time, timedelta
+
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+
+from .db_routing import shard_for_school
+from .jobs import enqueue
+from .models import CustomUser, Exeat, House, School, Student, TermReport
+from .pdf import table_pdf
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = [
+    ('student_number', 'Student ID'),
+    ('name', 'Name'),
+    ('house', 'House'),
+    ('exeats', 'Exeats'),
+    ('days_away', 'Days away'),
+    ('late_returns', 'Late returns'),
+    ('house_rank', 'Rank in house'),
+    ('house_avg_days', 'House avg days'),
+    ('approvers', 'Approved by'),
+]
+
+TERM_REPORT_SQL = """
+WITH per_student AS (
+    SELECT
+        s.id,
+        s.student_id AS student_number,
+        s.name,
+        h.name AS house,
+        h.id AS house_id,
+        COUNT(e.id) AS exeats,
+        -- Students still out count until now if overdue, else until their end date
+        COALESCE(SUM(
+            EXTRACT(EPOCH FROM COALESCE(
+                e.signed_in_time,
+                CASE WHEN e.status = 'overdue' THEN %(now)s ELSE LEAST(e.end_date, %(now)s) END
+            ) - e.signed_out_time)
+        ) FILTER (WHERE e.signed_out_time IS NOT NULL), 0) / 86400.0 AS days_away,
+        COUNT(e.id) FILTER (WHERE e.signed_in_time > e.end_date OR e.status = 'overdue') AS late_returns,
+        STRING_AGG(
+            DISTINCT COALESCE(NULLIF(TRIM(u.first_name || ' ' || u.last_name), ''), u.username), ', '
+        ) AS approvers
+    FROM {student} s
+    LEFT JOIN {exeat} e
+        ON e.student_id = s.id AND e.start_date >= %(start)s AND e.start_date < %(end)s
+    LEFT JOIN {house} h ON h.id = s.house_id
+    LEFT JOIN {user} u ON u.id = e.approved_by_id
+    WHERE s.school_id = %(school_id)s
+    GROUP BY s.id, h.id
+)
+SELECT
+    student_number,
+    name,
+    house,
+    exeats,
+    ROUND(days_away::numeric, 2) AS days_away,
+    late_returns,
+    RANK() OVER (PARTITION BY house_id ORDER BY days_away DESC) AS house_rank,
+    ROUND((AVG(days_away) OVER (PARTITION BY house_id))::numeric, 2) AS house_avg_days,
+    COALESCE(approvers, '') AS approvers
+FROM per_student
+ORDER BY house NULLS LAST, name
+""".format(
+    student=Student._meta.db_table,
+    exeat=Exeat._meta.db_table,
+    house=House._meta.db_table,
+    user=CustomUser._meta.db_table,
+)
+
+
+def term_rows(school_id, term_start, term_end):
+    """One tuple per student in COLUMNS order, for exeats starting within the term (end date inclusive)"""
+    start = timezone.make_aware(datetime.combine(term_start, time.min))
+    end = timezone.make_aware(datetime.combine(term_end + timedelta(days=1), time.min))
+    with connections[shard_for_school(school_id)].cursor() as cursor:
+        cursor.execute(TERM_REPORT_SQL, {
+            'school_id': school_id, 'start': start, 'end': end, 'now': timezone.now(),
+        })
+        return cursor.fetchall()
+
+
+def render_csv(rows):
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow([label for _, label in COLUMNS])
+    writer.writerows(rows)
+    return out.getvalue().encode()
+
+
+def render_pdf(school, report, rows):
+    title = f'{school.name} term report {report.term_start:%d %b %Y} - {report.term_end:%d %b %Y}'
+    widths = [1.2, 2.4, 1.4, 0.7, 0.9, 0.9, 0.9, 1.1, 3]
+    return table_pdf(title, [label for _, label in COLUMNS], rows, widths)
+
+
+def build_report(report_id, using='default'):
+    """Generate and store a TermReport's file (the term_report job)"""
+    claimed = TermReport.objects.using(using).filter(
+        pk=report_id, status__in=['pending', 'failed']
+    ).update(status='running', error='')
+    if not claimed:
+        return
+    report = TermReport.objects.using(using).get(pk=report_id)
+    try:
+        school = School.objects.get(pk=report.school_id)
+        rows = term_rows(report.school_id, report.term_start, report.term_end)
+        content = render_csv(rows) if report.format == 'csv' else render_pdf(school, report, rows)
+        name = f'{school.code}_{report.term_start:%Y%m%d}_{report.term_end:%Y%m%d}.{report.format}'
+        if report.file:
+            # Regenerating: drop the previous file
+            report.file.delete(save=False)
+        report.file.save(name, ContentFile(content), save=False)
+        report.status = 'ready'
+        report.completed_at = timezone.now()
+        report.save(using=using, update_fields=['file', 'status', 'completed_at'])
+    except Exception as exc:
+        logger.exception('Term report %s failed', report_id)
+        TermReport.objects.using(using).filter(pk=report_id).update(status='failed', error=str(exc))
+
+
+def schedule_report(report):
+    """Queue the report's build once the current transaction commits"""
+    using = report._state.db
+    transaction.on_commit(lambda: enqueue('term_report', report_id=report.pk, using=using), using=using)
+
+
+def request_report(school, term_start, term_end, fmt, user=None, refresh=False):
+    """Get the report for a school/term/format, scheduling generation when it isn't ready yet"""
+    report, created = TermReport.objects.get_or_create(
+        school=school, term_start=term_start, term_end=term_end, format=fmt,
+        defaults={'requested_by': user},
+    )
+    if created or report.status == 'failed' or (refresh and report.status == 'ready'):
+        if not created:
+            TermReport.objects.filter(pk=report.pk).update(status='pending', requested_by=user)
+            report.status = 'pending'
+        schedule_report(report)
+    return report
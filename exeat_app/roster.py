@@ -0,0 +1,78 @@
+"""
+Materialized "currently off campus" roster.
+
+OffCampusEntry holds one row per student who is out and HouseRosterCount
+keeps a counter per house. Both are updated in the same transaction as
+sign_out, sign_in and the overdue sweep, so answering "who is out right
+now?" never has to scan or join the Exeat table.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .db_routing import shard_aliases, use_shard
+from .models import Exeat, HouseRosterCount, OffCampusEntry
+
+
+def _bump(school_id, house_id, **deltas):
+    """Atomically add deltas to a house's counter row, creating it if needed"""
+    counts = HouseRosterCount.objects.filter(school_id=school_id, house_id=house_id)
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if counts.update(**updates):
+        return
+    try:
+        with transaction.atomic(using=counts.db):
+            HouseRosterCount.objects.create(school_id=school_id, house_id=house_id, **deltas)
+    except IntegrityError:
+        # Another transaction created the row first
+        counts.update(**updates)
+
+
+def add_to_roster(exeat):
+    """Record a student as off campus (call when the exeat is signed out)"""
+    student = exeat.student
+    school_id = exeat.school_id or student.school_id
+    OffCampusEntry.objects.create(
+        exeat=exeat,
+        school_id=school_id,
+        house_id=student.house_id,
+        student_id=student.pk,
+        student_name=student.name,
+        student_number=student.student_id,
+        signed_out_time=exeat.signed_out_time,
+        end_date=exeat.end_date,
+        is_overdue=exeat.status == 'overdue',
+    )
+    _bump(school_id, student.house_id, off_campus=1, overdue=int(exeat.status == 'overdue'))
+
+
+def remove_from_roster(exeat):
+    """Take a student off the roster (call when signed in or the exeat is deleted)"""
+    entry = OffCampusEntry.objects.filter(exeat=exeat).first()
+    if entry is None:
+        return
+    entry.delete()
+    _bump(entry.school_id, entry.house_id, off_campus=-1, overdue=-int(entry.is_overdue))
+
+
+def mark_roster_overdue(exeat):
+    """Flag a roster entry as overdue (call from the overdue sweep)"""
+    entry = OffCampusEntry.objects.filter(exeat=exeat, is_overdue=False).first()
+    if entry is None:
+        return
+    OffCampusEntry.objects.filter(pk=entry.pk).update(is_overdue=True)
+    _bump(entry.school_id, entry.house_id, overdue=1)
+
+
+def rebuild_roster():
+    """Rebuild the roster and counters from the Exeat table on every shard"""
+    for alias in shard_aliases():
+        with use_shard(alias), transaction.atomic(using=alias):
+            OffCampusEntry.objects.all().delete()
+            HouseRosterCount.objects.all().delete()
+            exeats = (
+                Exeat.objects.filter(status__in=['signed_out', 'overdue'])
+                .select_related('student')
+                .order_by('id')
+            )
+            for exeat in exeats.iterator(chunk_size=2000):
+                add_to_roster(exeat)
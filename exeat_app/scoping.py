@@ -0,0 +1,78 @@
+"""
+Role-based visibility rules for exeats.
+
+Every endpoint that exposes exeat data (the REST list, the live event feed)
+goes through these helpers so the rules only live in one place.
+"""
+from .models import House, School
+
+
+def exeat_scope(user):
+    """
+    Work out which exeats a user may see.
+
+    Returns a ``(kind, value)`` pair:
+      ('all', None)        - Django admin users
+      ('school', School)   - sub-admins and security personnel
+      ('house', House)     - house mistresses
+      ('student', user)    - everybody else only sees their own exeats
+
+    Users authenticated by a signed token carry their scope from the
+    token's claims, so this costs no profile queries for them.
+    """
+    token_scope = getattr(user, 'token_scope', None)
+    if token_scope is not None:
+        return token_scope
+    if user.is_staff:
+        return ('all', None)
+    elif hasattr(user, 'subadmin_profile'):
+        return ('school', user.subadmin_profile.school)
+    elif hasattr(user, 'housemistress_profile'):
+        return ('house', user.housemistress_profile.house)
+    elif hasattr(user, 'security_profile'):
+        return ('school', user.security_profile.school)
+    return ('student', user)
+
+
+def scope_from_claims(user, claims):
+    """
+    exeat_scope() rebuilt from access token claims: 'scp' is the scope kind
+    worked out when the token was issued, 'sch' and 'hse' the school and
+    house ids. The School/House are unsaved stand-ins with only ids set,
+    which is all the scope filters use. Tokens issued without 'scp'
+    return None and fall back to the profile lookups.
+    """
+    kind = claims.get('scp')
+    if kind == 'all':
+        return ('all', None)
+    elif kind == 'school':
+        return ('school', School(pk=claims['sch']))
+    elif kind == 'house':
+        return ('house', House(pk=claims['hse'], school_id=claims['sch']))
+    elif kind == 'student':
+        return ('student', user)
+    return None
+
+
+def scope_exeats(queryset, scope):
+    """Restrict an Exeat queryset to the given scope"""
+    kind, value = scope
+    if kind == 'all':
+        return queryset
+    elif kind == 'school':
+        return queryset.filter(school=value)
+    elif kind == 'house':
+        return queryset.filter(student__house=value)
+    return queryset.filter(student__user=value)
+
+
+def scope_students(queryset, scope):
+    """Restrict a Student queryset to the students whose exeats the scope can see"""
+    kind, value = scope
+    if kind == 'all':
+        return queryset
+    elif kind == 'school':
+        return queryset.filter(school=value)
+    elif kind == 'house':
+        return queryset.filter(house=value)
+    return queryset.filter(user=value)
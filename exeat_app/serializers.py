@@ -1,6 +1,10 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from .models import Student, Exeat, HouseMistress, House, School, SubAdmin, SecurityPerson
+from django.urls import reverse
+from .gate import GATE_STATUSES
+from .manifest import pass_token
+from .uploads import validate_photo
+from .models import AbsenceQuota, GateScan, TermReport, Student, Exeat, HouseMistress, House, School, SubAdmin, SecurityPerson
 
 User = get_user_model()
 
@@ -40,7 +44,7 @@ class StudentSerializer(serializers.ModelSerializer):
         write_only=True,
         source='school'
     )
-    photo = serializers.ImageField(required=False)
+    photo = serializers.ImageField(required=False, validators=[validate_photo])
     username = serializers.CharField(source='user.username', read_only=True)
     email_user = serializers.EmailField(source='user.email', read_only=True)
 
@@ -111,27 +115,137 @@ class SubAdminSerializer(serializers.ModelSerializer):
 
 class ExeatSerializer(serializers.ModelSerializer):
     student = StudentSerializer(read_only=True)
+    # The school comes from the student, loaded in the same query
     student_id = serializers.PrimaryKeyRelatedField(
-        queryset=Student.objects.all(),
+        queryset=Student.objects.select_related('school', 'user'),
         write_only=True,
         source='student'
     )
     school = SchoolSerializer(read_only=True)
-    school_id = serializers.PrimaryKeyRelatedField(
-        queryset=School.objects.all(),
-        write_only=True,
-        source='school'
-    )
+    # Optional; must match the student's school when given
+    school_id = serializers.IntegerField(write_only=True, required=False)
     approved_by = serializers.StringRelatedField(read_only=True)
     signed_out_by = serializers.StringRelatedField(read_only=True)
     signed_in_by = serializers.StringRelatedField(read_only=True)
+    # Shown at the gate; only issued while the gate may act on the exeat
+    pass_token = serializers.SerializerMethodField()
 
     class Meta:
         model = Exeat
         fields = ['id', 'school', 'school_id', 'student', 'student_id', 'reason', 'start_date', 
                   'end_date', 'status', 'approved_by', 'signed_out_by', 'signed_out_time', 
-                  'signed_in_by', 'signed_in_time', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'approved_by', 'signed_out_by', 'signed_in_by', 'created_at', 'updated_at']
+                  'signed_in_by', 'signed_in_time', 'pass_token', 'created_at', 'updated_at']
+        # status only changes through the approve/reject/sign_out/sign_in actions,
+        # which take and give back absence quota slots
+        read_only_fields = ['id', 'status', 'approved_by', 'signed_out_by', 'signed_in_by',
+                            'created_at', 'updated_at']
+        # Columns for the list fast path (see projection.py); users print as their username
+        read_projection = {
+            'approved_by': 'approved_by__username',
+            'signed_out_by': 'signed_out_by__username',
+            'signed_in_by': 'signed_in_by__username',
+            'pass_token': ('pk', 'status', 'start_date', 'end_date'),
+        }
+
+    def validate(self, attrs):
+        start_date = attrs.get('start_date', getattr(self.instance, 'start_date', None))
+        end_date = attrs.get('end_date', getattr(self.instance, 'end_date', None))
+        if start_date and end_date and end_date < start_date:
+            raise serializers.ValidationError({'end_date': 'Must be after start_date'})
+
+        school_id = attrs.pop('school_id', None)
+        student = attrs.get('student') or getattr(self.instance, 'student', None)
+        if student is None:
+            return attrs
+        if school_id is not None and school_id != student.school_id:
+            raise serializers.ValidationError({'school_id': "Does not match the student's school"})
+        attrs['school'] = student.school
+        return attrs
+
+    def get_pass_token(self, exeat):
+        if exeat.status not in GATE_STATUSES:
+            return None
+        return pass_token(exeat.pk, exeat.start_date, exeat.end_date)
+
+class AbsenceQuotaSerializer(serializers.ModelSerializer):
+    house_id = serializers.PrimaryKeyRelatedField(
+        queryset=House.objects.all(),
+        write_only=True,
+        required=False,
+        allow_null=True,
+        source='house'
+    )
+
+    class Meta:
+        model = AbsenceQuota
+        fields = ['id', 'school', 'house', 'house_id', 'capacity', 'used', 'updated_at']
+        read_only_fields = ['id', 'school', 'house', 'used', 'updated_at']
+
+
+class TermReportSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TermReport
+        fields = ['id', 'school', 'term_start', 'term_end', 'format', 'status', 'error',
+                  'download_url', 'created_at', 'completed_at']
+        read_only_fields = fields
+        read_projection = {'download_url': ('pk', 'status')}
+
+    def get_download_url(self, obj):
+        if obj.status != 'ready':
+            return None
+        request = self.context.get('request')
+        url = reverse('term-report-download', args=[obj.pk])
+        return request.build_absolute_uri(url) if request else url
+
+
+class TermReportRequestSerializer(serializers.Serializer):
+    term_start = serializers.DateField()
+    term_end = serializers.DateField()
+    format = serializers.ChoiceField(choices=TermReport.FORMAT_CHOICES, default='csv')
+    refresh = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['term_end'] < attrs['term_start']:
+            raise serializers.ValidationError({'term_end': 'Must not be before term_start'})
+        return attrs
+
+
+class ExeatCampaignSerializer(serializers.Serializer):
+    reason = serializers.CharField()
+    start_date = serializers.DateTimeField()
+    end_date = serializers.DateTimeField()
+    # Neither means every student in the school
+    house_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    student_ids = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False, max_length=20000
+    )
+    approve = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if attrs['end_date'] < attrs['start_date']:
+            raise serializers.ValidationError({'end_date': 'Must be after start_date'})
+        if attrs.get('house_ids') and attrs.get('student_ids'):
+            raise serializers.ValidationError('Give house_ids or student_ids, not both')
+        return attrs
+
+
+class GateScanUploadSerializer(serializers.Serializer):
+    scan_id = serializers.CharField(max_length=64)
+    exeat_id = serializers.IntegerField()
+    action = serializers.ChoiceField(choices=GateScan.ACTION_CHOICES)
+    scanned_at = serializers.DateTimeField()
+
+
+class GateScanBatchSerializer(serializers.Serializer):
+    scans = GateScanUploadSerializer(many=True, allow_empty=False, max_length=500)
+
+    def validate_scans(self, scans):
+        if len({scan['scan_id'] for scan in scans}) != len(scans):
+            raise serializers.ValidationError('scan_id values must be unique within a batch')
+        return scans
+
 
 class ForgotPasswordSerializer(serializers.Serializer):
     email = serializers.EmailField()
@@ -148,6 +262,15 @@ class PasswordResetConfirmSerializer(serializers.Serializer):
     new_password = serializers.CharField(min_length=8)
 
 
+class TokenObtainSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    password = serializers.CharField(write_only=True)
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    refresh = serializers.CharField()
+
+
 class APISuccessResponseStructureSerializer(serializers.Serializer):
     """Standard structure for API success responses"""
     status = serializers.IntegerField()
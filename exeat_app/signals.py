@@ -0,0 +1,57 @@
+import copy
+
+from django.contrib.auth import get_user_model
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import invalidate_cached_user
+from .db_routing import shard_aliases
+from .models import HouseMistress, School, SecurityPerson, Student, SubAdmin
+from .slow_queries import install as install_slow_query_capture
+
+PROFILE_MODELS = (SubAdmin, HouseMistress, SecurityPerson, Student)
+
+# Reference data written to 'default' and copied to every other shard
+MIRRORED_MODELS = (School, get_user_model())
+
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def drop_cached_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+def drop_cached_profile_user(sender, instance, **kwargs):
+    invalidate_cached_user(instance.user_id)
+
+
+for model in PROFILE_MODELS:
+    post_save.connect(drop_cached_profile_user, sender=model, dispatch_uid=f'drop_cached_user_{model.__name__}')
+    post_delete.connect(drop_cached_profile_user, sender=model, dispatch_uid=f'drop_cached_user_{model.__name__}_delete')
+
+
+def mirror_to_shards(sender, instance, using, raw=False, **kwargs):
+    if raw or using != 'default':
+        return
+    for alias in shard_aliases():
+        if alias != 'default':
+            # Save a copy so the caller's instance stays bound to 'default'
+            copy.copy(instance).save(using=alias)
+
+
+def delete_from_shards(sender, instance, using, **kwargs):
+    if using != 'default':
+        return
+    for alias in shard_aliases():
+        if alias != 'default':
+            sender._base_manager.using(alias).filter(pk=instance.pk).delete()
+
+
+for model in MIRRORED_MODELS:
+    post_save.connect(mirror_to_shards, sender=model, dispatch_uid=f'mirror_{model.__name__}')
+    post_delete.connect(delete_from_shards, sender=model, dispatch_uid=f'mirror_{model.__name__}_delete')
+
+
+@receiver(connection_created)
+def capture_slow_queries(sender, connection, **kwargs):
+    install_slow_query_capture(connection)
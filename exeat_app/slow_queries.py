@@ -0,0 +1,182 @@
+"""
+Slow query capture.
+
+Every database connection gets an execute wrapper (installed from
+signals.py when the connection opens) that times each statement. A
+statement taking SLOW_QUERY_MS or longer is recorded with:
+- its fingerprint: the SQL with literals and parameter lists taken out,
+  so the same query from different requests groups together
+- the call site: the innermost exeat_app frame and the view it ran under
+- how long it took, and on which database
+- for a SLOW_QUERY_EXPLAIN_RATE sample, its EXPLAIN (ANALYZE, BUFFERS)
+  plan. Only SELECTs are run again under ANALYZE; writes get a plain
+  EXPLAIN.
+
+Records go to a ring buffer of SLOW_QUERY_BUFFER slots in the shared
+cache, so `manage.py slow_queries` sees every worker's (point
+CACHE_BACKEND at Redis or Memcached for that, as for the throttles).
+"""
+import hashlib
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import metrics
+
+SLOW_QUERIES = metrics.counter('db.slow_queries', 'Statements over SLOW_QUERY_MS')
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_capturing = threading.local()
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*%s(?:\s*,\s*%s)*\s*\)', re.IGNORECASE)
+_VALUES = re.compile(r'\bVALUES\s*\([^()]*\)(?:\s*,\s*\([^()]*\))*', re.IGNORECASE)
+_SPACE = re.compile(r'\s+')
+
+
+def _cache():
+    return caches[getattr(settings, 'METRICS_CACHE_ALIAS', 'default')]
+
+
+def threshold_ms():
+    return getattr(settings, 'SLOW_QUERY_MS', 200)
+
+
+def normalize(sql):
+    """The SQL with literals as %s, and IN lists and VALUES rows of any length as (...)"""
+    sql = _STRING.sub('%s', sql)
+    sql = _NUMBER.sub('%s', sql)
+    sql = _IN_LIST.sub('IN (...)', sql)
+    sql = _VALUES.sub('VALUES (...)', sql)
+    return _SPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:16]
+
+
+def call_site():
+    """(innermost exeat_app frame, outermost exeat_app.views frame) of the current stack"""
+    site = view = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(APP_DIR) and filename != __file__:
+            code = frame.f_code
+            where = f"{frame.f_globals.get('__name__')}.{getattr(code, 'co_qualname', code.co_name)}:{frame.f_lineno}"
+            if site is None:
+                site = where
+            if frame.f_globals.get('__name__') == 'exeat_app.views':
+                view = where
+        frame = frame.f_back
+    return site, view
+
+
+def explain(connection, sql, params):
+    """EXPLAIN plan text for a statement, or None if it can't be explained"""
+    if connection.vendor != 'postgresql' or ';' in sql.strip().rstrip(';'):
+        return None
+    analyze = sql.lstrip()[:6].upper() == 'SELECT'
+    prefix = 'EXPLAIN (ANALYZE, BUFFERS) ' if analyze else 'EXPLAIN '
+    try:
+        # A savepoint so a failed EXPLAIN doesn't abort the caller's transaction
+        with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+    except DatabaseError:
+        return None
+
+
+def record(connection, sql, params, many, duration):
+    site, view = call_site()
+    plan = None
+    if not many and random.random() < getattr(settings, 'SLOW_QUERY_EXPLAIN_RATE', 0.01):
+        plan = explain(connection, sql, params)
+
+    cache = _cache()
+    size = getattr(settings, 'SLOW_QUERY_BUFFER', 500)
+    try:
+        slot = cache.incr('slow_queries:next')
+    except ValueError:
+        cache.add('slow_queries:next', 0, None)
+        slot = cache.incr('slow_queries:next')
+    cache.set(f'slow_queries:{slot % size}', {
+        'fingerprint': fingerprint(sql),
+        'sql': normalize(sql)[:2000],
+        'database': connection.alias,
+        'duration_ms': round(duration * 1000, 1),
+        'call_site': site,
+        'view': view,
+        'plan': plan,
+        'at': timezone.now().isoformat(),
+    }, None)
+    metrics.incr(SLOW_QUERIES)
+
+
+def capture(execute, sql, params, many, context):
+    if getattr(_capturing, 'active', False):
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = time.perf_counter() - started
+    threshold = threshold_ms()
+    if threshold and duration * 1000 >= threshold:
+        _capturing.active = True
+        try:
+            record(context['connection'], sql, params, many, duration)
+        finally:
+            _capturing.active = False
+    return result
+
+
+def install(connection):
+    """Add the capture wrapper to a connection (once; it stays across reconnects)"""
+    if threshold_ms() > 0 and capture not in connection.execute_wrappers:
+        # Outermost, so execute_wrapper() blocks opened before this pop their own wrapper
+        connection.execute_wrappers.insert(0, capture)
+
+
+def captured():
+    """Every record in the ring buffer"""
+    size = getattr(settings, 'SLOW_QUERY_BUFFER', 500)
+    return list(_cache().get_many([f'slow_queries:{slot}' for slot in range(size)]).values())
+
+
+def clear():
+    size = getattr(settings, 'SLOW_QUERY_BUFFER', 500)
+    _cache().delete_many(['slow_queries:next'] + [f'slow_queries:{slot}' for slot in range(size)])
+
+
+def top_offenders(records, order='total', limit=20):
+    """Records grouped by fingerprint, with counts and timings, worst first"""
+    groups = {}
+    for entry in records:
+        group = groups.setdefault(entry['fingerprint'], {
+            'fingerprint': entry['fingerprint'],
+            'sql': entry['sql'],
+            'count': 0,
+            'total_ms': 0.0,
+            'max_ms': 0.0,
+            'call_sites': set(),
+            'plan': None,
+        })
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        group['call_sites'].add(entry['view'] or entry['call_site'] or '?')
+        if entry['plan']:
+            group['plan'] = entry['plan']
+    for group in groups.values():
+        group['mean_ms'] = group['total_ms'] / group['count']
+    key = {'total': 'total_ms', 'max': 'max_ms', 'mean': 'mean_ms', 'count': 'count'}[order]
+    return sorted(groups.values(), key=lambda group: group[key], reverse=True)[:limit]
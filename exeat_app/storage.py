@@ -0,0 +1,83 @@
+"""
+Content-addressed file storage for student photos.
+
+Files are stored under <upload_to>/<aa>/<bb>/<sha256><ext>, named by the
+SHA-256 of their content, so re-uploading the same photo stores nothing
+new and a stored file never changes. That is what lets media_response()
+hand them to the web server with year-long cache headers.
+"""
+import hashlib
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import FileSystemStorage
+from django.http import FileResponse, Http404, HttpResponse
+
+
+def content_hash(content):
+    """SHA-256 of a file, reusing the hash PhotoUploadHandler took while streaming"""
+    digest = getattr(content, 'content_hash', None)
+    if digest:
+        return digest
+    sha = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        sha.update(chunk)
+    content.seek(0)
+    return sha.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def content_name(self, name, content):
+        digest = content_hash(content)
+        ext = os.path.splitext(name)[1].lower()
+        return os.path.join(os.path.dirname(name), digest[:2], digest[2:4], digest + ext)
+
+    def _save(self, name, content):
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        saved = super()._save(name, content)
+        if saved != name:
+            # Someone stored the same content in the meantime
+            self.delete(saved)
+        return name
+
+
+photo_storage = ContentAddressedStorage()
+
+
+def get_photo_storage():
+    return photo_storage
+
+
+def media_response(storage, name):
+    """
+    Response for a stored file. With MEDIA_SERVING set to 'x-accel-redirect'
+    (nginx) or 'x-sendfile' (Apache, lighttpd) only headers are returned and
+    the web server sends the file; otherwise Django streams it.
+    """
+    try:
+        path = storage.path(name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(path):
+        raise Http404
+
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    mode = getattr(settings, 'MEDIA_SERVING', 'django')
+    if mode == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + name)
+    elif mode == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    # Content-addressed names never change content; private as they need a login
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
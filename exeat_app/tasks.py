@@ -0,0 +1,18 @@
+"""
+The jobs workers can run (see jobs.py). Imported when the app loads so
+every process knows them by name.
+"""
+from django.conf import settings
+
+from .jobs import purge_finished_jobs, register
+from .otp import clear_legacy_otps
+from .overdue import mark_overdue_exeats
+from .reports import build_report
+
+register('term_report', build_report, priority=10)
+
+register('mark_overdue', mark_overdue_exeats, priority=5,
+         every=getattr(settings, 'OVERDUE_SWEEP_SECONDS', 60))
+register('clear_legacy_otps', clear_legacy_otps,
+         every=getattr(settings, 'LEGACY_OTP_SWEEP_SECONDS', 3600))
+register('purge_finished_jobs', purge_finished_jobs, every=86400)
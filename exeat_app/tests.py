@@ -0,0 +1,1496 @@
+import asyncio
+import gzip
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+import uuid
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.db import connections, transaction
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework import renderers
+from rest_framework.exceptions import ParseError
+from rest_framework.test import APIClient
+
+from . import analytics, jobs, otp, profiling
+from .admin import EstimatedCountPaginator
+from .authentication import user_from_claims
+from .backends import CachedModelBackend, user_cache_key
+from .conflicts import find_overlapping_exeats
+from .db_routing import (DatabaseRoutingMiddleware, RoutingState, ShardReplicaRouter, _routing_state, pin_school,
+                         shard_cache_key, shard_for_school, sticky_key, use_shard)
+from .events import fetch_events, latest_event_id, record_event, stream_events
+from .gate import sign_out_exeat
+from .manifest import get_manifest, manifest_delta, pass_token
+from .models import (EXEAT_OVERLAP_CONSTRAINT, AbsenceQuota, CustomUser, Exeat, ExeatEvent, GateScan, House,
+                     HouseMistress, HouseRosterCount, OffCampusEntry, School, SchoolShard, SecurityPerson, Student,
+                     SubAdmin, Job, TermReport)
+from .projection import compile_projection
+from .provisioning import ProvisioningError, provision_account
+from .overdue import mark_overdue_exeats
+from .quotas import QuotaExceeded, hold_quota
+from .renderers import ORJSONParser, ORJSONRenderer
+from .reports import build_report, term_rows
+from .rollup import school_rollup, sort_rows
+from .roster import rebuild_roster
+from .scoping import exeat_scope
+from .serializers import (AbsenceQuotaSerializer, ExeatSerializer, HouseMistressSerializer, HouseSerializer,
+                          SchoolSerializer, SecurityPersonSerializer, StudentSerializer)
+from .throttling import IPRateThrottle
+from .tokens import issue_tokens, verify_access_token
+
+
+def make_school(test):
+    """A school with two houses, a sub-admin, a house mistress, security and a student with a pending exeat"""
+    cache.clear()
+    test.school = School.objects.create(name='Test School', code='TS', email='school@example.com')
+    test.house = House.objects.create(school=test.school, name='Red')
+    test.house2 = House.objects.create(school=test.school, name='Blue')
+    test.admin = CustomUser.objects.create_user('admin', 'admin@example.com', 'pw', is_staff=True, role='admin')
+    test.subadmin_user = CustomUser.objects.create_user(
+        'subadmin', 'subadmin@example.com', 'pw', role='subadmin', school=test.school
+    )
+    SubAdmin.objects.create(user=test.subadmin_user, school=test.school)
+    test.mistress_user = CustomUser.objects.create_user(
+        'mistress', 'mistress@example.com', 'pw', role='house_mistress', school=test.school
+    )
+    HouseMistress.objects.create(
+        user=test.mistress_user, school=test.school, name='Mistress', email='mistress@example.com', house=test.house
+    )
+    test.security_user = CustomUser.objects.create_user(
+        'security', 'security@example.com', 'pw', role='security', school=test.school
+    )
+    SecurityPerson.objects.create(user=test.security_user, school=test.school, name='Guard', email='guard@example.com')
+    test.student = make_student(test.school, test.house, '001')
+    now = timezone.now()
+    test.exeat = Exeat.objects.create(
+        school=test.school, student=test.student, reason='Visit', start_date=now, end_date=now + timedelta(days=2)
+    )
+
+
+def make_student(school, house, number):
+    user = CustomUser.objects.create_user(
+        f'student{number}', f'student{number}@example.com', 'pw', role='student', school=school
+    )
+    return Student.objects.create(
+        user=user, school=school, student_id=number, name=f'Student {number}',
+        email=f'student{number}@example.com', house=house
+    )
+
+
+def client_for(user):
+    client = APIClient()
+    client.force_authenticate(user)
+    return client
+
+
+class RunInThreads:
+    """Start func(arg) for every arg at once and collect the results (or exceptions) in order"""
+
+    def __init__(self, func, args):
+        self.results = [None] * len(args)
+        barrier = threading.Barrier(len(args))
+
+        def run(index, arg):
+            try:
+                barrier.wait()
+                self.results[index] = func(arg)
+            except Exception as exc:
+                self.results[index] = exc
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=run, args=(index, arg)) for index, arg in enumerate(args)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+
+@override_settings(REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'ip': '5/min'},
+})
+class ThrottleTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # DRF caches api_settings; reload them for the override
+        from rest_framework.settings import api_settings
+        api_settings.reload()
+        self.addCleanup(api_settings.reload)
+
+    def request(self):
+        return RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')
+
+    def test_limit_holds_under_concurrent_requests(self):
+        allowed = RunInThreads(lambda _: IPRateThrottle().allow_request(self.request(), None), range(20)).results
+        self.assertEqual(allowed.count(True), 5)
+
+    @mock.patch('exeat_app.throttling.time.time', return_value=60 * 1000 + 30)
+    def test_refused_requests_get_a_wait_and_do_not_count(self, _):
+        throttle = IPRateThrottle()
+        for _ in range(5):
+            self.assertTrue(throttle.allow_request(self.request(), None))
+        self.assertFalse(throttle.allow_request(self.request(), None))
+        self.assertEqual(throttle.wait(), 30)
+        self.assertEqual(cache.get('throttle:ip:10.0.0.1:1000'), 5)
+
+    def test_previous_window_still_counts(self):
+        cache.set('throttle:ip:10.0.0.1:999', 4)
+        with mock.patch('exeat_app.throttling.time.time', return_value=60 * 1000 + 30):
+            # Half of the previous window's 4 requests still fall within the last minute
+            results = [IPRateThrottle().allow_request(self.request(), None) for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TokenScopeTests(TestCase):
+    def setUp(self):
+        make_school(self)
+
+    def test_scope_comes_from_the_claims(self):
+        cases = [
+            (self.admin, ('all', None)),
+            (self.subadmin_user, ('school', self.school.pk)),
+            (self.security_user, ('school', self.school.pk)),
+            (self.mistress_user, ('house', self.house.pk)),
+            (self.student.user, ('student', self.student.user.pk)),
+        ]
+        for user, expected in cases:
+            claims = verify_access_token(issue_tokens(CustomUser.objects.get(pk=user.pk))['access'])
+            with self.subTest(user=user.username), self.assertNumQueries(0):
+                kind, value = exeat_scope(user_from_claims(claims))
+                self.assertEqual((kind, value.pk if value is not None else None), expected)
+
+    def test_scoped_list_matches_the_profile_scope(self):
+        other = make_student(self.school, self.house2, '002')
+        Exeat.objects.create(school=self.school, student=other, reason='Other house',
+                             start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1))
+        token = issue_tokens(self.mistress_user)['access']
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        response = client.get('/api/exeats/')
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results'] if isinstance(response.data, dict) else response.data
+        self.assertEqual([row['id'] for row in results], [self.exeat.pk])
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ShardReplicaRouter()
+        self.user = CustomUser(pk=1, username='reader', role='subadmin')
+        request = RequestFactory().get('/api/exeats/')
+        request.user = self.user
+        self.state = RoutingState(request)
+        self.state.read_only = True
+        token = _routing_state.set(self.state)
+        self.addCleanup(_routing_state.reset, token)
+
+    def test_reads_go_to_the_replica_and_writes_to_the_primary(self):
+        self.assertEqual(self.router.db_for_read(School), 'replica')
+        self.assertEqual(self.router.db_for_read(Exeat), 'replica')
+        self.assertEqual(self.router.db_for_write(School), 'default')
+        self.assertEqual(self.router.db_for_write(Exeat), 'default')
+
+    def test_reads_outside_read_only_views_stay_on_the_primary(self):
+        self.state.read_only = False
+        self.assertEqual(self.router.db_for_read(Exeat), 'default')
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        request = RequestFactory().post('/api/exeats/')
+        request.user = self.user
+        middleware = DatabaseRoutingMiddleware(lambda request: None)
+        middleware.process_request(request)
+        middleware.process_response(request, mock.Mock(status_code=201))
+        self.assertTrue(cache.get(sticky_key(self.user.pk)))
+        self.assertEqual(self.router.db_for_read(Exeat), 'default')
+
+
+@unittest.skipUnless(settings.DATABASE_REPLICAS, 'needs a replica alias (set DB_REPLICA_HOSTS)')
+class ReplicaRoutingTests(TransactionTestCase):
+    """End to end over a real second alias, mirrored to the test database"""
+    databases = '__all__'
+
+    def setUp(self):
+        make_school(self)
+        self.replica = settings.DATABASE_REPLICAS[0]
+
+    def test_list_reads_from_the_replica_until_the_user_writes(self):
+        with override_settings(DATABASE_REPLICAS=[self.replica]):
+            client = client_for(self.mistress_user)
+            with CaptureQueriesContext(connections[self.replica]) as replica, \
+                    CaptureQueriesContext(connections['default']) as primary:
+                response = client.get('/api/exeats/')
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(replica.captured_queries)
+            self.assertFalse([q for q in primary.captured_queries if 'exeat_app_exeat' in q['sql']])
+
+            response = client.post(f'/api/exeats/{self.exeat.pk}/approve/')
+            self.assertEqual(response.status_code, 200)
+            with CaptureQueriesContext(connections[self.replica]) as replica:
+                response = client.get('/api/exeats/')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(replica.captured_queries, [])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.other = make_student(self.school, self.house2, '002')
+        self.client = client_for(self.subadmin_user)
+        start = timezone.now() + timedelta(days=7)
+        self.body = {
+            'student_id': self.other.pk, 'reason': 'Dentist',
+            'start_date': start.isoformat(), 'end_date': (start + timedelta(days=1)).isoformat(),
+        }
+
+    def post(self, body, key='retry-1'):
+        return self.client.post('/api/exeats/', body, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post(self.body)
+        self.assertEqual(first.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', first)
+
+        retry = self.post(self.body)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(Exeat.objects.filter(student=self.other).count(), 1)
+
+    def test_reused_key_with_a_different_body_is_refused(self):
+        self.assertEqual(self.post(self.body).status_code, 201)
+        response = self.post({**self.body, 'reason': 'Something else'})
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Exeat.objects.filter(student=self.other).count(), 1)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class OverlapTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.client = client_for(self.subadmin_user)
+
+    def test_overlapping_exeat_is_refused(self):
+        response = self.client.post('/api/exeats/', {
+            'student_id': self.student.pk, 'reason': 'Overlaps',
+            'start_date': (self.exeat.start_date + timedelta(days=1)).isoformat(),
+            'end_date': (self.exeat.end_date + timedelta(days=1)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('error', response.data)
+        self.assertEqual(Exeat.objects.filter(student=self.student).count(), 1)
+
+    def test_back_to_back_exeat_is_allowed(self):
+        response = self.client.post('/api/exeats/', {
+            'student_id': self.student.pk, 'reason': 'Next weekend',
+            'start_date': (self.exeat.end_date + timedelta(days=1)).isoformat(),
+            'end_date': (self.exeat.end_date + timedelta(days=2)).isoformat(),
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_find_overlapping_exeats_lists_existing_pairs(self):
+        # Data from before the constraint existed (the drop is rolled back with the test)
+        with connections['default'].cursor() as cursor:
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute(f'ALTER TABLE exeat_app_exeat DROP CONSTRAINT {EXEAT_OVERLAP_CONSTRAINT}')
+        start, end = self.exeat.start_date, self.exeat.end_date
+
+        def add(student, status, start_date, end_date):
+            return Exeat.objects.create(school=self.school, student=student, reason='Old', status=status,
+                                        start_date=start_date, end_date=end_date)
+
+        overlapping = add(self.student, 'approved', start + timedelta(hours=1), end + timedelta(days=1))
+        add(self.student, 'rejected', start, end)
+        add(self.student, 'pending', end + timedelta(days=1), end + timedelta(days=2))
+        add(make_student(self.school, self.house, '002'), 'pending', start, end)
+
+        pairs = find_overlapping_exeats(Exeat.objects.all())
+        self.assertEqual([(a.pk, b.pk) for a, b in pairs], [(self.exeat.pk, overlapping.pk)])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class QuotaConcurrencyTests(TransactionTestCase):
+    """Parallel approvals, sign outs and releases against one AbsenceQuota row"""
+    capacity = 3
+    students = 8
+
+    def setUp(self):
+        make_school(self)
+        self.quota = AbsenceQuota.objects.create(school=self.school, house=self.house, capacity=self.capacity)
+        now = timezone.now()
+        self.exeats = [self.exeat] + [
+            Exeat.objects.create(
+                school=self.school, student=make_student(self.school, self.house, f'{i:03}'), reason='Visit',
+                start_date=now, end_date=now + timedelta(days=2)
+            )
+            for i in range(2, self.students + 1)
+        ]
+
+    def used(self):
+        self.quota.refresh_from_db()
+        return self.quota.used
+
+    def approve(self, exeat):
+        return client_for(self.mistress_user).post(f'/api/exeats/{exeat.pk}/approve/').status_code
+
+    def test_parallel_approvals_fill_the_quota_exactly(self):
+        codes = RunInThreads(self.approve, self.exeats).results
+        self.assertEqual(codes.count(200), self.capacity)
+        self.assertEqual(codes.count(409), self.students - self.capacity)
+        self.assertEqual(self.used(), self.capacity)
+        self.assertEqual(Exeat.objects.filter(status='approved', quota_held=True).count(), self.capacity)
+
+    def test_parallel_hold_quota_calls_fill_the_quota_exactly(self):
+        def approve(exeat):
+            exeat = Exeat.objects.select_related('student').get(pk=exeat.pk)
+            with transaction.atomic():
+                hold_quota(exeat)
+                exeat.status = 'approved'
+                exeat.save()
+            return True
+
+        results = RunInThreads(approve, self.exeats).results
+        self.assertEqual(results.count(True), self.capacity)
+        self.assertEqual(sum(isinstance(r, QuotaExceeded) for r in results), self.students - self.capacity)
+        self.assertEqual(self.used(), self.capacity)
+
+    def test_parallel_sign_outs_fill_the_quota_exactly(self):
+        # Approved before the quota existed, so the slot is taken at the gate
+        Exeat.objects.update(status='approved', approved_by=self.mistress_user)
+
+        def sign_out(exeat):
+            sign_out_exeat(Exeat.objects.select_related('student').get(pk=exeat.pk), self.security_user)
+            return True
+
+        results = RunInThreads(sign_out, self.exeats).results
+        self.assertEqual(results.count(True), self.capacity)
+        self.assertEqual(sum(isinstance(r, QuotaExceeded) for r in results), self.students - self.capacity)
+        self.assertEqual(self.used(), self.capacity)
+        self.assertEqual(Exeat.objects.filter(status='signed_out').count(), self.capacity)
+
+    def approve_to_capacity(self):
+        held = self.exeats[:self.capacity]
+        for exeat in held:
+            self.assertEqual(self.approve(exeat), 200)
+        self.assertEqual(self.used(), self.capacity)
+        return held
+
+    def test_parallel_rejects_release_each_slot_once(self):
+        held = self.approve_to_capacity()
+        # Every exeat but the last is rejected twice at the same time
+        released = held[:-1] * 2
+        client = client_for(self.mistress_user)
+        codes = RunInThreads(lambda exeat: client.post(f'/api/exeats/{exeat.pk}/reject/').status_code, released).results
+        # The loser of each pair finds the exeat already rejected
+        self.assertEqual(sorted(codes), [200] * len(held[:-1]) + [400] * len(held[:-1]))
+        self.assertEqual(self.used(), 1)
+        self.assertEqual(Exeat.objects.filter(quota_held=True).count(), 1)
+
+    def test_parallel_deletes_release_each_slot_once(self):
+        held = self.approve_to_capacity()
+        deleted = held[:-1] * 2
+        client = client_for(self.subadmin_user)
+        codes = RunInThreads(lambda exeat: client.delete(f'/api/exeats/{exeat.pk}/').status_code, deleted).results
+        self.assertEqual(codes.count(204), len(held) - 1)
+        self.assertEqual(self.used(), 1)
+
+
+class AnalyticsTests(SimpleTestCase):
+    def columns(self, returns):
+        """One exeat per (student, house, hours late or None if still out), due back at hour 100"""
+        hour = 3600
+        return np.array([
+            [student, house, 0, 100 * hour, 1 * hour, np.nan if late is None else (100 + late) * hour, 1, 9]
+            for student, house, late in returns
+        ], dtype=np.float64)
+
+    def test_lateness_buckets(self):
+        now = datetime.fromtimestamp(110 * 3600, dt_timezone.utc)
+        columns = self.columns([(1, 1, -2), (1, 1, 0.1), (2, 1, 0.5), (2, 2, 2), (3, 2, 30), (3, 2, None)])
+        report = analytics.analyse(columns, now=now)
+
+        distribution = report['lateness_distribution']
+        self.assertEqual(len(distribution), len(analytics.LATENESS_BUCKETS) - 1)
+        self.assertEqual(distribution[0]['from_hours'], analytics.LATE_GRACE_HOURS)
+        for bucket in distribution:
+            self.assertNotEqual(bucket['from_hours'], bucket['to_hours'])
+        counts = {(b['from_hours'], b['to_hours']): b['count'] for b in distribution}
+        self.assertEqual(counts[(0.25, 1)], 1)
+        self.assertEqual(counts[(1, 3)], 1)
+        # Still out, measured against now: 10 hours late
+        self.assertEqual(counts[(6, 12)], 1)
+        self.assertEqual(counts[(24, 48)], 1)
+        self.assertEqual(distribution[-1]['to_hours'], None)
+        self.assertEqual(sum(counts.values()), report['late_returns'])
+        self.assertEqual(report['late_returns'], 4)
+        self.assertEqual(report['exeats'], 6)
+        self.assertEqual(report['returned'], 5)
+        self.assertEqual(report['departure_heatmap'][0][9], 6)
+
+    def test_no_exeats(self):
+        report = analytics.analyse(np.zeros((0, 8)))
+        self.assertEqual(report['exeats'], 0)
+        self.assertEqual([b['count'] for b in report['lateness_distribution']],
+                         [0] * (len(analytics.LATENESS_BUCKETS) - 1))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class GateScanUploadTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        Exeat.objects.filter(pk=self.exeat.pk).update(status='approved', approved_by=self.mistress_user)
+        self.client = client_for(self.security_user)
+        self.scans = {'scans': [
+            {'scan_id': 'gate1-1', 'exeat_id': self.exeat.pk, 'action': 'sign_out',
+             'scanned_at': timezone.now().isoformat()},
+        ]}
+
+    def test_same_scan_uploaded_twice_is_applied_once(self):
+        first = self.client.post('/api/gate/sync/', self.scans, format='json')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.data['applied'], 1)
+        self.assertFalse(first.data['results'][0]['duplicate'])
+
+        second = self.client.post('/api/gate/sync/', self.scans, format='json')
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data['applied'], 0)
+        result = second.data['results'][0]
+        self.assertTrue(result['duplicate'])
+        self.assertEqual(result['result'], first.data['results'][0]['result'])
+
+        self.assertEqual(GateScan.objects.filter(scan_id='gate1-1').count(), 1)
+        self.assertEqual(ExeatEvent.objects.filter(exeat_id=self.exeat.pk, kind='signed_out').count(), 1)
+        self.exeat.refresh_from_db()
+        self.assertEqual(self.exeat.status, 'signed_out')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ProjectionTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        now = timezone.now()
+        other = make_student(self.school, self.house2, '002')
+        # Every nullable relation and timestamp both set and unset
+        Exeat.objects.create(
+            school=self.school, student=other, reason='Home', start_date=now - timedelta(days=3),
+            end_date=now - timedelta(days=1), status='signed_in', approved_by=self.mistress_user,
+            signed_out_by=self.security_user, signed_out_time=now - timedelta(days=3),
+            signed_in_by=self.security_user, signed_in_time=now - timedelta(hours=20),
+        )
+        Exeat.objects.create(
+            school=self.school, student=self.student, reason='Match', start_date=now + timedelta(days=5),
+            end_date=now + timedelta(days=6), status='approved', approved_by=self.subadmin_user,
+        )
+        AbsenceQuota.objects.create(school=self.school, house=self.house, capacity=5)
+        AbsenceQuota.objects.create(school=self.school, capacity=20)
+        self.context = {'request': RequestFactory().get('/api/')}
+
+    def test_projected_rows_equal_serializer_output(self):
+        cases = [
+            (ExeatSerializer, Exeat),
+            (StudentSerializer, Student),
+            (HouseMistressSerializer, HouseMistress),
+            (SecurityPersonSerializer, SecurityPerson),
+            (HouseSerializer, House),
+            (SchoolSerializer, School),
+            (AbsenceQuotaSerializer, AbsenceQuota),
+        ]
+        for serializer_class, model in cases:
+            with self.subTest(serializer=serializer_class.__name__):
+                projection = compile_projection(serializer_class, self.context)
+                self.assertIsNotNone(projection)
+                queryset = model.objects.order_by('pk')
+                expected = [dict(row) for row in serializer_class(queryset, many=True, context=self.context).data]
+                self.assertTrue(expected)
+                rows = projection.rows(queryset)
+                for row, expected_row in zip(rows, expected):
+                    self.assertEqual(list(row), list(expected_row))
+                    for field, value in expected_row.items():
+                        self.assertEqual(row[field], value, f'{serializer_class.__name__}.{field}')
+                self.assertEqual(len(rows), len(expected))
+
+
+class ProvisioningTests(TestCase):
+    def setUp(self):
+        make_school(self)
+
+    def assertDuplicate(self, field, profile_model, role, user, profile):
+        users = CustomUser.objects.count()
+        with self.assertRaises(ProvisioningError) as caught:
+            provision_account(profile_model, self.school, role, user, profile)
+        self.assertEqual(caught.exception.field, field)
+        # The user row is rolled back with the profile
+        self.assertEqual(CustomUser.objects.count(), users)
+
+    def new_student(self, username='new', email='new@example.com', student_id='900'):
+        return (Student, 'student', {'username': username, 'email': email, 'password': 'pw'},
+                {'student_id': student_id, 'name': 'New', 'email': email, 'house': self.house2})
+
+    def test_duplicate_username(self):
+        self.assertDuplicate('username', *self.new_student(username='student001'))
+
+    def test_duplicate_email(self):
+        self.assertDuplicate('email', *self.new_student(email='student001@example.com'))
+
+    def test_duplicate_email_ignores_case(self):
+        self.assertDuplicate('email', *self.new_student(email='Student001@Example.com'))
+
+    def test_duplicate_student_id(self):
+        self.assertDuplicate('student_id', *self.new_student(student_id='001'))
+
+    def test_second_house_mistress(self):
+        self.assertDuplicate(
+            'house_id', HouseMistress, 'house_mistress',
+            {'username': 'mistress2', 'email': 'mistress2@example.com', 'password': 'pw'},
+            {'name': 'Second', 'email': 'mistress2@example.com', 'house': self.house},
+        )
+
+    def test_second_sub_admin(self):
+        self.assertDuplicate(
+            'school_id', SubAdmin, 'subadmin',
+            {'username': 'subadmin2', 'email': 'subadmin2@example.com', 'password': 'pw'},
+            {},
+        )
+
+    def test_new_account_is_created(self):
+        profile_model, role, user, profile = self.new_student()
+        student = provision_account(profile_model, self.school, role, user, profile)
+        self.assertEqual(student.user.role, 'student')
+        self.assertEqual(student.user.school, self.school)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class StudentPhotoTests(TestCase):
+    name = 'ab/cd/abcd1234.jpg'
+
+    def setUp(self):
+        make_school(self)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(media.name, 'student_photos', 'ab', 'cd'))
+        with open(os.path.join(media.name, 'student_photos', self.name), 'wb') as photo:
+            photo.write(b'photo')
+        Student.objects.filter(pk=self.student.pk).update(photo=f'student_photos/{self.name}')
+
+    def get(self, user, name=None):
+        return client_for(user).get(f'/media/student_photos/{name or self.name}')
+
+    def test_visible_to_the_student_and_staff_over_them(self):
+        for user in (self.student.user, self.mistress_user, self.subadmin_user, self.security_user, self.admin):
+            with self.subTest(user=user.username):
+                self.assertEqual(self.get(user).status_code, 200)
+
+    def test_hidden_from_everyone_else(self):
+        other_student = make_student(self.school, self.house, '002')
+        other_school = School.objects.create(name='Other School', code='OS', email='other@example.com')
+        other_mistress = CustomUser.objects.create_user(
+            'mistress2', 'mistress2@example.com', 'pw', role='house_mistress', school=self.school
+        )
+        HouseMistress.objects.create(
+            user=other_mistress, school=self.school, name='Blue Mistress', email='mistress2@example.com',
+            house=self.house2
+        )
+        other_subadmin = CustomUser.objects.create_user(
+            'subadmin2', 'subadmin2@example.com', 'pw', role='subadmin', school=other_school
+        )
+        SubAdmin.objects.create(user=other_subadmin, school=other_school)
+        for user in (other_student.user, other_mistress, other_subadmin):
+            with self.subTest(user=user.username):
+                self.assertEqual(self.get(user).status_code, 404)
+
+    def test_unknown_photo(self):
+        self.assertEqual(self.get(self.admin, 'ab/cd/missing.jpg').status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class CampaignTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        for number in ('002', '003'):
+            make_student(self.school, self.house, number)
+        self.blue = [make_student(self.school, self.house2, number) for number in ('004', '005')]
+        AbsenceQuota.objects.create(school=self.school, house=self.house2, capacity=1)
+        start = self.exeat.start_date + timedelta(days=1)
+        self.body = {'reason': 'Half term', 'start_date': start.isoformat(),
+                     'end_date': (start + timedelta(days=2)).isoformat(), 'approve': True}
+
+    def test_skips_overlapping_and_holds_back_when_the_house_quota_is_full(self):
+        response = client_for(self.subadmin_user).post('/api/exeat-campaigns/', self.body, format='json')
+        self.assertEqual(response.status_code, 201, response.data)
+        summary = response.data['data']
+        self.assertEqual(summary['targeted'], 5)
+        self.assertEqual(summary['skipped_overlapping'], 1)
+        self.assertEqual(summary['created'], 4)
+        self.assertEqual(summary['approved'], 2)
+        self.assertEqual(summary['pending_quota_full'], 2)
+
+        campaign = Exeat.objects.filter(reason='Half term')
+        self.assertFalse(campaign.filter(student=self.student).exists())
+        self.assertEqual(
+            set(campaign.filter(status='approved').values_list('student__house', flat=True)), {self.house.pk}
+        )
+        held_back = campaign.filter(student__in=self.blue)
+        self.assertEqual([(e.status, e.approved_by_id, e.quota_held) for e in held_back], [('pending', None, False)] * 2)
+        for exeat in held_back:
+            self.assertGreater(exeat.updated_at, exeat.created_at)
+        self.assertEqual(AbsenceQuota.objects.get(house=self.house2).used, 0)
+
+        events = ExeatEvent.objects.filter(exeat__in=campaign)
+        self.assertEqual(sorted(events.filter(kind='approved').values_list('student__house', flat=True)),
+                         [self.house.pk] * 2)
+        self.assertEqual(set(events.filter(kind='updated').values_list('exeat', flat=True)),
+                         {e.pk for e in held_back})
+
+    def test_repeating_a_campaign_creates_nothing(self):
+        client = client_for(self.subadmin_user)
+        client.post('/api/exeat-campaigns/', self.body, format='json')
+        response = client.post('/api/exeat-campaigns/', self.body, format='json')
+        summary = response.data['data']
+        self.assertEqual(summary['created'], 0)
+        self.assertEqual(summary['skipped_overlapping'], 5)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ExeatStatusTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        AbsenceQuota.objects.create(school=self.school, house=self.house, capacity=0)
+
+    def test_status_cannot_be_patched(self):
+        for user in (self.student.user, self.subadmin_user, self.admin):
+            with self.subTest(user=user.username):
+                response = client_for(user).patch(
+                    f'/api/exeats/{self.exeat.pk}/', {'status': 'approved'}, format='json'
+                )
+                self.assertIn(response.status_code, (200, 403))
+                self.exeat.refresh_from_db()
+                self.assertEqual(self.exeat.status, 'pending')
+                self.assertFalse(self.exeat.quota_held)
+
+    def test_full_quota_still_refuses_the_approve_action(self):
+        response = client_for(self.mistress_user).post(f'/api/exeats/{self.exeat.pk}/approve/')
+        self.assertEqual(response.status_code, 409)
+        self.exeat.refresh_from_db()
+        self.assertEqual(self.exeat.status, 'pending')
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class GateTransitionConcurrencyTests(TransactionTestCase):
+    """Parallel gate actions on one exeat: the status is checked under the row lock"""
+
+    def setUp(self):
+        make_school(self)
+        Exeat.objects.filter(pk=self.exeat.pk).update(status='approved', approved_by=self.mistress_user)
+
+    def post(self, action):
+        return client_for(self.security_user).post(f'/api/exeats/{self.exeat.pk}/{action}/').status_code
+
+    def off_campus(self):
+        return HouseRosterCount.objects.get(house=self.house).off_campus
+
+    def test_parallel_sign_outs(self):
+        codes = RunInThreads(lambda _: self.post('sign_out'), range(4)).results
+        self.assertEqual(sorted(codes), [200, 400, 400, 400])
+        self.assertEqual(OffCampusEntry.objects.filter(exeat_id=self.exeat.pk).count(), 1)
+        self.assertEqual(self.off_campus(), 1)
+        self.assertEqual(ExeatEvent.objects.filter(exeat_id=self.exeat.pk, kind='signed_out').count(), 1)
+
+    def test_parallel_sign_ins(self):
+        self.assertEqual(self.post('sign_out'), 200)
+        codes = RunInThreads(lambda _: self.post('sign_in'), range(4)).results
+        self.assertEqual(sorted(codes), [200, 400, 400, 400])
+        self.assertFalse(OffCampusEntry.objects.exists())
+        self.assertEqual(self.off_campus(), 0)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ApproveRejectStatusTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.mistress = client_for(self.mistress_user)
+        Exeat.objects.filter(pk=self.exeat.pk).update(status='approved', approved_by=self.mistress_user)
+        response = client_for(self.security_user).post(f'/api/exeats/{self.exeat.pk}/sign_out/')
+        self.assertEqual(response.status_code, 200)
+
+    def assertStillOut(self):
+        self.exeat.refresh_from_db()
+        self.assertEqual(self.exeat.status, 'signed_out')
+        self.assertEqual(OffCampusEntry.objects.filter(exeat_id=self.exeat.pk).count(), 1)
+        self.assertEqual(HouseRosterCount.objects.get(house=self.house).off_campus, 1)
+
+    def test_signed_out_exeat_cannot_be_approved(self):
+        self.assertEqual(self.mistress.post(f'/api/exeats/{self.exeat.pk}/approve/').status_code, 400)
+        self.assertStillOut()
+        # The gate can still sign the student back in
+        response = client_for(self.security_user).post(f'/api/exeats/{self.exeat.pk}/sign_in/')
+        self.assertEqual(response.status_code, 200)
+
+    def test_signed_out_exeat_cannot_be_rejected(self):
+        self.assertEqual(self.mistress.post(f'/api/exeats/{self.exeat.pk}/reject/').status_code, 400)
+        self.assertStillOut()
+
+    def test_rejected_exeat_can_be_approved_again(self):
+        exeat = Exeat.objects.create(
+            school=self.school, student=make_student(self.school, self.house, '002'), reason='Visit',
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1)
+        )
+        self.assertEqual(self.mistress.post(f'/api/exeats/{exeat.pk}/reject/').status_code, 200)
+        self.assertEqual(self.mistress.post(f'/api/exeats/{exeat.pk}/reject/').status_code, 400)
+        self.assertEqual(self.mistress.post(f'/api/exeats/{exeat.pk}/approve/').status_code, 200)
+
+
+@override_settings(DATABASE_REPLICAS=[], REST_FRAMEWORK={
+    **settings.REST_FRAMEWORK,
+    'DEFAULT_THROTTLE_RATES': {**settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], 'school': '3/min', 'gate': '2/min'},
+})
+class GateThrottleTests(TestCase):
+    def setUp(self):
+        from rest_framework.settings import api_settings
+        api_settings.reload()
+        self.addCleanup(api_settings.reload)
+        make_school(self)
+        Exeat.objects.filter(pk=self.exeat.pk).update(status='approved', approved_by=self.mistress_user)
+        self.security = client_for(self.security_user)
+
+    def test_polling_cannot_get_a_sign_out_throttled(self):
+        # The school's budget goes on polling, from several users
+        for client in (self.security, client_for(self.mistress_user), client_for(self.subadmin_user)):
+            self.assertEqual(client.get('/api/exeats/').status_code, 200)
+        self.assertEqual(self.security.get('/api/exeats/').status_code, 429)
+
+        self.assertEqual(self.security.post(f'/api/exeats/{self.exeat.pk}/sign_out/').status_code, 200)
+        self.assertEqual(self.security.get('/api/gate/sync/').status_code, 200)
+        # Gate requests have their own budget
+        self.assertEqual(self.security.post(f'/api/exeats/{self.exeat.pk}/sign_in/').status_code, 429)
+
+
+@override_settings(DATABASE_REPLICAS=[], EXEAT_EVENT_SETTLE_SECONDS=2, EXEAT_EVENT_POLL_INTERVAL=0.05)
+class EventStreamTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.other_exeat = Exeat.objects.create(
+            school=self.school, student=make_student(self.school, self.house2, '002'), reason='Visit',
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1)
+        )
+        self.events = [
+            self.settled(record_event(self.exeat, 'approved')),
+            self.settled(record_event(self.other_exeat, 'approved')),
+            self.settled(record_event(self.exeat, 'signed_out')),
+        ]
+
+    def settled(self, event):
+        ExeatEvent.objects.filter(pk=event.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+        return event
+
+    def test_unsettled_events_wait(self):
+        fresh = record_event(self.exeat, 'signed_in')
+        self.assertEqual([e.pk for e in fetch_events(0)], [e.pk for e in self.events])
+        self.assertEqual(latest_event_id(), self.events[-1].pk)
+        self.settled(fresh)
+        self.assertEqual([e.pk for e in fetch_events(self.events[-1].pk)], [fresh.pk])
+
+    async def test_resume_replays_missed_events_in_scope_then_goes_live(self):
+        stream = stream_events(('house', self.house), {'default': self.events[0].pk})
+        try:
+            self.assertTrue((await stream.__anext__()).startswith('retry:'))
+            # The other house's approval is skipped
+            replayed = await stream.__anext__()
+            self.assertTrue(replayed.startswith(f'id: {self.events[2].pk}\nevent: signed_out\n'))
+
+            await sync_to_async(lambda: [
+                self.settled(record_event(self.other_exeat, 'signed_out')),
+                self.settled(record_event(self.exeat, 'signed_in')),
+            ])()
+            live = await asyncio.wait_for(stream.__anext__(), timeout=5)
+            self.assertIn('event: signed_in\n', live)
+            self.assertIn(f'"exeat_id": {self.exeat.pk}', live)
+        finally:
+            await stream.aclose()
+
+    async def test_student_only_sees_their_own_events(self):
+        stream = stream_events(('student', self.student.user), {'default': 0})
+        try:
+            await stream.__anext__()
+            messages = [await stream.__anext__(), await stream.__anext__()]
+        finally:
+            await stream.aclose()
+        self.assertEqual([m.split('\n')[0] for m in messages], [f'id: {self.events[0].pk}', f'id: {self.events[2].pk}'])
+
+
+@override_settings(SHARD_MAP_CACHE_SECONDS=1)
+class ShardMapCacheTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        # Only the map lookup sees the second shard; nothing is written to it
+        shards = self.settings(DATABASE_SHARDS=['default', 'shard_1'])
+        shards.enable()
+        self.addCleanup(shards.disable)
+
+    def test_workers_follow_a_move_once_their_cache_expires(self):
+        other_worker = LocMemCache('shard-map-tests', {})
+        with mock.patch('exeat_app.db_routing.cache', other_worker):
+            self.assertEqual(shard_for_school(self.school.pk), 'default')
+        self.assertEqual(shard_for_school(self.school.pk), 'default')
+
+        # What move_school_shard does; the delete only reaches this worker's cache
+        SchoolShard.objects.create(school=self.school, database='shard_1')
+        cache.delete(shard_cache_key(self.school.pk))
+
+        self.assertEqual(shard_for_school(self.school.pk), 'shard_1')
+        with mock.patch('exeat_app.db_routing.cache', other_worker):
+            self.assertEqual(shard_for_school(self.school.pk), 'default')
+            time.sleep(1.1)
+            self.assertEqual(shard_for_school(self.school.pk), 'shard_1')
+
+
+@override_settings(DATABASE_REPLICAS=[], PROFILE_INTERVAL_MS=1)
+class ProfilingTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        override = override_settings(PROFILE_DIR=directory.name)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def profiled_get(self, authorization):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=authorization)
+        return client.get(f'/api/exeats/?school_id={self.school.pk}', HTTP_X_PROFILE='1')
+
+    def test_staff_request_is_profiled(self):
+        response = self.profiled_get(f"Bearer {issue_tokens(self.admin)['access']}")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('X-Profile-Id', response)
+
+    def test_other_callers_never_start_the_sampler(self):
+        callers = [f"Bearer {issue_tokens(self.subadmin_user)['access']}", 'Bearer forged', '']
+        for authorization in callers:
+            with mock.patch.object(profiling, 'StackSampler') as sampler:
+                response = self.profiled_get(authorization)
+            sampler.assert_not_called()
+            self.assertNotIn('X-Profile-Id', response)
+        # The profiler is still free for staff
+        self.assertTrue(profiling._profiling.acquire(blocking=False))
+        profiling._profiling.release()
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class TermReportTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.now = timezone.now()
+
+    def days_away(self):
+        today = timezone.localdate()
+        rows = term_rows(self.school.pk, today - timedelta(days=30), today)
+        return {row[0]: row[4] for row in rows}
+
+    def test_overdue_student_counts_until_now(self):
+        Exeat.objects.filter(pk=self.exeat.pk).update(
+            status='overdue', start_date=self.now - timedelta(days=3), end_date=self.now - timedelta(days=1),
+            signed_out_time=self.now - timedelta(days=3)
+        )
+        self.assertAlmostEqual(float(self.days_away()['001']), 3, places=1)
+
+    def test_signed_out_student_counts_until_their_end_date(self):
+        Exeat.objects.filter(pk=self.exeat.pk).update(
+            status='signed_out', start_date=self.now - timedelta(days=2), end_date=self.now + timedelta(days=2),
+            signed_out_time=self.now - timedelta(days=2)
+        )
+        self.assertAlmostEqual(float(self.days_away()['001']), 2, places=1)
+
+    def away(self, exeat, days_ago, days, late=False, **fields):
+        """Mark an exeat signed in after `days` away, starting `days_ago`"""
+        out = self.now - timedelta(days=days_ago)
+        back = out + timedelta(days=days)
+        Exeat.objects.filter(pk=exeat.pk).update(
+            status='signed_in', start_date=out, end_date=back + timedelta(hours=-1 if late else 1),
+            signed_out_time=out, signed_in_time=back, **fields
+        )
+
+    def test_rows_rank_students_within_their_house(self):
+        self.away(self.exeat, 10, 2, late=True, approved_by=self.mistress_user)
+        second = Exeat.objects.create(school=self.school, student=make_student(self.school, self.house, '002'),
+                                      reason='Visit', start_date=self.now, end_date=self.now)
+        self.away(second, 5, 1)
+        make_student(self.school, self.house2, '003')
+        # Started before the term, so not counted
+        before_term = Exeat.objects.create(school=self.school, student=self.student, reason='Old',
+                                           start_date=self.now, end_date=self.now)
+        self.away(before_term, 60, 3)
+
+        today = timezone.localdate()
+        rows = term_rows(self.school.pk, today - timedelta(days=30), today)
+        self.assertEqual([row[:4] + (float(row[4]), row[5], row[6], float(row[7]), row[8]) for row in rows], [
+            ('003', 'Student 003', 'Blue', 0, 0.0, 0, 1, 0.0, ''),
+            ('001', 'Student 001', 'Red', 1, 2.0, 1, 1, 1.5, 'mistress'),
+            ('002', 'Student 002', 'Red', 1, 1.0, 0, 2, 1.5, ''),
+        ])
+
+    def test_build_report_stores_the_csv(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        today = timezone.localdate()
+        report = TermReport.objects.create(
+            school=self.school, term_start=today - timedelta(days=30), term_end=today, format='csv'
+        )
+        with override_settings(MEDIA_ROOT=media.name):
+            build_report(report.pk)
+            report.refresh_from_db()
+            self.assertEqual(report.status, 'ready')
+            with report.file.open('rb') as f:
+                lines = f.read().decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['Student ID', 'Name', 'House'])
+        self.assertEqual(lines[1].split(',')[:4], ['001', 'Student 001', 'Red', '1'])
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class RosterTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        Exeat.objects.filter(pk=self.exeat.pk).update(status='approved')
+        self.security = client_for(self.security_user)
+
+    def counts(self):
+        return list(HouseRosterCount.objects.values_list('house_id', 'off_campus', 'overdue'))
+
+    def roster(self, user):
+        return client_for(user).get('/api/off-campus/').data['data']
+
+    def test_counters_follow_sign_out_overdue_and_sign_in(self):
+        self.assertEqual(self.security.post(f'/api/exeats/{self.exeat.pk}/sign_out/').status_code, 200)
+        self.assertEqual(self.counts(), [(self.house.pk, 1, 0)])
+        roster = self.roster(self.mistress_user)
+        self.assertEqual((roster['total'], roster['overdue']), (1, 0))
+        self.assertEqual([s['exeat_id'] for s in roster['students']], [self.exeat.pk])
+
+        now = timezone.now()
+        Exeat.objects.filter(pk=self.exeat.pk).update(
+            start_date=now - timedelta(hours=3), end_date=now - timedelta(hours=1)
+        )
+        mark_overdue_exeats()
+        self.assertEqual(self.counts(), [(self.house.pk, 1, 1)])
+        self.assertTrue(OffCampusEntry.objects.get().is_overdue)
+        # Rebuilding from the exeat table gives the same counts
+        rebuild_roster()
+        self.assertEqual(self.counts(), [(self.house.pk, 1, 1)])
+
+        self.assertEqual(self.security.post(f'/api/exeats/{self.exeat.pk}/sign_in/').status_code, 200)
+        self.assertEqual(self.counts(), [(self.house.pk, 0, 0)])
+        self.assertFalse(OffCampusEntry.objects.exists())
+        self.assertEqual(self.roster(self.subadmin_user)['total'], 0)
+
+    def test_deleting_a_signed_out_exeat_takes_it_off_the_roster(self):
+        self.security.post(f'/api/exeats/{self.exeat.pk}/sign_out/')
+        self.assertEqual(client_for(self.subadmin_user).delete(f'/api/exeats/{self.exeat.pk}/').status_code, 204)
+        self.assertEqual(self.counts(), [(self.house.pk, 0, 0)])
+        self.assertFalse(OffCampusEntry.objects.exists())
+
+    def test_house_mistress_only_sees_their_house(self):
+        other = Exeat.objects.create(
+            school=self.school, student=make_student(self.school, self.house2, '002'), reason='Visit',
+            status='approved', start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1)
+        )
+        self.security.post(f'/api/exeats/{self.exeat.pk}/sign_out/')
+        self.security.post(f'/api/exeats/{other.pk}/sign_out/')
+        self.assertEqual(self.roster(self.mistress_user)['total'], 1)
+        self.assertEqual(self.roster(self.subadmin_user)['total'], 2)
+        self.assertEqual(client_for(self.student.user).get('/api/off-campus/').status_code, 403)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class AdminTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        CustomUser.objects.filter(pk=self.admin.pk).update(is_superuser=True)
+        self.client.force_login(self.admin)
+
+    def add_exeat(self, house, number, status='pending'):
+        return Exeat.objects.create(
+            school=self.school, student=make_student(self.school, house, number), reason='Visit', status=status,
+            start_date=timezone.now(), end_date=timezone.now() + timedelta(days=1)
+        )
+
+    def run_action(self, action, exeats):
+        return self.client.post('/admin/exeat_app/exeat/', {
+            'action': action, '_selected_action': [exeat.pk for exeat in exeats],
+        })
+
+    def changelist_queries(self, url):
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        urls = ['/admin/exeat_app/exeat/', '/admin/exeat_app/student/', '/admin/exeat_app/housemistress/']
+        # The first request also caches the signed in user
+        self.client.get('/admin/')
+        before = [self.changelist_queries(url) for url in urls]
+        for number in range(2, 7):
+            self.add_exeat(self.house2, f'{number:03}')
+        self.assertEqual([self.changelist_queries(url) for url in urls], before)
+
+    def test_approve_takes_quota_slots_a_house_at_a_time(self):
+        AbsenceQuota.objects.create(school=self.school, house=self.house, capacity=1)
+        same_house = self.add_exeat(self.house, '002')
+        other_house = self.add_exeat(self.house2, '003')
+        signed_out = self.add_exeat(self.house2, '004', status='signed_out')
+
+        response = self.run_action('approve_exeats', [self.exeat, same_house, other_house, signed_out])
+        self.assertEqual(response.status_code, 302)
+        statuses = dict(Exeat.objects.values_list('pk', 'status'))
+        # Red needs two slots and has one, so neither of its exeats is approved
+        self.assertEqual(
+            [statuses[e.pk] for e in (self.exeat, same_house, other_house, signed_out)],
+            ['pending', 'pending', 'approved', 'signed_out']
+        )
+        self.assertEqual(AbsenceQuota.objects.get().used, 0)
+        self.assertEqual(Exeat.objects.get(pk=other_house.pk).approved_by, self.admin)
+        self.assertEqual(list(ExeatEvent.objects.values_list('exeat_id', 'kind')), [(other_house.pk, 'approved')])
+
+    def test_reject_gives_back_held_slots(self):
+        AbsenceQuota.objects.create(school=self.school, house=self.house, capacity=1)
+        self.run_action('approve_exeats', [self.exeat])
+        self.assertEqual(AbsenceQuota.objects.get().used, 1)
+
+        self.run_action('reject_exeats', [self.exeat])
+        exeat = Exeat.objects.get(pk=self.exeat.pk)
+        self.assertEqual((exeat.status, exeat.quota_held), ('rejected', False))
+        self.assertEqual(AbsenceQuota.objects.get().used, 0)
+        self.assertEqual(
+            list(ExeatEvent.objects.values_list('kind', flat=True).order_by('pk')), ['approved', 'rejected']
+        )
+
+    def test_paginator_estimates_unfiltered_counts(self):
+        with connections['default'].cursor() as cursor:
+            cursor.execute(f'ANALYZE {Exeat._meta.db_table}')
+        self.add_exeat(self.house2, '002')
+        with mock.patch.object(EstimatedCountPaginator, 'exact_count_threshold', 1):
+            # The planner's estimate still reflects the single row analyzed
+            self.assertEqual(EstimatedCountPaginator(Exeat.objects.all(), 100).count, 1)
+            self.assertEqual(EstimatedCountPaginator(Exeat.objects.filter(status='pending'), 100).count, 2)
+
+
+@override_settings(OTP_TTL_SECONDS=300, OTP_MAX_ATTEMPTS=3)
+class OTPTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.user = self.student.user
+
+    def test_code_works_once_without_touching_the_database(self):
+        with CaptureQueriesContext(connections['default']) as queries:
+            code = otp.issue_otp(self.user)
+            self.assertTrue(self.user.is_otp_valid())
+            self.assertFalse(self.user.verify_otp('wrong'))
+            self.assertTrue(self.user.verify_otp(code))
+            self.assertFalse(self.user.verify_otp(code))
+            self.assertFalse(self.user.is_otp_valid())
+        self.assertEqual(len(queries), 0)
+
+    def test_code_is_burned_after_max_attempts(self):
+        code = otp.issue_otp(self.user)
+        for _ in range(3):
+            self.assertFalse(self.user.verify_otp('wrong'))
+        self.assertFalse(self.user.verify_otp(code))
+        self.assertFalse(self.user.is_otp_valid())
+
+    def test_new_code_replaces_the_old_one_and_resets_attempts(self):
+        with mock.patch.object(otp, 'generate_otp', side_effect=['111111', '222222']):
+            otp.issue_otp(self.user)
+            self.user.verify_otp('wrong')
+            self.user.verify_otp('wrong')
+            otp.issue_otp(self.user)
+        self.assertFalse(self.user.verify_otp('111111'))
+        self.assertTrue(self.user.verify_otp('222222'))
+
+    @override_settings(OTP_TTL_SECONDS=1)
+    def test_code_expires(self):
+        code = otp.issue_otp(self.user)
+        time.sleep(1.1)
+        self.assertFalse(self.user.is_otp_valid())
+        self.assertFalse(self.user.verify_otp(code))
+
+    def test_legacy_columns_are_cleared(self):
+        CustomUser.objects.filter(pk=self.user.pk).update(otp='123456', otp_created_at=timezone.now())
+        self.assertEqual(otp.clear_legacy_otps(), 1)
+        self.assertFalse(CustomUser.objects.filter(otp__isnull=False).exists())
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class SessionCacheTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.backend = CachedModelBackend()
+
+    def test_repeat_requests_read_no_session_user_or_profile_rows(self):
+        self.client.force_login(self.subadmin_user)
+        self.client.get('/api/houses/')
+        with CaptureQueriesContext(connections['default']) as queries:
+            self.assertEqual(self.client.get('/api/houses/').status_code, 200)
+        tables = ('django_session', CustomUser._meta.db_table, SubAdmin._meta.db_table)
+        self.assertEqual([q['sql'] for q in queries if any(f'"{table}"' in q['sql'] for table in tables)], [])
+
+    def test_cached_user_carries_its_profile(self):
+        self.backend.get_user(self.mistress_user.pk)
+        with self.assertNumQueries(0):
+            user = self.backend.get_user(self.mistress_user.pk)
+            self.assertEqual(user.housemistress_profile.house, self.house)
+
+    def test_saving_the_user_or_a_profile_drops_the_cached_user(self):
+        key = user_cache_key(self.mistress_user.pk)
+        self.backend.get_user(self.mistress_user.pk)
+        HouseMistress.objects.get(user=self.mistress_user).save()
+        self.assertIsNone(cache.get(key))
+
+        self.backend.get_user(self.mistress_user.pk)
+        self.mistress_user.is_active = False
+        self.mistress_user.save()
+        self.assertIsNone(cache.get(key))
+        self.assertIsNone(self.backend.get_user(self.mistress_user.pk))
+
+
+@override_settings(DATABASE_SHARDS=['default', 'shard_1'], DATABASE_REPLICAS=[])
+class ShardRouterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        # School 2 lives on shard_1; the cached map saves a query
+        cache.set(shard_cache_key(2), 'shard_1')
+        self.router = ShardReplicaRouter()
+
+    def route(self, user, path='/api/exeats/'):
+        request = RequestFactory().get(path)
+        request.user = user
+        request._db_routing_state = RoutingState(request)
+        token = _routing_state.set(request._db_routing_state)
+        self.addCleanup(_routing_state.reset, token)
+        return request
+
+    def test_school_data_follows_the_users_school(self):
+        self.route(CustomUser(pk=1, username='mistress', role='house_mistress', school_id=2))
+        self.assertEqual(self.router.db_for_read(Exeat), 'shard_1')
+        self.assertEqual(self.router.db_for_write(Student), 'shard_1')
+        # Reference data stays on the primary
+        self.assertEqual(self.router.db_for_write(School), 'default')
+        self.assertEqual(self.router.db_for_read(CustomUser), 'default')
+
+    def test_staff_pick_a_school_with_school_id(self):
+        self.route(CustomUser(pk=1, username='admin', role='admin', is_staff=True), '/api/exeats/?school_id=2')
+        self.assertEqual(self.router.db_for_read(Exeat), 'shard_1')
+
+    def test_pinned_school_and_use_shard_override_the_user(self):
+        request = self.route(CustomUser(pk=1, username='admin', role='admin', is_staff=True))
+        self.assertEqual(self.router.db_for_read(Exeat), 'default')
+        pin_school(request, 2)
+        self.assertEqual(self.router.db_for_read(Exeat), 'shard_1')
+        with use_shard('default'):
+            self.assertEqual(self.router.db_for_write(Exeat), 'default')
+
+    def test_saved_instances_stay_on_their_own_shard(self):
+        exeat = Exeat(pk=1)
+        exeat._state.db = 'shard_1'
+        self.assertEqual(self.router.db_for_write(Exeat, instance=exeat), 'shard_1')
+
+
+@unittest.skipUnless('shard_1' in settings.DATABASES, 'needs a second shard (set DB_SHARD_HOSTS)')
+class ShardMoveTests(TransactionTestCase):
+    """move_school_shard end to end over a real second shard"""
+    databases = '__all__'
+
+    def setUp(self):
+        make_school(self)
+        Exeat.objects.filter(pk=self.exeat.pk).update(status='approved')
+        client_for(self.security_user).post(f'/api/exeats/{self.exeat.pk}/sign_out/')
+
+    def test_requests_follow_the_school_after_a_move(self):
+        call_command('move_school_shard', self.school.pk, 'shard_1', stdout=io.StringIO())
+        self.assertFalse(Exeat.objects.using('default').exists())
+        self.assertEqual(Exeat.objects.using('shard_1').get().status, 'signed_out')
+        self.assertEqual(OffCampusEntry.objects.using('shard_1').count(), 1)
+
+        response = client_for(self.mistress_user).get('/api/exeats/')
+        self.assertEqual([exeat['id'] for exeat in response.data], [self.exeat.pk])
+        response = client_for(self.security_user).post(f'/api/exeats/{self.exeat.pk}/sign_in/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Exeat.objects.using('shard_1').get().status, 'signed_in')
+        self.assertFalse(OffCampusEntry.objects.using('shard_1').exists())
+        self.assertEqual(ExeatEvent.objects.using('shard_1').filter(kind='signed_in').count(), 1)
+
+
+@override_settings(DATABASE_REPLICAS=[], GATE_SYNC_SETTLE_SECONDS=0)
+class GateManifestTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        self.security = client_for(self.security_user)
+        self.mistress = client_for(self.mistress_user)
+        self.mistress.post(f'/api/exeats/{self.exeat.pk}/approve/')
+        now = timezone.now()
+        # Approved, but not for today
+        Exeat.objects.create(
+            school=self.school, student=self.student, reason='Later', status='approved',
+            start_date=now + timedelta(days=7), end_date=now + timedelta(days=8)
+        )
+        self.other = Exeat.objects.create(
+            school=self.school, student=make_student(self.school, self.house2, '002'), reason='Visit',
+            start_date=now, end_date=now + timedelta(days=1)
+        )
+        self.subadmin = client_for(self.subadmin_user)
+        self.subadmin.post(f'/api/exeats/{self.other.pk}/approve/')
+
+    def manifest(self):
+        response = self.security.get('/api/gate/manifest/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        header, *entries = [json.loads(line) for line in gzip.decompress(response.content).splitlines()]
+        return response, header, entries
+
+    def test_manifest_lists_the_days_gate_exeats(self):
+        response, header, entries = self.manifest()
+        self.assertEqual(header['count'], 2)
+        self.assertEqual([entry['exeat_id'] for entry in entries], [self.exeat.pk, self.other.pk])
+        exeat = Exeat.objects.get(pk=self.exeat.pk)
+        self.assertEqual(entries[0]['pass_token'], pass_token(exeat.pk, exeat.start_date, exeat.end_date))
+        self.assertEqual(entries[0]['student_number'], '001')
+
+        again = self.security.get('/api/gate/manifest/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        # Served from the cache
+        with self.assertNumQueries(0):
+            get_manifest(self.school, timezone.localdate())
+
+    def test_delta_brings_a_device_up_to_date(self):
+        response, _, _ = self.manifest()
+        version = int(response['X-Manifest-Version'])
+        self.security.post(f'/api/exeats/{self.exeat.pk}/sign_out/')
+        self.subadmin.post(f'/api/exeats/{self.other.pk}/reject/')
+
+        delta = self.security.get('/api/gate/manifest/delta/', {'version': version}).data
+        self.assertEqual([(e['exeat_id'], e['status']) for e in delta['upserts']], [(self.exeat.pk, 'signed_out')])
+        self.assertEqual(delta['removed'], [self.other.pk])
+        self.assertFalse(delta['has_more'])
+
+        caught_up = self.security.get('/api/gate/manifest/delta/', {'version': delta['version']}).data
+        self.assertEqual((caught_up['upserts'], caught_up['removed']), ([], []))
+
+    def test_delta_pages_through_events(self):
+        version = int(self.manifest()[0]['X-Manifest-Version'])
+        self.security.post(f'/api/exeats/{self.exeat.pk}/sign_out/')
+        self.subadmin.post(f'/api/exeats/{self.other.pk}/reject/')
+        first = manifest_delta(self.school, timezone.localdate(), version, limit=1)
+        self.assertTrue(first['has_more'])
+        second = manifest_delta(self.school, timezone.localdate(), first['version'], limit=1)
+        self.assertEqual((first['upserts'][0]['exeat_id'], second['removed']), (self.exeat.pk, [self.other.pk]))
+
+    def test_delta_needs_a_version(self):
+        self.assertEqual(self.security.get('/api/gate/manifest/delta/').status_code, 400)
+
+
+class ORJSONTests(SimpleTestCase):
+    data = {
+        'when': datetime(2026, 5, 1, 12, 30, 15, 123456, tzinfo=dt_timezone.utc),
+        'day': date(2026, 5, 1),
+        'amount': Decimal('2.50'),
+        'id': uuid.UUID('12345678-1234-5678-1234-567812345678'),
+        'names': ['Zoë', 'line\u2028break'],
+        3: None,
+        'nested': [{'ok': True, 'ratio': 0.1}],
+    }
+
+    def test_renders_like_drfs_json_renderer(self):
+        self.assertEqual(ORJSONRenderer().render(self.data), renderers.JSONRenderer().render(self.data))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_parses_json(self):
+        body = ORJSONRenderer().render(self.data)
+        parsed = ORJSONParser().parse(io.BytesIO(body))
+        self.assertEqual(parsed['when'], '2026-05-01T12:30:15.123456Z')
+        self.assertEqual((parsed['amount'], parsed['names'][0], parsed['3']), (2.5, 'Zoë', None))
+
+    def test_bad_json_is_a_parse_error(self):
+        with self.assertRaisesMessage(ParseError, 'JSON parse error'):
+            ORJSONParser().parse(io.BytesIO(b'{bad'))
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class ContentNegotiationTests(TestCase):
+    browser = 'text/html,application/xhtml+xml,*/*;q=0.8'
+
+    def setUp(self):
+        make_school(self)
+
+    def test_browsable_api_is_for_staff_only(self):
+        response = client_for(self.subadmin_user).get('/api/exeats/', HTTP_ACCEPT=self.browser)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+        response = client_for(self.admin).get('/api/exeats/', HTTP_ACCEPT=self.browser)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        # Only the raw data form, no dropdown of every student
+        self.assertNotIn('<select name="student_id"', response.content.decode())
+
+    def test_bad_request_body_is_a_400(self):
+        response = client_for(self.subadmin_user).post('/api/exeats/', b'{bad', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.data['detail'])
+
+
+JOB_CALLS = []
+
+
+def record_job_call(n):
+    JOB_CALLS.append(n)
+    if n < 0:
+        raise RuntimeError(f'failed {n}')
+
+
+jobs.register('tests.record', record_job_call, max_attempts=2)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        JOB_CALLS.clear()
+        Job.objects.all().delete()
+
+    def test_claims_the_highest_priority_due_job_first(self):
+        low = jobs.enqueue('tests.record', n=1)
+        high = jobs.enqueue('tests.record', n=2, priority=9)
+        jobs.enqueue('tests.record', n=3, delay=3600)
+        self.assertEqual([jobs.claim('w1').pk, jobs.claim('w1').pk, jobs.claim('w1')], [high.pk, low.pk, None])
+        high.refresh_from_db()
+        self.assertEqual((high.status, high.attempts, high.locked_by), ('running', 1, 'w1'))
+
+    def test_failed_job_is_retried_later_then_left_failed(self):
+        job = jobs.enqueue('tests.record', n=-1)
+        with self.assertLogs('exeat_app.jobs', 'ERROR'):
+            jobs.run(jobs.claim('w1'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('queued', 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn('failed -1', job.last_error)
+        self.assertIsNone(jobs.claim('w1'))
+
+        with self.assertLogs('exeat_app.jobs', 'ERROR'):
+            jobs.run(jobs.claim('w1', now=job.run_at))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, JOB_CALLS), ('failed', 2, [-1, -1]))
+
+    @override_settings(JOB_RETRY_BASE_SECONDS=10, JOB_RETRY_MAX_SECONDS=60)
+    def test_retry_delay_doubles_up_to_the_cap(self):
+        for attempts, full in ((1, 10), (3, 40), (10, 60)):
+            self.assertTrue(full / 2 <= jobs.retry_delay(attempts) <= full)
+
+    def test_jobs_of_a_dead_worker_are_requeued_or_failed(self):
+        long_ago = timezone.now() - timedelta(hours=2)
+        retry = jobs.enqueue('tests.record', n=1)
+        spent = jobs.enqueue('tests.record', n=2)
+        Job.objects.filter(pk=retry.pk).update(status='running', attempts=1, locked_at=long_ago)
+        Job.objects.filter(pk=spent.pk).update(status='running', attempts=2, locked_at=long_ago)
+        self.assertEqual(jobs.requeue_stale(), 1)
+        self.assertEqual(dict(Job.objects.values_list('pk', 'status')), {retry.pk: 'queued', spent.pk: 'failed'})
+
+    def test_periodic_task_keeps_one_queued_run(self):
+        jobs.register('tests.periodic', lambda: None, every=60)
+        self.addCleanup(jobs.TASKS.pop, 'tests.periodic')
+        periodic = Job.objects.filter(name='tests.periodic')
+        jobs.schedule_periodic()
+        jobs.schedule_periodic()
+        self.assertEqual(periodic.count(), 1)
+
+        with mock.patch.object(jobs, 'close_old_connections'):
+            jobs.Worker('w1').run(burst=True)
+        self.assertEqual(list(periodic.values_list('status', flat=True).order_by('pk')), ['done', 'queued'])
+        self.assertGreater(periodic.get(status='queued').run_at, timezone.now() + timedelta(seconds=50))
+
+
+def claim_without_waiting(worker):
+    # Fail rather than hang if claim() ever waits on a locked row
+    with connections['default'].cursor() as cursor:
+        cursor.execute("SET lock_timeout = '5s'")
+    return jobs.claim(worker)
+
+
+class JobClaimConcurrencyTests(TransactionTestCase):
+    def test_workers_skip_jobs_locked_by_another(self):
+        first = jobs.enqueue('tests.record', n=1, priority=9)
+        second = jobs.enqueue('tests.record', n=2)
+        with transaction.atomic():
+            # Another worker is in the middle of claiming the first job
+            Job.objects.select_for_update().get(pk=first.pk)
+            claimed = RunInThreads(claim_without_waiting, ['w2']).results
+        self.assertEqual(claimed[0].pk, second.pk)
+
+
+@override_settings(DATABASE_REPLICAS=[])
+class SchoolRollupTests(TestCase):
+    def setUp(self):
+        make_school(self)
+        now = timezone.now()
+        Exeat.objects.filter(pk=self.exeat.pk).update(status='overdue', signed_out_time=now - timedelta(days=1))
+        Exeat.objects.create(
+            school=self.school, student=make_student(self.school, self.house, '002'), reason='Visit',
+            status='signed_in', start_date=now - timedelta(days=5), end_date=now - timedelta(days=4),
+            signed_out_time=now - timedelta(days=5), signed_in_time=now - timedelta(days=3)
+        )
+        for code in ('C', 'A', 'B'):
+            School.objects.create(name=f'School {code}', code=code, email=f'{code.lower()}@example.com')
+        self.client = client_for(self.admin)
+
+    def rollup(self, **params):
+        response = self.client.get('/api/admin-dashboard/schools/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['data']
+
+    def test_counts_every_school(self):
+        data = self.rollup()
+        self.assertEqual(data['count'], 4)
+        top = data['results'][0]
+        fields = ('school_id', 'total', 'out', 'overdue', 'late', 'departed', 'overdue_rate')
+        self.assertEqual(tuple(top[field] for field in fields), (self.school.pk, 2, 1, 1, 2, 2, 1.0))
+        self.assertEqual({row['total'] for row in data['results'][1:]}, {0})
+
+    def test_since_only_counts_later_exeats(self):
+        since = (timezone.now() - timedelta(days=2)).date()
+        self.assertEqual(self.rollup(since=since, ordering='-total')['results'][0]['total'], 1)
+
+    def test_sorts_and_pages(self):
+        first = self.rollup(ordering='name', page_size=2)
+        second = self.rollup(ordering='name', page_size=2, page=2)
+        self.assertEqual([row['code'] for row in first['results'] + second['results']], ['A', 'B', 'C', 'TS'])
+        self.assertEqual([row['code'] for row in self.rollup(ordering='-code', page_size=1)['results']], ['TS'])
+        self.assertEqual(self.rollup(ordering='name', page=3, page_size=2)['results'], [])
+
+    def test_ties_go_by_school_id(self):
+        rows = [{'school_id': 3, 'total': 1}, {'school_id': 1, 'total': 1}, {'school_id': 2, 'total': 5}]
+        self.assertEqual([row['school_id'] for row in sort_rows(rows, 'total')], [1, 3, 2])
+        self.assertEqual([row['school_id'] for row in sort_rows(rows, '-total')], [2, 1, 3])
+
+    def test_rollup_is_cached(self):
+        school_rollup()
+        with self.assertNumQueries(0):
+            school_rollup()
+
+    def test_bad_parameters_and_non_staff_are_refused(self):
+        self.assertEqual(self.client.get('/api/admin-dashboard/schools/?ordering=bogus').status_code, 400)
+        self.assertEqual(self.client.get('/api/admin-dashboard/schools/?page=0').status_code, 400)
+        self.assertEqual(client_for(self.subadmin_user).get('/api/admin-dashboard/schools/').status_code, 403)
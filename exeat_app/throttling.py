@@ -0,0 +1,143 @@
+"""
+Sliding-window throttles backed by the shared cache.
+
+Each limit of N requests per period counts requests in fixed windows of
+one period, one cache counter per window. A request is allowed while the
+current window's count plus the share of the previous window's count that
+still falls within the last period stays at or below N. That smooths the
+burst a plain fixed window would allow at window boundaries. Counters are
+only changed with cache.add() and cache.incr()/decr(), which are atomic
+on Redis and Memcached, so workers racing on the same key can't both
+spend the last request.
+
+These replace the original token buckets. A bucket's refill is a
+read-modify-write of (tokens, last refill) that Django's cache API can't do
+atomically (there is no compare-and-set), so concurrent requests could
+overwrite each other's spend. The sliding window gives the same smoothed
+rate using nothing but add/incr/decr. Rates come from
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'] using DRF's 'N/period' syntax,
+keyed by the throttle's scope.
+
+Critical views and actions (gate sign out/in and sync, marked with the
+load_priority / action_load_priorities the load shedder uses) are left out
+of the shared ip, user and school budgets and only count against their
+own 'gate' budget, so list polling can never get a gate scan a 429.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+def view_priority(view):
+    """'critical', 'normal' or 'low', as declared on the view for LoadSheddingMiddleware"""
+    priorities = getattr(view, 'action_load_priorities', {})
+    return priorities.get(getattr(view, 'action', None), getattr(view, 'load_priority', 'normal'))
+
+
+class SlidingWindowThrottle(BaseThrottle):
+    scope = None
+    # Whether the throttle counts critical requests (True) or everything else (False)
+    critical = False
+    durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'THROTTLE_CACHE_ALIAS', 'default')]
+        self.capacity, self.period = self.parse_rate(
+            api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        )
+        self.wait_seconds = None
+
+    def parse_rate(self, rate):
+        if rate is None:
+            return (None, None)
+        num, period = rate.split('/')
+        return (int(num), self.durations[period[0]])
+
+    def get_cache_key(self, request, view):
+        """Return the counter key prefix for this request, or None to skip throttling"""
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def _incr(self, key):
+        try:
+            return self.cache.incr(key)
+        except ValueError:
+            # Two periods, so the window is still there while it is the previous one
+            self.cache.add(key, 0, 2 * self.period)
+            return self.cache.incr(key)
+
+    def allow_request(self, request, view):
+        if self.capacity is None or (view_priority(view) == 'critical') != self.critical:
+            return True
+        key = self.get_cache_key(request, view)
+        if key is None:
+            return True
+
+        position = time.time() / self.period
+        window = int(position)
+        elapsed = position - window
+        current_key = f'{key}:{window}'
+        count = self._incr(current_key)
+        previous = self.cache.get(f'{key}:{window - 1}', 0)
+        if previous * (1 - elapsed) + count <= self.capacity:
+            return True
+
+        # Refused requests don't use up the limit
+        self.cache.decr(current_key)
+        count -= 1
+        if previous and count < self.capacity:
+            # Until enough of the previous window has slid out
+            self.wait_seconds = max(0.0, (1 - (self.capacity - count - 1) / previous - elapsed) * self.period)
+        else:
+            self.wait_seconds = (1 - elapsed) * self.period
+        return False
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class IPRateThrottle(SlidingWindowThrottle):
+    """Per client IP, for every request"""
+    scope = 'ip'
+
+    def get_cache_key(self, request, view):
+        return f'throttle:{self.scope}:{self.get_ident(request)}'
+
+
+class UserRateThrottle(SlidingWindowThrottle):
+    """Per authenticated user"""
+    scope = 'user'
+
+    def get_cache_key(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return None
+        return f'throttle:{self.scope}:{request.user.pk}'
+
+
+class SchoolRateThrottle(SlidingWindowThrottle):
+    """Shared by every user of a school, so one tenant cannot starve the rest"""
+    scope = 'school'
+
+    def get_cache_key(self, request, view):
+        school_id = getattr(request.user, 'school_id', None)
+        if school_id is None:
+            return None
+        return f'throttle:{self.scope}:{school_id}'
+
+
+class GateRateThrottle(UserRateThrottle):
+    """Per user budget for critical gate requests, kept apart from the shared budgets"""
+    scope = 'gate'
+    critical = True
+
+
+class PasswordResetThrottle(IPRateThrottle):
+    """Tight per-IP limit for the unauthenticated password reset endpoints"""
+    scope = 'password_reset'
+
+
+class LoginThrottle(IPRateThrottle):
+    """Per-IP limit for token issue/refresh, where passwords are checked"""
+    scope = 'login'
@@ -0,0 +1,91 @@
+"""
+Signed access/refresh tokens.
+
+Tokens are django.core.signing payloads carrying the user's id, role,
+school, house and exeat scope, so they can be verified and scoped with the
+SECRET_KEY alone - no database lookup and no password hash per request. Revoked token ids are
+kept in the cache until the token would have expired anyway.
+"""
+import uuid
+
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+
+from .scoping import exeat_scope
+
+ACCESS_SALT = 'exeat_app.tokens.access'
+REFRESH_SALT = 'exeat_app.tokens.refresh'
+
+
+class InvalidToken(Exception):
+    pass
+
+
+def _cache():
+    return caches[getattr(settings, 'TOKEN_REVOCATION_CACHE_ALIAS', 'default')]
+
+
+def access_lifetime():
+    return getattr(settings, 'ACCESS_TOKEN_LIFETIME', 900)
+
+
+def refresh_lifetime():
+    return getattr(settings, 'REFRESH_TOKEN_LIFETIME', 7 * 86400)
+
+
+def user_claims(user):
+    """Claims describing the user's role, school, house and exeat scope"""
+    kind, value = exeat_scope(user)
+    house_id = value.pk if kind == 'house' else None
+    return {
+        'uid': user.pk,
+        'usr': user.username,
+        'role': user.role,
+        'sch': user.school_id,
+        'hse': house_id,
+        'scp': kind,
+        'stf': user.is_staff,
+        'su': user.is_superuser,
+    }
+
+
+def issue_tokens(user):
+    """Return a fresh access/refresh token pair for the user"""
+    claims = user_claims(user)
+    access = signing.dumps({**claims, 'jti': uuid.uuid4().hex}, salt=ACCESS_SALT)
+    refresh = signing.dumps({'uid': user.pk, 'jti': uuid.uuid4().hex}, salt=REFRESH_SALT)
+    return {
+        'access': access,
+        'refresh': refresh,
+        'token_type': 'Bearer',
+        'expires_in': access_lifetime(),
+    }
+
+
+def _load(token, salt, max_age):
+    try:
+        claims = signing.loads(token, salt=salt, max_age=max_age)
+    except signing.SignatureExpired:
+        raise InvalidToken('Token has expired')
+    except signing.BadSignature:
+        raise InvalidToken('Invalid token')
+    if is_revoked(claims['jti']):
+        raise InvalidToken('Token has been revoked')
+    return claims
+
+
+def verify_access_token(token):
+    return _load(token, ACCESS_SALT, access_lifetime())
+
+
+def verify_refresh_token(token):
+    return _load(token, REFRESH_SALT, refresh_lifetime())
+
+
+def revoke(claims, lifetime):
+    _cache().set(f'token:revoked:{claims["jti"]}', True, lifetime)
+
+
+def is_revoked(jti):
+    return _cache().get(f'token:revoked:{jti}') is not None
@@ -0,0 +1,91 @@
+"""
+Streaming photo uploads.
+
+PhotoUploadHandler writes uploads to a temporary file chunk by chunk while
+hashing them, so the content-addressed storage (storage.py) can name the
+file without reading it again and the upload never sits in memory. Uploads
+over PHOTO_MAX_BYTES are refused from the Content-Length before anything
+is read, and while streaming when the length isn't known. Images larger
+than PHOTO_MAX_DIMENSION are refused as soon as their header arrives.
+validate_photo() applies the same limits to files that bypass the handler.
+"""
+import hashlib
+from io import BytesIO
+
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig, ValidationError
+from django.core.files.images import get_image_dimensions
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from PIL import Image, UnidentifiedImageError
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+def max_photo_bytes():
+    return getattr(settings, 'PHOTO_MAX_BYTES', 5 * 2**20)
+
+
+def max_photo_dimension():
+    return getattr(settings, 'PHOTO_MAX_DIMENSION', 4096)
+
+
+class UploadTooLarge(APIException, RequestDataTooBig):
+    # Also a SuspiciousOperation, so plain Django views (the admin) answer 400
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Upload is too large'
+    default_code = 'upload_too_large'
+
+
+def _too_large_dimensions(width, height):
+    limit = max_photo_dimension()
+    return width > limit or height > limit
+
+
+class PhotoUploadHandler(TemporaryFileUploadHandler):
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        # Leave room for the multipart framing and the other form fields
+        if content_length and content_length > max_photo_bytes() + 64 * 1024:
+            raise UploadTooLarge()
+        return None
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.hash = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > max_photo_bytes():
+            self.upload_interrupted()
+            raise UploadTooLarge()
+        if start == 0 and self.content_type.startswith('image/'):
+            self.check_dimensions(raw_data)
+        self.hash.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def check_dimensions(self, head):
+        try:
+            width, height = Image.open(BytesIO(head)).size
+        except (UnidentifiedImageError, OSError):
+            # Header not in the first chunk; validate_photo() checks the whole file
+            return
+        if _too_large_dimensions(width, height):
+            self.upload_interrupted()
+            raise UploadTooLarge(
+                f'Images may be at most {max_photo_dimension()}x{max_photo_dimension()} pixels'
+            )
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        uploaded.content_hash = self.hash.hexdigest()
+        return uploaded
+
+
+def validate_photo(photo):
+    if photo.size is not None and photo.size > max_photo_bytes():
+        raise ValidationError(f'Photos may be at most {max_photo_bytes() // 2**20} MB')
+    width, height = get_image_dimensions(photo)
+    if width and height and _too_large_dimensions(width, height):
+        raise ValidationError(
+            f'Photos may be at most {max_photo_dimension()}x{max_photo_dimension()} pixels'
+        )
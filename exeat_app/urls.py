@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
@@ -15,6 +16,10 @@ router.register(r'students', views.StudentManagementViewSet, basename='student')
 router.register(r'house-mistresses', views.HouseMistressManagementViewSet, basename='house-mistress')
 router.register(r'security-personnel', views.SecurityPersonManagementViewSet, basename='security-person')
 router.register(r'houses', views.HouseManagementViewSet, basename='house')
+router.register(r'absence-quotas', views.AbsenceQuotaViewSet, basename='absence-quota')
+
+# Reports
+router.register(r'term-reports', views.TermReportViewSet, basename='term-report')
 
 # Exeat Management
 router.register(r'exeats', views.ExeatViewSet, basename='exeat')
@@ -22,9 +27,27 @@ router.register(r'exeats', views.ExeatViewSet, basename='exeat')
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/admin-dashboard/', views.AdminDashboardView.as_view(), name='admin_dashboard'),
+    path('api/admin-dashboard/schools/', views.SchoolRollupView.as_view(), name='school_rollup'),
+    path('api/off-campus/', views.OffCampusRosterView.as_view(), name='off_campus_roster'),
+    path('api/analytics/lateness/', views.LatenessAnalyticsView.as_view(), name='lateness_analytics'),
+    path('api/exeat-campaigns/', views.ExeatCampaignView.as_view(), name='exeat_campaigns'),
+    path('api/gate/sync/', views.GateSyncView.as_view(), name='gate_sync'),
+    path('api/gate/manifest/', views.GateManifestView.as_view(), name='gate_manifest'),
+    path('api/gate/manifest/delta/', views.GateManifestDeltaView.as_view(), name='gate_manifest_delta'),
+    path(f"{settings.MEDIA_URL.strip('/')}/student_photos/<path:name>", views.StudentPhotoView.as_view(),
+         name='student_photo'),
+    path('api/metrics/', views.MetricsView.as_view(), name='metrics'),
+    path('api/profiles/', views.ProfileListView.as_view(), name='profile_list'),
+    path('api/profiles/<str:profile_id>/', views.ProfileDownloadView.as_view(), name='profile_download'),
+    # Live exeat activity (Server-Sent Events, served by the ASGI app)
+    path('api/exeat-events/', views.exeat_event_stream, name='exeat_events'),
     # Custom school endpoints
     path('api/schools/list/', views.SchoolViewSet.as_view({'get': 'list_schools'}), name='list_schools'),
     path('api/schools/create/', views.SchoolViewSet.as_view({'post': 'create_school'}), name='create_school'),
+    # Token authentication
+    path('api/auth/token/', views.TokenObtainAPIView.as_view(), name='token_obtain'),
+    path('api/auth/token/refresh/', views.TokenRefreshAPIView.as_view(), name='token_refresh'),
+    path('api/auth/token/revoke/', views.TokenRevokeAPIView.as_view(), name='token_revoke'),
     # Password reset API endpoints
     path('api/auth/forgot-password/', views.ForgotPasswordAPIView.as_view(), name='forgot_password'),
     path('api/auth/reset-password/', views.PasswordResetConfirmAPIView.as_view(), name='password_reset_confirm'),
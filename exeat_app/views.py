@@ -1,20 +1,48 @@
 from django.contrib.auth import get_user_model, authenticate, login, logout
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
-from django.db import transaction
+from django.utils.dateparse import parse_date
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Q
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from asgiref.sync import sync_to_async
 from rest_framework import viewsets, permissions, status
 from rest_framework.views import APIView
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
 
 from .models import (Exeat, Student, HouseMistress, House, School, 
-                     SubAdmin, SecurityPerson, CustomUser)
+                     SubAdmin, SecurityPerson, CustomUser, OffCampusEntry,
+                     HouseRosterCount, AbsenceQuota, TermReport)
 from .serializers import (
-    ExeatSerializer, StudentSerializer, HouseMistressSerializer, HouseSerializer,
+    AbsenceQuotaSerializer, ExeatCampaignSerializer, GateScanBatchSerializer, TermReportSerializer, TermReportRequestSerializer, ExeatSerializer, StudentSerializer, HouseMistressSerializer, HouseSerializer,
     ForgotPasswordSerializer, PasswordResetSerializer, SchoolSerializer,
-    SubAdminSerializer, SecurityPersonSerializer,
+    SubAdminSerializer, SecurityPersonSerializer, TokenObtainSerializer, TokenRefreshSerializer,
     APIErrorResponseStructureSerializer, APISuccessResponseStructureSerializer
 )
+from .scoping import exeat_scope, scope_exeats, scope_students
+from .storage import get_photo_storage, media_response
+from .db_routing import current_shard, fan_out, pin_school
+from .events import parse_cursor, record_event, scope_shards, stream_events
+from .gate import (InvalidCursor, InvalidTransition, apply_scans, require_status, sign_in_exeat, sign_out_exeat,
+                   sync_changes)
+from .manifest import get_manifest, manifest_delta
+from .campaigns import issue_campaign
+from .conflicts import OVERLAP_ERROR, OverlappingExeat, is_overlap_violation
+from .idempotency import idempotent_response
+from .profiling import list_profiles, profile_path
+from .projection import ProjectedListMixin
+from .provisioning import ProvisioningError, provision_account
+from .quotas import QuotaExceeded, hold_quota, release_quota
+from .reports import request_report
+from .analytics import lateness_report
+from .roster import remove_from_roster
+from .rollup import ORDERINGS as ROLLUP_ORDERINGS, school_rollup, sort_rows
+from .throttling import IPRateThrottle, LoginThrottle, PasswordResetThrottle
+from . import metrics, tokens
 
 import random
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
@@ -46,7 +74,7 @@ class IsAdminOrSubAdmin(permissions.BasePermission):
 
 # ==================== SCHOOL MANAGEMENT ====================
 
-class SchoolViewSet(viewsets.ModelViewSet):
+class SchoolViewSet(ProjectedListMixin, viewsets.ModelViewSet):
     """
     School management - Only accessible to Django admin users
     Allows creating and managing schools
@@ -102,45 +130,19 @@ class SubAdminManagementViewSet(viewsets.ViewSet):
             # Check school exists
             school = get_object_or_404(School, id=school_id)
 
-            # Check if school already has a sub-admin
-            if SubAdmin.objects.filter(school=school).exists():
-                return Response(
-                    {'error': 'This school already has a sub-admin'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Check if username/email already exists
-            CustomUser = get_user_model()
-            if CustomUser.objects.filter(username=username).exists():
-                return Response(
-                    {'error': 'Username already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            if CustomUser.objects.filter(email=email).exists():
-                return Response(
-                    {'error': 'Email already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Create user and sub-admin
-            with transaction.atomic():
-                user = CustomUser.objects.create_user(
-                    username=username,
-                    email=email,
-                    password=password,
-                    first_name=first_name,
-                    last_name=last_name,
-                    role='subadmin',
-                    school=school,
-                    is_staff=False  # Sub-admin is not Django staff
-                )
-
-                sub_admin = SubAdmin.objects.create(
-                    user=user,
-                    school=school,
-                    phone=phone
-                )
+            # Duplicates (username, email, a second sub-admin) are caught by constraints
+            sub_admin = provision_account(
+                SubAdmin, school, 'subadmin',
+                user={
+                    'username': username,
+                    'email': email,
+                    'password': password,
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'is_staff': False,  # Sub-admin is not Django staff
+                },
+                profile={'phone': phone}
+            )
 
             return Response(
                 {
@@ -150,6 +152,11 @@ class SubAdminManagementViewSet(viewsets.ViewSet):
                 status=status.HTTP_201_CREATED
             )
 
+        except ProvisioningError as e:
+            return Response(
+                {'error': e.message, 'field': e.field},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -163,6 +170,8 @@ class SubAdminManagementViewSet(viewsets.ViewSet):
 class ForgotPasswordAPIView(APIView):
     """Accepts an email and returns a uid/token for password reset (or sends email)."""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [PasswordResetThrottle, IPRateThrottle]
+    load_priority = 'low'
 
     def post(self, request):
         serializer = ForgotPasswordSerializer(data=request.data)
@@ -184,6 +193,8 @@ class ForgotPasswordAPIView(APIView):
 class PasswordResetConfirmAPIView(APIView):
     """Accepts uid, token and new_password to reset the user's password."""
     permission_classes = [permissions.AllowAny]
+    throttle_classes = [PasswordResetThrottle, IPRateThrottle]
+    load_priority = 'low'
 
     def post(self, request):
         from .serializers import PasswordResetConfirmSerializer
@@ -207,9 +218,79 @@ class PasswordResetConfirmAPIView(APIView):
         return Response({'detail': 'Password reset successful'}, status=status.HTTP_200_OK)
 
 
+# ==================== TOKEN AUTH API ====================
+
+
+class TokenObtainAPIView(APIView):
+    """
+    Exchange username/password for a short-lived access token and a refresh
+    token. This is the only request that pays for a password hash check.
+    """
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    throttle_classes = [LoginThrottle, IPRateThrottle]
+
+    def post(self, request):
+        serializer = TokenObtainSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        user = authenticate(
+            request,
+            username=serializer.validated_data['username'],
+            password=serializer.validated_data['password']
+        )
+        if user is None:
+            return Response({'error': 'Invalid username or password'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        return Response(tokens.issue_tokens(user), status=status.HTTP_200_OK)
+
+
+class TokenRefreshAPIView(APIView):
+    """Rotate a refresh token: the old one is revoked and a new pair issued"""
+    permission_classes = [permissions.AllowAny]
+    authentication_classes = []
+    throttle_classes = [LoginThrottle, IPRateThrottle]
+
+    def post(self, request):
+        serializer = TokenRefreshSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            claims = tokens.verify_refresh_token(serializer.validated_data['refresh'])
+        except tokens.InvalidToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_401_UNAUTHORIZED)
+
+        # Reload the user so role/school changes are picked up on refresh
+        user = User.objects.filter(pk=claims['uid'], is_active=True).first()
+        if user is None:
+            return Response({'error': 'User not found or inactive'}, status=status.HTTP_401_UNAUTHORIZED)
+
+        tokens.revoke(claims, tokens.refresh_lifetime())
+        return Response(tokens.issue_tokens(user), status=status.HTTP_200_OK)
+
+
+class TokenRevokeAPIView(APIView):
+    """Log out: revoke the refresh token and the access token used for this call"""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = TokenRefreshSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            claims = tokens.verify_refresh_token(serializer.validated_data['refresh'])
+        except tokens.InvalidToken as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if claims['uid'] != request.user.pk:
+            return Response({'error': 'Token does not belong to this user'}, status=status.HTTP_403_FORBIDDEN)
+
+        tokens.revoke(claims, tokens.refresh_lifetime())
+        if isinstance(request.auth, dict) and 'jti' in request.auth:
+            tokens.revoke(request.auth, tokens.access_lifetime())
+        return Response({'detail': 'Tokens revoked'}, status=status.HTTP_200_OK)
+
+
 # ==================== STUDENT MANAGEMENT ====================
 
-class StudentManagementViewSet(viewsets.ModelViewSet):
+class StudentManagementViewSet(ProjectedListMixin, viewsets.ModelViewSet):
     """
     Student management - Sub-admins can add students to their school
     """
@@ -255,53 +336,26 @@ class StudentManagementViewSet(viewsets.ModelViewSet):
                 school = get_object_or_404(School, id=school_id)
             else:
                 school = request.user.subadmin_profile.school
-
-            # Check if student_id already exists in school
-            if Student.objects.filter(school=school, student_id=student_id).exists():
-                return Response(
-                    {'error': 'Student ID already exists in this school'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Check if username/email exists
-            if User.objects.filter(username=username).exists():
-                return Response(
-                    {'error': 'Username already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            if User.objects.filter(email=email).exists():
-                return Response(
-                    {'error': 'Email already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Create user and student
-            with transaction.atomic():
-                user = User.objects.create_user(
-                    username=username,
-                    email=email,
-                    password=password
-                )
-                user.customuser.role = 'student'
-                user.customuser.school = school
-                user.customuser.save()
-
-                house = None
-                if house_id:
-                    house = get_object_or_404(House, id=house_id, school=school)
-
-                student = Student.objects.create(
-                    user=user,
-                    school=school,
-                    student_id=student_id,
-                    name=name,
-                    email=email,
-                    phone=phone,
-                    house=house,
-                    guardian_name=guardian_name,
-                    guardian_phone=guardian_phone
-                )
+            pin_school(request, school.id)
+
+            house = None
+            if house_id:
+                house = get_object_or_404(House, id=house_id, school=school)
+
+            # Duplicates (username, email, student ID) are caught by constraints
+            student = provision_account(
+                Student, school, 'student',
+                user={'username': username, 'email': email, 'password': password},
+                profile={
+                    'student_id': student_id,
+                    'name': name,
+                    'email': email,
+                    'phone': phone,
+                    'house': house,
+                    'guardian_name': guardian_name,
+                    'guardian_phone': guardian_phone,
+                }
+            )
 
             return Response(
                 {
@@ -311,6 +365,11 @@ class StudentManagementViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_201_CREATED
             )
 
+        except ProvisioningError as e:
+            return Response(
+                {'error': e.message, 'field': e.field},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -320,7 +379,7 @@ class StudentManagementViewSet(viewsets.ModelViewSet):
 
 # ==================== HOUSE MISTRESS MANAGEMENT ====================
 
-class HouseMistressManagementViewSet(viewsets.ModelViewSet):
+class HouseMistressManagementViewSet(ProjectedListMixin, viewsets.ModelViewSet):
     """
     House Mistress management - Sub-admins can add house mistresses to their school
     """
@@ -363,49 +422,17 @@ class HouseMistressManagementViewSet(viewsets.ModelViewSet):
                 school = get_object_or_404(School, id=school_id)
             else:
                 school = request.user.subadmin_profile.school
+            pin_school(request, school.id)
 
             # Get house and verify it belongs to the school
             house = get_object_or_404(House, id=house_id, school=school)
 
-            # Check if house already has a mistress
-            if HouseMistress.objects.filter(house=house).exists():
-                return Response(
-                    {'error': 'This house already has a mistress'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Check if username/email exists
-            if User.objects.filter(username=username).exists():
-                return Response(
-                    {'error': 'Username already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            if User.objects.filter(email=email).exists():
-                return Response(
-                    {'error': 'Email already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Create user and house mistress
-            with transaction.atomic():
-                user = User.objects.create_user(
-                    username=username,
-                    email=email,
-                    password=password
-                )
-                user.customuser.role = 'house_mistress'
-                user.customuser.school = school
-                user.customuser.save()
-
-                house_mistress = HouseMistress.objects.create(
-                    user=user,
-                    school=school,
-                    name=name,
-                    email=email,
-                    phone=phone,
-                    house=house
-                )
+            # Duplicates (username, email, a second mistress) are caught by constraints
+            house_mistress = provision_account(
+                HouseMistress, school, 'house_mistress',
+                user={'username': username, 'email': email, 'password': password},
+                profile={'name': name, 'email': email, 'phone': phone, 'house': house}
+            )
 
             return Response(
                 {
@@ -415,6 +442,11 @@ class HouseMistressManagementViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_201_CREATED
             )
 
+        except ProvisioningError as e:
+            return Response(
+                {'error': e.message, 'field': e.field},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -424,7 +456,7 @@ class HouseMistressManagementViewSet(viewsets.ModelViewSet):
 
 # ==================== SECURITY PERSONNEL MANAGEMENT ====================
 
-class SecurityPersonManagementViewSet(viewsets.ModelViewSet):
+class SecurityPersonManagementViewSet(ProjectedListMixin, viewsets.ModelViewSet):
     """
     Security Personnel management - Sub-admins can add security staff to their school
     """
@@ -467,39 +499,14 @@ class SecurityPersonManagementViewSet(viewsets.ModelViewSet):
                 school = get_object_or_404(School, id=school_id)
             else:
                 school = request.user.subadmin_profile.school
+            pin_school(request, school.id)
 
-            # Check if username/email exists
-            if User.objects.filter(username=username).exists():
-                return Response(
-                    {'error': 'Username already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            if User.objects.filter(email=email).exists():
-                return Response(
-                    {'error': 'Email already exists'},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-
-            # Create user and security person
-            with transaction.atomic():
-                user = User.objects.create_user(
-                    username=username,
-                    email=email,
-                    password=password
-                )
-                user.customuser.role = 'security'
-                user.customuser.school = school
-                user.customuser.save()
-
-                security_person = SecurityPerson.objects.create(
-                    user=user,
-                    school=school,
-                    name=name,
-                    email=email,
-                    phone=phone,
-                    employee_id=employee_id
-                )
+            # Duplicates (username, email) are caught by constraints
+            security_person = provision_account(
+                SecurityPerson, school, 'security',
+                user={'username': username, 'email': email, 'password': password},
+                profile={'name': name, 'email': email, 'phone': phone, 'employee_id': employee_id}
+            )
 
             return Response(
                 {
@@ -509,6 +516,11 @@ class SecurityPersonManagementViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_201_CREATED
             )
 
+        except ProvisioningError as e:
+            return Response(
+                {'error': e.message, 'field': e.field},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         except Exception as e:
             return Response(
                 {'error': str(e)},
@@ -518,7 +530,7 @@ class SecurityPersonManagementViewSet(viewsets.ModelViewSet):
 
 # ==================== HOUSE MANAGEMENT ====================
 
-class HouseManagementViewSet(viewsets.ModelViewSet):
+class HouseManagementViewSet(ProjectedListMixin, viewsets.ModelViewSet):
     """
     House management - Sub-admins can create houses for their school
     """
@@ -557,6 +569,7 @@ class HouseManagementViewSet(viewsets.ModelViewSet):
                 school = get_object_or_404(School, id=school_id)
             else:
                 school = request.user.subadmin_profile.school
+            pin_school(request, school.id)
 
             # Check if house name already exists in school
             if House.objects.filter(school=school, name=name).exists():
@@ -586,30 +599,166 @@ class HouseManagementViewSet(viewsets.ModelViewSet):
             )
 
 
-# ==================== EXEAT MANAGEMENT ====================
+# ==================== ABSENCE QUOTAS ====================
 
-class ExeatViewSet(viewsets.ModelViewSet):
+class AbsenceQuotaViewSet(ProjectedListMixin, viewsets.ModelViewSet):
     """
-    Exeat management and approval
+    Absence quotas - Sub-admins cap how many students of a house (or of the
+    whole school, with no house_id) can be out at once
     """
-    serializer_class = ExeatSerializer
-    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = AbsenceQuotaSerializer
+    permission_classes = [IsAdminOrSubAdmin]
 
     def get_queryset(self):
         user = self.request.user
         if user.is_staff:
-            return Exeat.objects.all()
+            return AbsenceQuota.objects.all()
         elif hasattr(user, 'subadmin_profile'):
-            school = user.subadmin_profile.school
-            return Exeat.objects.filter(school=school)
-        elif hasattr(user, 'housemistress_profile'):
-            house = user.housemistress_profile.house
-            return Exeat.objects.filter(student__house=house)
-        elif hasattr(user, 'security_profile'):
-            school = user.security_profile.school
-            return Exeat.objects.filter(school=school)
+            return AbsenceQuota.objects.filter(school=user.subadmin_profile.school)
+        return AbsenceQuota.objects.none()
+
+    def perform_create(self, serializer):
+        if self.request.user.is_staff:
+            school_id = self.request.data.get('school_id')
+            if not school_id:
+                raise ValidationError({'school_id': 'Admin must specify school_id'})
+            school = get_object_or_404(School, id=school_id)
+            pin_school(self.request, school.id)
         else:
-            return Exeat.objects.filter(student__user=user)
+            school = self.request.user.subadmin_profile.school
+
+        house = serializer.validated_data.get('house')
+        if house is not None and house.school_id != school.id:
+            raise ValidationError({'house_id': 'House does not belong to this school'})
+        if AbsenceQuota.objects.filter(school=school, house=house).exists():
+            raise ValidationError({'error': 'A quota already exists for this house'})
+        serializer.save(school=school)
+
+    def perform_update(self, serializer):
+        # The quota's house is fixed once created; only the capacity changes
+        serializer.validated_data.pop('house', None)
+        serializer.save()
+
+
+# ==================== TERM REPORTS ====================
+
+class TermReportViewSet(ProjectedListMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Per-student term reports - built in the background and stored, so each
+    school/term/format is generated once
+    """
+    serializer_class = TermReportSerializer
+    permission_classes = [IsAdminOrSubAdmin]
+    load_priority = 'low'
+
+    def get_queryset(self):
+        user = self.request.user
+        if user.is_staff:
+            return TermReport.objects.all()
+        elif hasattr(user, 'subadmin_profile'):
+            return TermReport.objects.filter(school=user.subadmin_profile.school)
+        return TermReport.objects.none()
+
+    @action(detail=False, methods=['post'])
+    def generate(self, request):
+        """Request a report; returns it straight away when it has already been built"""
+        serializer = TermReportRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if request.user.is_staff:
+            school_id = request.data.get('school_id')
+            if not school_id:
+                return Response(
+                    {'error': 'Admin must specify school_id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            school = get_object_or_404(School, id=school_id)
+            pin_school(request, school.id)
+        else:
+            school = request.user.subadmin_profile.school
+
+        report = request_report(
+            school, data['term_start'], data['term_end'], data['format'],
+            user=request.user, refresh=data['refresh']
+        )
+        return Response(
+            {
+                'message': 'Report ready' if report.status == 'ready' else 'Report is being generated',
+                'data': TermReportSerializer(report, context={'request': request}).data
+            },
+            status=status.HTTP_200_OK if report.status == 'ready' else status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Stream the report file, or 202 while it is still being built"""
+        report = self.get_object()
+        if report.status == 'failed':
+            return Response(
+                {'error': f'Report generation failed: {report.error}'},
+                status=status.HTTP_409_CONFLICT
+            )
+        if report.status != 'ready':
+            response = Response(
+                {'message': 'Report is being generated', 'status': report.status},
+                status=status.HTTP_202_ACCEPTED
+            )
+            response['Retry-After'] = '5'
+            return response
+        return FileResponse(report.file.open('rb'), as_attachment=True, filename=report.file.name.rsplit('/', 1)[-1])
+
+
+# ==================== EXEAT MANAGEMENT ====================
+
+class ExeatViewSet(ProjectedListMixin, viewsets.ModelViewSet):
+    """
+    Exeat management and approval
+    """
+    serializer_class = ExeatSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    # Gate actions are never shed; list polling is shed first under load
+    action_load_priorities = {'sign_out': 'critical', 'sign_in': 'critical', 'list': 'low'}
+
+    def get_queryset(self):
+        return scope_exeats(Exeat.objects.all(), exeat_scope(self.request.user))
+
+    def create(self, request, *args, **kwargs):
+        """Create an exeat; retries carrying the same Idempotency-Key get the first response"""
+        return idempotent_response(request, lambda: self.create_exeat(request, *args, **kwargs))
+
+    def create_exeat(self, request, *args, **kwargs):
+        try:
+            return super().create(request, *args, **kwargs)
+        except OverlappingExeat:
+            return Response({'error': OVERLAP_ERROR}, status=status.HTTP_409_CONFLICT)
+
+    def perform_create(self, serializer):
+        try:
+            with transaction.atomic(using=current_shard()):
+                serializer.save()
+        except IntegrityError as exc:
+            if is_overlap_violation(exc):
+                raise OverlappingExeat() from exc
+            raise
+
+    def perform_update(self, serializer):
+        try:
+            with transaction.atomic(using=serializer.instance._state.db):
+                exeat = serializer.save()
+                record_event(exeat, 'updated', actor=self.request.user)
+        except IntegrityError as exc:
+            if is_overlap_violation(exc):
+                raise OverlappingExeat() from exc
+            raise
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=instance._state.db):
+            release_quota(instance)
+            remove_from_roster(instance)
+            # Gate devices learn about the removal from this event
+            record_event(instance, 'deleted', actor=self.request.user)
+            instance.delete()
 
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
@@ -630,9 +779,24 @@ class ExeatViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        exeat.status = 'approved'
-        exeat.approved_by = user
-        exeat.save()
+        try:
+            with transaction.atomic(using=exeat._state.db):
+                # Students already out or back keep their status (and roster entry)
+                require_status(exeat, ('pending', 'rejected'), 'Only pending or rejected exeats can be approved')
+                hold_quota(exeat)
+                exeat.status = 'approved'
+                exeat.approved_by = user
+                exeat.save()
+                record_event(exeat, 'approved', actor=user)
+        except InvalidTransition as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except QuotaExceeded as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
+        except IntegrityError as exc:
+            # Re-approving a rejected exeat can collide with a newer one
+            if not is_overlap_violation(exc):
+                raise
+            return Response({'error': OVERLAP_ERROR}, status=status.HTTP_409_CONFLICT)
 
         return Response({
             'message': 'Exeat approved successfully',
@@ -658,8 +822,16 @@ class ExeatViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        exeat.status = 'rejected'
-        exeat.save()
+        try:
+            with transaction.atomic(using=exeat._state.db):
+                # Signed out students are on the roster; they can only be signed in
+                require_status(exeat, ('pending', 'approved'), 'Only pending or approved exeats can be rejected')
+                release_quota(exeat)
+                exeat.status = 'rejected'
+                exeat.save()
+                record_event(exeat, 'rejected', actor=user)
+        except InvalidTransition as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
         return Response({
             'message': 'Exeat rejected successfully',
@@ -679,16 +851,13 @@ class ExeatViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        if exeat.status != 'approved':
-            return Response(
-                {'error': 'Only approved exeats can be signed out'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        exeat.status = 'signed_out'
-        exeat.signed_out_by = user
-        exeat.signed_out_time = timezone.now()
-        exeat.save()
+        # The status is checked again under the row lock, so parallel sign outs can't both pass
+        try:
+            sign_out_exeat(exeat, user)
+        except InvalidTransition as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        except QuotaExceeded as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_409_CONFLICT)
 
         return Response({
             'message': 'Student signed out successfully',
@@ -708,44 +877,205 @@ class ExeatViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
 
-        if exeat.status != 'signed_out':
+        try:
+            sign_in_exeat(exeat, user)
+        except InvalidTransition as exc:
+            return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'message': 'Student signed in successfully',
+            'data': ExeatSerializer(exeat).data
+        })
+
+
+class ExeatCampaignView(APIView):
+    """
+    Issue an exeat to every student in a school, some of its houses or a
+    list of students in one request (set-based, see campaigns.py)
+    """
+    permission_classes = [IsAdminOrSubAdmin]
+
+    def post(self, request):
+        return idempotent_response(request, lambda: self.issue(request))
+
+    def issue(self, request):
+        serializer = ExeatCampaignSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+
+        if request.user.is_staff:
+            school_id = request.data.get('school_id')
+            if not school_id:
+                return Response(
+                    {'error': 'Admin must specify school_id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            school = get_object_or_404(School, id=school_id)
+            pin_school(request, school.id)
+        else:
+            school = request.user.subadmin_profile.school
+
+        for field, model in (('house_ids', House), ('student_ids', Student)):
+            requested = set(data.get(field) or [])
+            if not requested:
+                continue
+            unknown = requested - set(model.objects.filter(school=school, pk__in=requested).values_list('pk', flat=True))
+            if unknown:
+                return Response(
+                    {'error': f'Not in this school: {sorted(unknown)}', 'field': field},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        summary = issue_campaign(
+            school, request.user, data['reason'], data['start_date'], data['end_date'],
+            house_ids=data.get('house_ids'), student_ids=data.get('student_ids'), approve=data['approve'],
+        )
+        return Response({
+            "status": 201,
+            "message": f"Issued {summary['created']} exeats",
+            "data": summary,
+        }, status=status.HTTP_201_CREATED)
+
+
+# ==================== GATE SYNC ====================
+
+def _gate_school(request):
+    """The school a gate request acts for, or an error Response"""
+    user = request.user
+    if hasattr(user, 'security_profile'):
+        school = user.security_profile.school
+    elif user.is_staff:
+        school_id = request.query_params.get('school_id')
+        if not school_id:
             return Response(
-                {'error': 'Only signed out exeats can be signed in'},
+                {'error': 'Admin must specify school_id'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        school = get_object_or_404(School, id=school_id)
+    else:
+        return Response(
+            {'error': 'Only security personnel can use gate sync'},
+            status=status.HTTP_403_FORBIDDEN
+        )
+    pin_school(request, school.id)
+    return school
+
+
+class GateSyncView(APIView):
+    """
+    Offline gate devices: GET pulls exeats changed since ?cursor= (all
+    gate-relevant exeats without one), POST uploads scans made offline
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    # Gates must keep working under load
+    load_priority = 'critical'
 
-        exeat.status = 'signed_in'
-        exeat.signed_in_by = user
-        exeat.signed_in_time = timezone.now()
-        exeat.save()
+    def get(self, request):
+        school = _gate_school(request)
+        if isinstance(school, Response):
+            return school
+        try:
+            changes = sync_changes(school, request.query_params.get('cursor'))
+        except InvalidCursor:
+            return Response(
+                {'error': 'Invalid sync cursor; sync again without one'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(changes)
 
+    def post(self, request):
+        school = _gate_school(request)
+        if isinstance(school, Response):
+            return school
+        serializer = GateScanBatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = apply_scans(school, request.user, serializer.validated_data['scans'])
         return Response({
-            'message': 'Student signed in successfully',
-            'data': ExeatSerializer(exeat).data
+            'applied': sum(1 for r in results if r['result'] == 'applied' and not r['duplicate']),
+            'conflicts': sum(1 for r in results if r['result'] == 'conflict'),
+            'results': results,
         })
 
 
+class GateManifestView(APIView):
+    """
+    The day's gate manifest (?date=YYYY-MM-DD, default today) as gzipped
+    NDJSON; send If-None-Match with the ETag to skip an unchanged download
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    load_priority = 'critical'
+
+    def get(self, request):
+        school = _gate_school(request)
+        if isinstance(school, Response):
+            return school
+        day = _date_param(request, 'date') or timezone.localdate()
+        manifest = get_manifest(school, day)
+        etag = f'"{school.id}-{day.isoformat()}-{manifest["version"]}"'
+        if request.headers.get('If-None-Match') == etag:
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(manifest['content'], content_type='application/x-ndjson')
+            response['Content-Encoding'] = 'gzip'
+        response['ETag'] = etag
+        response['X-Manifest-Version'] = str(manifest['version'])
+        return response
+
+
+class GateManifestDeltaView(APIView):
+    """Changes to a day's manifest since ?version= (the manifest's X-Manifest-Version)"""
+    permission_classes = [permissions.IsAuthenticated]
+    load_priority = 'critical'
+
+    def get(self, request):
+        school = _gate_school(request)
+        if isinstance(school, Response):
+            return school
+        day = _date_param(request, 'date') or timezone.localdate()
+        try:
+            version = int(request.query_params['version'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'version must be the manifest version'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(manifest_delta(school, day, version))
+
+
+def _exeat_status_counts(exeats):
+    """Total and per-status exeat counts in a single aggregate query"""
+    return exeats.aggregate(
+        total=Count('id'),
+        **{key: Count('id', filter=Q(status=key))
+           for key in ('approved', 'rejected', 'pending', 'signed_out', 'signed_in')}
+    )
+
+
 class AdminDashboardView(APIView):
     """
     Admin/SubAdmin dashboard showing exeat statistics
     """
     permission_classes = [IsAdminOrSubAdmin]
+    load_priority = 'low'
+    use_read_replica = True
 
     def get(self, request):
         if request.user.is_staff:
-            exeats = Exeat.objects.all()
+            # Schools are spread over the shards: count on each in parallel and add up
             school_name = "All Schools"
+            per_shard = fan_out(lambda alias: _exeat_status_counts(Exeat.objects.using(alias)))
+            counts = {key: sum(c[key] or 0 for c in per_shard) for key in per_shard[0]}
         else:
             school = request.user.subadmin_profile.school
-            exeats = Exeat.objects.filter(school=school)
             school_name = school.name
+            counts = _exeat_status_counts(Exeat.objects.filter(school=school))
 
-        total_exeats = exeats.count()
-        approved_exeats = exeats.filter(status='approved').count()
-        rejected_exeats = exeats.filter(status='rejected').count()
-        pending_exeats = exeats.filter(status='pending').count()
-        signed_out_exeats = exeats.filter(status='signed_out').count()
-        signed_in_exeats = exeats.filter(status='signed_in').count()
+        total_exeats = counts['total'] or 0
+        approved_exeats = counts['approved'] or 0
+        rejected_exeats = counts['rejected'] or 0
+        pending_exeats = counts['pending'] or 0
+        signed_out_exeats = counts['signed_out'] or 0
+        signed_in_exeats = counts['signed_in'] or 0
 
         response_data = {
             "status": 200,
@@ -762,3 +1092,254 @@ class AdminDashboardView(APIView):
         }
 
         return Response(response_data, status=status.HTTP_200_OK)
+
+
+def _date_param(request, name):
+    """Optional YYYY-MM-DD query parameter"""
+    value = request.query_params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_date(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: 'Must be a YYYY-MM-DD date'})
+    return parsed
+
+
+def _int_param(request, name, default, maximum=None):
+    """Optional positive integer query parameter"""
+    value = request.query_params.get(name)
+    if not value:
+        return default
+    if not value.isdigit() or int(value) < 1:
+        raise ValidationError({name: 'Must be a positive integer'})
+    return min(int(value), maximum) if maximum else int(value)
+
+
+class SchoolRollupView(APIView):
+    """
+    Exeat counts, students out and overdue rate for every school in one
+    response, sortable and paginated (staff only)
+    """
+    permission_classes = [IsAdmin]
+    load_priority = 'low'
+    use_read_replica = True
+
+    def get(self, request):
+        ordering = request.query_params.get('ordering', '-overdue_rate')
+        if ordering.lstrip('-') not in ROLLUP_ORDERINGS:
+            raise ValidationError({'ordering': f"Must be one of {', '.join(ROLLUP_ORDERINGS)} (prefix - for descending)"})
+        page = _int_param(request, 'page', 1)
+        page_size = _int_param(request, 'page_size', 50, maximum=500)
+
+        rows = sort_rows(school_rollup(_date_param(request, 'since')), ordering)
+        start = (page - 1) * page_size
+        return Response({
+            "status": 200,
+            "message": "Per-school exeat rollup",
+            "data": {
+                "count": len(rows),
+                "page": page,
+                "page_size": page_size,
+                "ordering": ordering,
+                "results": rows[start:start + page_size],
+            }
+        }, status=status.HTTP_200_OK)
+
+
+class LatenessAnalyticsView(APIView):
+    """
+    Lateness distribution, outlier students and houses, and a departure
+    heatmap for a school, optionally limited to a term (cached)
+    """
+    permission_classes = [IsAdminOrSubAdmin]
+    load_priority = 'low'
+    use_read_replica = True
+
+    def get(self, request):
+        if request.user.is_staff:
+            school_id = request.query_params.get('school_id')
+            if not school_id:
+                return Response(
+                    {'error': 'Admin must specify school_id'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            school = get_object_or_404(School, id=school_id)
+        else:
+            school = request.user.subadmin_profile.school
+
+        term_start = _date_param(request, 'term_start')
+        term_end = _date_param(request, 'term_end')
+
+        return Response({
+            "status": 200,
+            "message": f"Lateness analytics for {school.name}",
+            "data": lateness_report(school.id, term_start, term_end),
+        })
+
+
+class OffCampusRosterView(APIView):
+    """
+    Students currently off campus and counts per house, read from the
+    materialized roster rather than the Exeat table
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    load_priority = 'low'
+    use_read_replica = True
+
+    def get(self, request):
+        kind, value = exeat_scope(request.user)
+        if kind == 'student':
+            return Response(
+                {'error': 'Not authorized to view the off campus roster'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+
+        entries = OffCampusEntry.objects.all()
+        counts = HouseRosterCount.objects.filter(off_campus__gt=0)
+        if kind == 'school':
+            entries = entries.filter(school=value)
+            counts = counts.filter(school=value)
+        elif kind == 'house':
+            entries = entries.filter(house=value)
+            counts = counts.filter(house=value)
+        elif request.query_params.get('school_id'):
+            entries = entries.filter(school_id=request.query_params['school_id'])
+            counts = counts.filter(school_id=request.query_params['school_id'])
+
+        house_id = request.query_params.get('house_id')
+        if house_id:
+            entries = entries.filter(house_id=house_id)
+            counts = counts.filter(house_id=house_id)
+
+        counts = list(counts.values('school_id', 'house_id', 'off_campus', 'overdue'))
+        house_names = dict(
+            House.objects.filter(id__in=[c['house_id'] for c in counts if c['house_id']])
+            .values_list('id', 'name')
+        )
+        for count in counts:
+            count['house_name'] = house_names.get(count['house_id'])
+
+        students = list(entries.values(
+            'exeat_id', 'student_id', 'student_number', 'student_name', 'school_id',
+            'house_id', 'signed_out_time', 'end_date', 'is_overdue'
+        ))
+
+        return Response({
+            "status": 200,
+            "message": "Students currently off campus",
+            "data": {
+                "total": sum(c['off_campus'] for c in counts),
+                "overdue": sum(c['overdue'] for c in counts),
+                "houses": counts,
+                "students": students,
+            }
+        }, status=status.HTTP_200_OK)
+
+
+# ==================== MEDIA ====================
+
+class StudentPhotoView(APIView):
+    """
+    Student photos (content-addressed, so cached for a year). Only served
+    when a student the caller can see has the photo; otherwise 404.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, name):
+        path = f'student_photos/{name}'
+        scope = exeat_scope(request.user)
+        if scope[0] == 'all':
+            # Staff aren't tied to a shard; the photo's student may be on any
+            visible = any(fan_out(lambda alias: Student.objects.using(alias).filter(photo=path).exists()))
+        else:
+            visible = scope_students(Student.objects.filter(photo=path), scope).exists()
+        if not visible:
+            raise Http404
+        return media_response(get_photo_storage(), path)
+
+
+# ==================== METRICS ====================
+
+class MetricsView(APIView):
+    """Counters and gauges from exeat_app.metrics (staff only)"""
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response({
+            "status": 200,
+            "message": "Metrics",
+            "data": metrics.snapshot(),
+        }, status=status.HTTP_200_OK)
+
+
+class ProfileListView(APIView):
+    """Recent request profiles taken with X-Profile (staff only)"""
+    permission_classes = [IsAdmin]
+
+    def get(self, request):
+        return Response({
+            "status": 200,
+            "message": "Request profiles",
+            "data": list_profiles(),
+        }, status=status.HTTP_200_OK)
+
+
+class ProfileDownloadView(APIView):
+    """One profile's collapsed stacks, for flamegraph.pl or speedscope (staff only)"""
+    permission_classes = [IsAdmin]
+
+    def get(self, request, profile_id):
+        path = profile_path(profile_id)
+        if path is None:
+            return Response({'error': 'Profile not found'}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(path, 'rb'), as_attachment=True,
+                            filename=f'{profile_id}.collapsed', content_type='text/plain')
+
+
+# ==================== LIVE EXEAT EVENTS ====================
+
+def _authenticate_stream(request):
+    """Run the DRF authenticators and resolve the caller's exeat scope"""
+    drf_request = Request(
+        request,
+        authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    )
+    user = drf_request.user
+    if not user.is_authenticated:
+        return None
+    return exeat_scope(user)
+
+
+async def exeat_event_stream(request):
+    """
+    Server-Sent Events feed of approvals, sign outs, sign ins and overdue
+    exeats, scoped like the exeat list. Needs the ASGI app to hold
+    connections open cheaply.
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    scope = await sync_to_async(_authenticate_stream)(request)
+    if scope is None:
+        return JsonResponse(
+            {'error': 'Authentication credentials were not provided.'},
+            status=status.HTTP_401_UNAUTHORIZED
+        )
+
+    last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        aliases = await sync_to_async(scope_shards)(scope)
+        last_event_id = parse_cursor(last_event_id, aliases)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid Last-Event-ID'}, status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        stream_events(scope, last_event_id),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response